@@ -1,5 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
-from typing import Dict, Any
+from fastapi.responses import StreamingResponse
+from typing import Dict, Any, AsyncIterator
+import json
 
 from app.services.ai_analysis import ai_analysis_service, AnalysisRequest
 from app.models.user import User
@@ -13,5 +15,23 @@ async def analyze_statistics(request: AnalysisRequest):
     try:
         result = await ai_analysis_service.generate_analysis(request)  # 添加await关键字
         return result
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/stream")
+async def analyze_statistics_stream(request: AnalysisRequest):
+    """
+    以SSE流式返回AI分析报告：meta（是否命中缓存/共享上游调用）、
+    reasoning（推理过程）、delta（报告内容片段）、最后为 done 或 error。
+    """
+    async def generate() -> AsyncIterator[str]:
+        async for event in ai_analysis_service.stream_analysis(request):
+            yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,15 +1,23 @@
 import os
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends
+from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
-from app.core.database import get_db
+from app.core.database import get_db, async_session_maker
 from app.services.detector import detector
-from app.models.detection import Detection
+from app.services.inference import inference_engine
+from app.services.inference_pool import inference_pool
+from app.services.cache import detection_cache
+from app.services.statistics import statistics_service
+from app.services.persistence import insert_detections
 from app.models.user import User
-from app.core.users import current_active_user
-from typing import List
+from app.core.users import cached_active_user
+from typing import List, Dict, Tuple, AsyncIterator
 import time
-import base64
+import asyncio
+import json
+import shutil
+import tempfile
 
 # 确保目录存在
 os.makedirs(os.path.join("app", "static", "uploads"), exist_ok=True)
@@ -17,61 +25,94 @@ os.makedirs(os.path.join("app", "static", "annotated"), exist_ok=True)
 
 router = APIRouter()
 
+def _content_names(filename: str, key: str) -> Tuple[str, str]:
+    """按内容摘要生成上传文件名和标注文件名，相同图片重复上传不会覆盖或重复写入"""
+    ext = os.path.splitext(filename)[1].lower() or ".jpg"
+    return f"{key}{ext}", f"{key}.jpg"
+
+def _write_once(directory: str, name: str, data: bytes):
+    """内容寻址文件已存在时跳过写入"""
+    file_path = os.path.join("app", "static", directory, name)
+    if os.path.exists(file_path):
+        return
+    with open(file_path, "wb") as f:
+        f.write(data)
+
+def _save_upload(image_bytes: bytes, upload_name: str):
+    """保存上传的原始文件"""
+    _write_once("uploads", upload_name, image_bytes)
+
+def _detection_item(filename: str, upload_name: str, annotated_name: str, predictions: List[Dict]) -> Dict:
+    """构造单个文件的检测结果（无检测结果时不生成标注图像）"""
+    return {
+        "filename": filename,
+        "predictions": predictions,
+        "image_path": f"/uploads/{upload_name}",
+        "annotated_path": f"/annotated/{annotated_name}" if predictions else None,
+        "annotated_image": f"/api/static/annotated/{annotated_name}" if predictions else None
+    }
+
+async def _restore_cached(cached: Dict, image_bytes: bytes, upload_name: str, annotated_name: str):
+    """缓存命中时确保对应的静态文件存在（例如在另一台机器上产生的缓存）"""
+    await asyncio.to_thread(_save_upload, image_bytes, upload_name)
+    if cached["annotated"]:
+        await asyncio.to_thread(_write_once, "annotated", annotated_name, cached["annotated"])
+
+async def _detect_and_annotate(image_bytes: bytes, filename: str) -> Dict:
+    """
+    单次解码、单次推理的检测流程：
+    先查内容寻址缓存；未命中时解码得到BGR/RGB图像 → 推理引擎预测 →
+    在BGR图像上原地标注并直接编码写入文件，最后写入缓存。
+    """
+    key = detection_cache.key(image_bytes)
+    upload_name, annotated_name = _content_names(filename, key)
+
+    cached = await detection_cache.get(key)
+    if cached is not None:
+        await _restore_cached(cached, image_bytes, upload_name, annotated_name)
+        return _detection_item(filename, upload_name, annotated_name, cached["predictions"])
+
+    await asyncio.to_thread(_save_upload, image_bytes, upload_name)
+    img_bgr, img_rgb = await asyncio.to_thread(detector.decode_for_inference, image_bytes)
+    predictions = await inference_engine.predict(img_rgb)
+
+    # 生成标注图像 (只有在有检测结果时才生成)
+    annotated = None
+    if predictions:
+        annotated_path = os.path.join("app", "static", "annotated", annotated_name)
+        annotated = await asyncio.to_thread(detector.save_annotated, img_bgr, predictions, annotated_path)
+    await detection_cache.set(key, predictions, annotated)
+    return _detection_item(filename, upload_name, annotated_name, predictions)
+
 @router.post("/upload")
 async def upload_image(
     file: UploadFile = File(...),
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(current_active_user)
+    current_user: User = Depends(cached_active_user)
 ):
     try:
         # 读取图片字节流
         start_time = time.time()
         image_bytes = await file.read()
-        
-        # 保存上传的文件
-        file_path = os.path.join("app", "static", "uploads", file.filename)
-        with open(file_path, "wb") as f:
-            f.write(image_bytes)
-        
-        # 执行预测
-        predictions = detector.predict(image_bytes)
-        
-        # 生成标注图像 (只有在有检测结果时才生成)
-        annotated_image = None
-        annotated_path = None
-        if predictions:
-            # 获取base64图像
-            annotated_base64 = detector.annotate_image(image_bytes, predictions)
-            # 删除data:image/jpeg;base64,前缀
-            base64_data = annotated_base64.replace("data:image/jpeg;base64,", "")
-            # 解码base64为二进制
-            annotated_image_bytes = base64.b64decode(base64_data)
-            # 保存标注图像
-            annotated_path = os.path.join("app", "static", "annotated", file.filename)
-            with open(annotated_path, "wb") as f:
-                f.write(annotated_image_bytes)
-            
-            # 用于返回的图像URL
-            annotated_image = f"/api/static/annotated/{file.filename}"
-        
+
+        try:
+            item = await _detect_and_annotate(image_bytes, file.filename)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"无法处理图像: {str(e)}")
+        predictions = item["predictions"]
+
         # 保存到数据库 (无论是否检测到都保存记录)
-        new_detection = Detection(
-            image_path=f"/uploads/{file.filename}",
-            annotated_path=f"/annotated/{file.filename}" if annotated_image else None,
-            results=predictions,
-            created_at=datetime.now(),
-            user_id=current_user.id
-        )
-        db.add(new_detection)
+        await insert_detections(db, [_detection_row(item, current_user.id)])
         await db.commit()
-        
+        await statistics_service.invalidate()
+
         # 构造返回结果，增加状态标识
         return {
             "status": "success" if predictions else "no_detection",
             "message": "检测成功" if predictions else "未检测到害虫，请尝试其他图片",
             "time_cost": round(time.time() - start_time, 3),
             "results": predictions,
-            "annotated_image": f"/api/static/annotated/{file.filename}" if annotated_image else None
+            "annotated_image": item["annotated_image"]
         }
     except HTTPException:
         raise
@@ -79,92 +120,231 @@ async def upload_image(
         print(f"服务器内部错误: {str(e)}")
         raise HTTPException(status_code=500, detail=f"内部错误: {str(e)}")
 
+async def _detect_in_process(items: List[Tuple[bytes, str, str]]) -> AsyncIterator[Dict]:
+    """进程内批量模式：先全部解码，再按形状分组进行真正的批量推理，按输入顺序产出结果"""
+    decoded = []
+    for image_bytes, upload_name, annotated_name in items:
+        try:
+            await asyncio.to_thread(_save_upload, image_bytes, upload_name)
+            img_bgr, img_rgb = await asyncio.to_thread(detector.decode_for_inference, image_bytes)
+            decoded.append((annotated_name, img_bgr, img_rgb, None))
+        except Exception as e:
+            decoded.append((annotated_name, None, None, str(e)))
+
+    valid = [item for item in decoded if item[3] is None]
+    batch_predictions = await inference_engine.predict_many([item[2] for item in valid])
+    predictions_by_item = {id(item): predictions for item, predictions in zip(valid, batch_predictions)}
+
+    for item in decoded:
+        annotated_name, img_bgr, _, error = item
+        if error is not None:
+            yield {"error": error}
+            continue
+        try:
+            predictions = predictions_by_item[id(item)]
+            # 生成标注图像 (只有在有检测结果时才生成)
+            annotated = None
+            if predictions:
+                annotated_path = os.path.join("app", "static", "annotated", annotated_name)
+                annotated = await asyncio.to_thread(detector.save_annotated, img_bgr, predictions, annotated_path)
+            yield {"predictions": predictions, "annotated": annotated}
+        except Exception as e:
+            yield {"error": str(e)}
+
+async def _detect_files(items: List[Tuple[bytes, str]]) -> AsyncIterator[Dict]:
+    """
+    批量检测：缓存命中的文件直接返回，未命中的文件根据配置交给多进程或进程内批量推理，
+    结果按上传顺序产出。
+    """
+    entries = []
+    misses = []
+    for image_bytes, filename in items:
+        key = detection_cache.key(image_bytes)
+        upload_name, annotated_name = _content_names(filename, key)
+        cached = await detection_cache.get(key)
+        entries.append((image_bytes, filename, key, upload_name, annotated_name, cached))
+        if cached is None:
+            misses.append((image_bytes, upload_name, annotated_name))
+
+    backend = inference_pool.process(misses) if inference_pool.enabled else _detect_in_process(misses)
+    for image_bytes, filename, key, upload_name, annotated_name, cached in entries:
+        if cached is not None:
+            await _restore_cached(cached, image_bytes, upload_name, annotated_name)
+            yield _detection_item(filename, upload_name, annotated_name, cached["predictions"])
+            continue
+        output = await backend.__anext__()
+        if "error" in output:
+            yield {"filename": filename, "error": output["error"]}
+            continue
+        await detection_cache.set(key, output["predictions"], output["annotated"])
+        yield _detection_item(filename, upload_name, annotated_name, output["predictions"])
+
+def _result_entry(item: Dict) -> Dict:
+    """将单个文件的处理结果转换为响应格式，包含检测状态信息"""
+    if "error" in item:
+        return {
+            "filename": item["filename"],
+            "status": "error",
+            "message": item["error"],
+            "error": item["error"]
+        }
+    predictions = item["predictions"]
+    return {
+        "filename": item["filename"],
+        "status": "success" if predictions else "no_detection",
+        "message": "检测成功" if predictions else "未检测到害虫",
+        "predictions": predictions,
+        "annotated_image": item["annotated_image"]
+    }
+
+def _detection_row(item: Dict, user_id: int) -> Dict:
+    """构造用于批量插入的检测记录"""
+    return {
+        "image_path": item["image_path"],
+        "annotated_path": item["annotated_path"],
+        "results": item["predictions"],
+        "created_at": datetime.now(),
+        "user_id": user_id  # 关联当前用户ID
+    }
+
+def _detection_stats(results: List[Dict]) -> Dict[str, int]:
+    """统计检测结果"""
+    return {
+        "detected": sum(1 for item in results if item.get("status") == "success"),
+        "not_detected": sum(1 for item in results if item.get("status") == "no_detection"),
+        "errors": sum(1 for item in results if item.get("status") == "error")
+    }
+
 @router.post("/upload-multiple")
 async def upload_multiple_images(
     files: List[UploadFile] = File(...),
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(current_active_user)  # 添加用户依赖
+    current_user: User = Depends(cached_active_user)  # 添加用户依赖
 ):
     if not files:
         raise HTTPException(status_code=400, detail="未提供文件")
-    
+
     start_time = time.time()
     results = []
-    
-    for file in files:
-        try:
-            # 读取图片字节流
-            image_bytes = await file.read()
-            
-            # 保存上传的文件
-            file_path = os.path.join("app", "static", "uploads", file.filename)
-            with open(file_path, "wb") as f:
-                f.write(image_bytes)
-            
-            # 执行预测
-            predictions = detector.predict(image_bytes)
-            
-            # 生成标注图像 (只有在有检测结果时才生成)
-            annotated_image = None
-            annotated_path = None
-            if predictions:
-                # 获取base64图像
-                annotated_base64 = detector.annotate_image(image_bytes, predictions)
-                # 删除data:image/jpeg;base64,前缀
-                base64_data = annotated_base64.replace("data:image/jpeg;base64,", "")
-                # 解码base64为二进制
-                annotated_image_bytes = base64.b64decode(base64_data)
-                
-                # 保存标注图像
-                annotated_path = os.path.join("app", "static", "annotated", file.filename)
-                with open(annotated_path, "wb") as f:
-                    f.write(annotated_image_bytes)
-                
-                annotated_image = f"/api/static/annotated/{file.filename}"
-            
-            # 保存到数据库
-            new_detection = Detection(
-                image_path=f"/uploads/{file.filename}",
-                annotated_path=f"/annotated/{file.filename}" if annotated_image else None,
-                results=predictions,
-                created_at=datetime.now(),
-                user_id=current_user.id  # 关联当前用户ID
-            )
-            db.add(new_detection)
-            
-            # 添加到结果列表，包含检测状态信息
-            results.append({
-                "filename": file.filename,
-                "status": "success" if predictions else "no_detection",
-                "message": "检测成功" if predictions else "未检测到害虫",
-                "predictions": predictions,
-                "annotated_image": f"/api/static/annotated/{file.filename}" if annotated_image else None
-            })
-        except Exception as e:
-            # 记录单个文件处理失败，但继续处理其他文件
-            results.append({
-                "filename": file.filename,
-                "status": "error",
-                "message": str(e),
-                "error": str(e)
-            })
-    
-    # 提交所有数据库更改
+    detection_rows = []
+
+    items = [(await file.read(), file.filename) for file in files]
+    async for item in _detect_files(items):
+        results.append(_result_entry(item))
+        # 单个文件处理失败不影响其他文件，数据库写入在最后一次性批量完成
+        if "error" not in item:
+            detection_rows.append(_detection_row(item, current_user.id))
+
+    # 一次性批量写入所有检测记录
+    await insert_detections(db, detection_rows)
     await db.commit()
-    
-    # 统计检测结果
-    detection_count = sum(1 for item in results if item.get("status") == "success")
-    no_detection_count = sum(1 for item in results if item.get("status") == "no_detection")
-    error_count = sum(1 for item in results if item.get("status") == "error")
-    
+    await statistics_service.invalidate()
+
     return {
         "status": "success",
         "time_cost": round(time.time() - start_time, 3),
         "processed_count": len(results),
-        "detection_stats": {
-            "detected": detection_count,
-            "not_detected": no_detection_count,
-            "errors": error_count
-        },
+        "detection_stats": _detection_stats(results),
         "results": results
-    }
\ No newline at end of file
+    }
+
+def _spool_upload(file: UploadFile) -> str:
+    """将上传文件分块复制到临时文件，响应流开始后请求表单会被关闭"""
+    file.file.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, prefix="yolopest_upload_") as tmp:
+        shutil.copyfileobj(file.file, tmp, 1024 * 1024)
+        return tmp.name
+
+def _read_and_remove(path: str) -> bytes:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.unlink(path)
+
+def _format_record(record: Dict, fmt: str) -> str:
+    """按NDJSON或SSE格式编码单条记录"""
+    data = json.dumps(record, ensure_ascii=False)
+    if fmt == "sse":
+        return f"event: {record['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+@router.post("/upload-multiple/stream")
+async def upload_multiple_images_stream(
+    files: List[UploadFile] = File(...),
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+    window: int = Query(8, ge=1, le=64, description="同时在内存中处理的图片数量"),
+    current_user: User = Depends(cached_active_user)
+):
+    """
+    批量检测的流式版本：每处理完一张图片立即输出一条记录，
+    每个窗口结束后输出一条进度记录，最后输出汇总记录。
+    内存占用只与窗口大小有关，与文件总数无关。
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="未提供文件")
+
+    # 先把上传内容转存到磁盘，生成器中按窗口读取
+    spooled = [(await asyncio.to_thread(_spool_upload, file), file.filename) for file in files]
+    user_id = current_user.id
+    total = len(spooled)
+
+    async def generate() -> AsyncIterator[str]:
+        start_time = time.time()
+        stats = {"detected": 0, "not_detected": 0, "errors": 0}
+        stats_keys = {"success": "detected", "no_detection": "not_detected", "error": "errors"}
+        processed = 0
+        try:
+            async with async_session_maker() as db:
+                for offset in range(0, total, window):
+                    chunk = spooled[offset:offset + window]
+                    items = []
+                    for path, filename in chunk:
+                        try:
+                            items.append((await asyncio.to_thread(_read_and_remove, path), filename))
+                        except OSError:
+                            # 读取失败时交给检测流程产生错误记录
+                            items.append((b"", filename))
+
+                    detection_rows = []
+                    async for item in _detect_files(items):
+                        entry = _result_entry(item)
+                        stats[stats_keys[entry["status"]]] += 1
+                        if "error" not in item:
+                            detection_rows.append(_detection_row(item, user_id))
+                        processed += 1
+                        yield _format_record({"type": "result", "index": processed - 1, **entry}, format)
+
+                    # 每个窗口写入一次数据库
+                    if detection_rows:
+                        await insert_detections(db, detection_rows)
+                        await db.commit()
+                        await statistics_service.invalidate()
+
+                    yield _format_record({
+                        "type": "progress",
+                        "processed": processed,
+                        "total": total,
+                        "progress": int(processed / total * 100)
+                    }, format)
+
+            yield _format_record({
+                "type": "summary",
+                "status": "success",
+                "time_cost": round(time.time() - start_time, 3),
+                "processed_count": processed,
+                "detection_stats": stats
+            }, format)
+        finally:
+            # 客户端中途断开时清理尚未处理的临时文件
+            for path, _ in spooled:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(generate(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+@router.get("/engine-stats")
+async def get_engine_stats(user: User = Depends(cached_active_user)):
+    """获取推理引擎的队列深度与批次大小统计，以及检测缓存命中情况"""
+    return {**inference_engine.stats(), "cache": detection_cache.stats()}
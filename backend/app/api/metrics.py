@@ -0,0 +1,36 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from typing import Dict, Any
+from app.core.database import engine, replica_engine, pool_stats
+from app.core.user_cache import user_cache
+from app.core.metrics import render_prometheus
+from app.services.ai_analysis import ai_analysis_service
+from app.services.video import video_processor
+
+router = APIRouter()
+
+@router.get("/db", response_model=Dict[str, Any])
+async def get_db_pool_metrics():
+    """获取数据库连接池状态：已借出连接数、获取连接的等待时间、溢出连接和超时次数"""
+    metrics = {"primary": pool_stats(engine)}
+    if replica_engine is not engine:
+        metrics["replica"] = pool_stats(replica_engine)
+    return metrics
+
+@router.get("/user-cache", response_model=Dict[str, Any])
+async def get_user_cache_metrics():
+    """获取鉴权用户缓存的命中情况"""
+    return user_cache.stats()
+
+@router.get("/ai", response_model=Dict[str, Any])
+async def get_ai_metrics():
+    """获取AI分析上游调用的并发、排队等待和延迟分布"""
+    return ai_analysis_service.stats()
+
+async def prometheus_metrics():
+    """以Prometheus文本格式导出所有指标（在 main.py 中挂载到 /metrics）"""
+    try:
+        await video_processor.refresh_queue_metrics()
+    except Exception as e:
+        print(f"读取视频队列长度失败: {str(e)}")
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -2,6 +2,8 @@ from fastapi import APIRouter
 from app.api import detection  # 修正导入路径
 from app.api.api import api_router as user_api_router  # 导入用户API路由
 from app.api import ai_analysis  # 添加这一行，导入AI分析路由
+from app.api import statistics
+from app.api import metrics
 
 router = APIRouter()
 
@@ -14,5 +16,11 @@ router.include_router(detection.router, prefix="/detection", tags=["Detection"])
 # 包括AI分析路由
 router.include_router(ai_analysis.router, prefix="/ai-analysis", tags=["AI-Analysis"])
 
+# 包括统计路由
+router.include_router(statistics.router, prefix="/statistics", tags=["Statistics"])
+
+# 包括运行指标路由
+router.include_router(metrics.router, prefix="/metrics", tags=["Metrics"])
+
 # 包括新的用户API
 router.include_router(user_api_router, prefix="")
\ No newline at end of file
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+
+from app.core.database import get_read_db
+from app.core.users import cached_active_user
+from app.models.user import User
+from app.services.statistics import statistics_service
+
+router = APIRouter()
+
+@router.get("/", response_model=Dict[str, Any])
+async def get_statistics(
+    startTime: Optional[int] = Query(None, description="起始时间（JS毫秒时间戳）"),
+    endTime: Optional[int] = Query(None, description="结束时间（JS毫秒时间戳）"),
+    source: str = Query("history", pattern="^(history|detections|video)$", description="统计数据来源"),
+    interval: str = Query("day", pattern="^(day|week|month)$", description="趋势数据的时间粒度"),
+    compare: bool = Query(False, description="是否同时返回上一个等长周期的数据"),
+    db: AsyncSession = Depends(get_read_db),
+    user: User = Depends(cached_active_user)
+):
+    """
+    获取害虫检测统计数据（总数、类别分布和时间趋势），基于按天汇总的数据，默认统计最近30天。
+    普通用户只统计自己的记录，管理员统计所有记录。
+    """
+    # 未指定结束时间时取整到下一分钟，使相同请求在一分钟内可以命中缓存
+    default_end = datetime.now().replace(second=0, microsecond=0) + timedelta(minutes=1)
+    end = datetime.fromtimestamp(endTime / 1000) if endTime else default_end
+    start = datetime.fromtimestamp(startTime / 1000) if startTime else end - timedelta(days=30)
+    user_id = None if user.is_superuser else user.id
+    return await statistics_service.get_statistics(db, start, end, source, interval, compare, user_id)
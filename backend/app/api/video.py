@@ -1,27 +1,80 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
+from typing import Optional
+from app.core.config import get_settings
 from app.services.video import video_processor
+from app.services.video_upload import iter_upload
+from app.services.video_tracking import VIDEO_MODES, TRACKER_CONFIGS
+from app.services.video_pipeline import SAMPLING_MODES, DECODE_MODES
+
+settings = get_settings()
 
 router = APIRouter()
 
-@router.post("/process-async")
-async def process_video_async(file: UploadFile = File(...)):
-    """异步处理视频文件"""
+# 请求体由接口自行流式解析，这里只用于生成接口文档
+UPLOAD_REQUEST_BODY = {
+    "required": True,
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "properties": {"file": {"type": "string", "format": "binary"}},
+                "required": ["file"]
+            }
+        }
+    }
+}
+
+@router.post("/process-async", openapi_extra={"requestBody": UPLOAD_REQUEST_BODY})
+async def process_video_async(
+    request: Request,
+    mode: str = Query("detect", description="detect 逐帧检测；track 跟踪并按目标计数"),
+    tracker: Optional[str] = Query(None, description="跟踪器类型：bytetrack / botsort"),
+    detect_interval: Optional[int] = Query(None, ge=1, le=30, description="跟踪模式下每隔N个采样帧检测一次"),
+    sampling: Optional[str] = Query(None, description="帧采样方式：fixed 固定步长 / adaptive 自适应"),
+    decode: Optional[str] = Query(None, description="解码方式：full / grab / seek / keyframes"),
+    seek_interval: Optional[float] = Query(None, gt=0, le=3600, description="seek 模式的采样间隔（秒）")
+):
+    """异步处理视频文件（multipart/form-data 的 file 字段）"""
+    if mode not in VIDEO_MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的处理模式: {mode}")
+    if tracker is not None and tracker not in TRACKER_CONFIGS:
+        raise HTTPException(status_code=400, detail=f"不支持的跟踪器类型: {tracker}")
+    if sampling is not None and sampling not in SAMPLING_MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的采样方式: {sampling}")
+    if decode is not None and decode not in DECODE_MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的解码方式: {decode}")
+    options = {"mode": mode}
+    if tracker is not None:
+        options["tracker"] = tracker
+    if detect_interval is not None:
+        options["detect_interval"] = detect_interval
+    if sampling is not None:
+        options["sampling"] = sampling
+    if decode is not None:
+        options["decode"] = decode
+    if seek_interval is not None:
+        options["seek_interval"] = seek_interval
     try:
-        # 读取视频文件
-        video_bytes = await file.read()
-        
-        # 文件大小检查 (可选，限制为100MB)
-        if len(video_bytes) > 100 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail="视频文件过大，请限制在100MB以内")
+        # 边接收请求体边写入共享目录，不经过临时文件，超出大小限制时立即中止；随后只校验文件头
+        try:
+            upload = await video_processor.save_upload(
+                iter_upload(request, "file", settings.video_max_upload_bytes)
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
         # 创建异步处理任务
-        task_id = await video_processor.create_task(video_bytes)
+        task_id = await video_processor.create_task(
+            upload["video_path"], options, size=upload["size"], content_hash=upload["content_hash"]
+        )
         
         return {
             "status": "success",
             "task_id": task_id,
             "message": "视频已提交处理，请使用任务ID查询结果"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
@@ -37,11 +90,20 @@ async def get_video_status(task_id: str):
     return status
 
 @router.get("/result/{task_id}")
-async def get_video_result(task_id: str):
-    """获取视频处理结果"""
+async def get_video_result(
+    task_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    start_ms: Optional[int] = Query(None, ge=0, description="起始时间（毫秒，含）"),
+    end_ms: Optional[int] = Query(None, ge=0, description="结束时间（毫秒，含）")
+):
+    """获取视频处理结果，逐帧检测结果按时间范围分页返回"""
     result = await video_processor.get_task_result(task_id)
     if result.get("status") == "not_found":
         raise HTTPException(status_code=404, detail="任务不存在")
     if result.get("status") in ["pending", "processing"]:
         return {"status": result["status"], "progress": result.get("progress", 0)}
-    return result
\ No newline at end of file
+    if result.get("status") != "success":
+        return result
+    page = await video_processor.get_frame_results(task_id, offset, limit, start_ms, end_ms)
+    return {**result, **page}
@@ -1,19 +1,167 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, AsyncEngine
+from sqlalchemy import event
 from sqlalchemy.orm import sessionmaker
-from typing import AsyncGenerator
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from typing import AsyncGenerator, Dict, Any, Optional
 from app.core.config import get_settings
+from app.core.metrics import histogram, gauge
+import threading
+import time
 import logging
 
 settings = get_settings()
 # 使用大写变量名以保持一致性
 DATABASE_URL = settings.DATABASE_URL
 
-engine = create_async_engine(DATABASE_URL)
+logger = logging.getLogger(__name__)
+
+DB_QUERY_LATENCY = histogram(
+    "db_query_seconds",
+    "数据库语句执行耗时",
+    labelnames=("engine", "statement")
+)
+DB_POOL_WAIT = histogram("db_pool_wait_seconds", "从连接池获取连接的等待时间", labelnames=("engine",))
+
+class PoolMetrics:
+    """连接池指标：获取连接的等待时间、溢出连接和超时次数"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.overflow_events = 0
+        self.timeouts = 0
+
+    def record_checkout(self, wait: float, overflowed: bool):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if overflowed:
+                self.overflow_events += 1
+
+    def record_timeout(self, wait: float):
+        with self._lock:
+            self.timeouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """记录每次从连接池获取连接耗时的队列连接池"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+        self.label = "primary"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        overflow_before = self._overflow
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record_timeout(time.perf_counter() - start)
+            raise
+        # 本次获取新建了超出 pool_size 的连接
+        overflowed = self._overflow > overflow_before and self._overflow > 0
+        wait = time.perf_counter() - start
+        self.metrics.record_checkout(wait, overflowed)
+        DB_POOL_WAIT.observe(wait, engine=self.label)
+        return connection
+
+def _instrument_queries(target: AsyncEngine, label: str):
+    """按语句类型（SELECT/INSERT/...）记录执行耗时"""
+    sync_engine = target.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("query_start")
+        if not starts:
+            return
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        DB_QUERY_LATENCY.observe(time.perf_counter() - starts.pop(), engine=label, statement=kind)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        # 出错时丢弃未完成的计时，避免下一条语句错用
+        connection = context.connection
+        if connection is not None and connection.info.get("query_start"):
+            connection.info["query_start"].pop()
+
+def build_engine(url: str, label: str = "primary") -> AsyncEngine:
+    """按配置创建带连接池参数和监控的异步引擎"""
+    connect_args: Dict[str, Any] = {}
+    if "+asyncpg" in url:
+        # 前者为 SQLAlchemy 适配层的预编译语句缓存，后者为 asyncpg 自身的语句缓存
+        connect_args["prepared_statement_cache_size"] = settings.db_statement_cache_size
+        connect_args["statement_cache_size"] = settings.db_statement_cache_size
+    target = create_async_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        connect_args=connect_args
+    )
+    target.pool.label = label
+    _instrument_queries(target, label)
+    return target
+
+def pool_stats(target: AsyncEngine) -> Dict[str, Any]:
+    """连接池当前状态与累计指标"""
+    pool = target.pool
+    stats: Dict[str, Any] = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": settings.db_max_overflow
+    }
+    metrics: Optional[PoolMetrics] = getattr(pool, "metrics", None)
+    if metrics is not None:
+        stats.update({
+            "checkouts": metrics.checkouts,
+            "wait_avg_ms": round(metrics.wait_total / metrics.checkouts * 1000, 3) if metrics.checkouts else 0,
+            "wait_max_ms": round(metrics.wait_max * 1000, 3),
+            "overflow_events": metrics.overflow_events,
+            "timeouts": metrics.timeouts
+        })
+    return stats
+
+engine = build_engine(DATABASE_URL)
 async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
-logger = logging.getLogger(__name__)
+# 统计分析使用的只读引擎，未配置副本时与主库共用同一个引擎
+replica_engine = build_engine(settings.DATABASE_REPLICA_URL, "replica") if settings.DATABASE_REPLICA_URL else engine
+replica_session_maker = (
+    sessionmaker(replica_engine, class_=AsyncSession, expire_on_commit=False)
+    if replica_engine is not engine else async_session_maker
+)
+
+def _pool_gauge(field: str):
+    def collect():
+        values = {("primary",): pool_stats(engine)[field]}
+        if replica_engine is not engine:
+            values[("replica",)] = pool_stats(replica_engine)[field]
+        return values
+    return collect
+
+gauge("db_pool_checked_out", "已借出的数据库连接数", ("engine",), _pool_gauge("checked_out"))
+gauge("db_pool_overflow", "当前溢出连接数", ("engine",), _pool_gauge("overflow"))
+
 logger.info(f"连接到数据库: {DATABASE_URL}")  # 添加日志以帮助调试
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+async def get_read_db() -> AsyncGenerator[AsyncSession, None]:
+    """只读查询（统计分析）使用的会话，配置了只读副本时连接副本"""
+    async with replica_session_maker() as session:
+        yield session
@@ -0,0 +1,48 @@
+import time
+from app.core.metrics import histogram
+
+HTTP_REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds",
+    "HTTP请求处理耗时（流式响应计到最后一个数据块发送完成）",
+    labelnames=("method", "route", "status")
+)
+
+class HTTPMetricsMiddleware:
+    """
+    按路由模板记录请求耗时的ASGI中间件。
+    使用路由模板（如 /api/history/{history_id}）而不是实际路径作为标签，避免标签数量无限增长。
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=self._route_label(scope),
+                status=str(status["code"])
+            )
+
+    @staticmethod
+    def _route_label(scope) -> str:
+        route = scope.get("route")
+        if route is not None and getattr(route, "path", None):
+            return route.path
+        if scope.get("path", "").startswith("/api/static/"):
+            return "/api/static"
+        return "unmatched"
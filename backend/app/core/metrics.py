@@ -0,0 +1,203 @@
+import bisect
+import math
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Any, List, Optional, Sequence, Tuple
+
+# 默认的延迟分桶上界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(labelnames, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+class Metric(ABC):
+    """指标基类：按标签值分别记录，可在多个线程中更新"""
+    type_name = "untyped"
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        """Prometheus 文本格式的样本行"""
+
+class Counter(Metric):
+    """单调递增的计数器"""
+    type_name = "counter"
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, description, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Gauge(Metric):
+    """
+    当前值指标。可以直接 set，也可以提供回调函数在采集时读取：
+    回调返回数值（无标签）或 {标签值元组: 数值}。
+    """
+    type_name = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: Sequence[str] = (),
+        callback: Optional[Callable[[], Any]] = None
+    ):
+        super().__init__(name, description, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def _collect(self) -> List[Tuple[LabelValues, float]]:
+        with self._lock:
+            items = list(self._values.items())
+        if self.callback is not None:
+            try:
+                value = self.callback()
+            except Exception as e:
+                print(f"采集指标 {self.name} 失败: {str(e)}")
+                return items
+            if isinstance(value, dict):
+                items.extend((tuple(str(v) for v in key), float(v)) for key, v in value.items())
+            elif value is not None:
+                items.append(((), float(value)))
+        return items
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in self._collect()]
+
+class Histogram(Metric):
+    """累积分桶直方图（与Prometheus的histogram语义一致）"""
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        labelnames: Sequence[str] = ()
+    ):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各桶计数（最后一个对应 +Inf）, 总和, 样本数]
+        self._series: Dict[LabelValues, List[Any]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, **labels) -> Dict[str, Any]:
+        """返回累积计数：buckets[le] 为小于等于 le 的样本数"""
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            counts = list(series[0]) if series else [0] * (len(self.buckets) + 1)
+            total, count = (series[1], series[2]) if series else (0.0, 0)
+        cumulative = {}
+        running = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            running += bucket_count
+            cumulative[str(bound)] = running
+        cumulative["+Inf"] = count
+        return {"count": count, "sum": round(total, 6), "buckets": cumulative}
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(series[0]), series[1], series[2]) for key, series in self._series.items()]
+        lines = []
+        for key, counts, total, count in items:
+            running = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                running += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_value(bound)))} {running}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+# 全局注册表：名称 -> 指标
+REGISTRY: Dict[str, Metric] = {}
+_registry_lock = threading.Lock()
+
+def _register(name: str, factory: Callable[[], Metric]) -> Any:
+    with _registry_lock:
+        if name not in REGISTRY:
+            REGISTRY[name] = factory()
+        return REGISTRY[name]
+
+def histogram(
+    name: str,
+    description: str,
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+    labelnames: Sequence[str] = ()
+) -> Histogram:
+    """获取或创建指定名称的直方图"""
+    return _register(name, lambda: Histogram(name, description, buckets, labelnames))
+
+def counter(name: str, description: str, labelnames: Sequence[str] = ()) -> Counter:
+    """获取或创建指定名称的计数器"""
+    return _register(name, lambda: Counter(name, description, labelnames))
+
+def gauge(
+    name: str,
+    description: str,
+    labelnames: Sequence[str] = (),
+    callback: Optional[Callable[[], Any]] = None
+) -> Gauge:
+    """获取或创建指定名称的当前值指标"""
+    return _register(name, lambda: Gauge(name, description, labelnames, callback))
+
+def render_prometheus() -> str:
+    """按 Prometheus 文本格式（0.0.4）输出所有指标"""
+    with _registry_lock:
+        metrics = list(REGISTRY.values())
+    lines: List[str] = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.type_name}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
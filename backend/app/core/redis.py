@@ -0,0 +1,31 @@
+import time
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+from app.core.metrics import histogram
+
+REDIS_LATENCY = histogram(
+    "redis_command_seconds",
+    "Redis命令耗时（阻塞命令如BLMOVE包含等待时间，pipeline按一次往返计）",
+    labelnames=("command",)
+)
+
+class InstrumentedPipeline(Pipeline):
+    """记录整个pipeline往返耗时"""
+    async def execute(self, raise_on_error: bool = True):
+        start = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            REDIS_LATENCY.observe(time.perf_counter() - start, command="PIPELINE")
+
+class InstrumentedRedis(Redis):
+    """按命令记录耗时的Redis客户端，各服务通过 Redis.from_url 的同名方法创建"""
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_LATENCY.observe(time.perf_counter() - start, command=str(args[0]).upper())
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, Optional, Set, Tuple
+from redis.asyncio import Redis
+from app.core.redis import InstrumentedRedis
+from app.core.config import get_settings
+from app.models.user import User
+
+settings = get_settings()
+
+# 缓存的用户字段（不包含密码哈希，鉴权之外的操作仍然从数据库读取完整用户）
+CACHED_FIELDS = ("id", "email", "username", "is_active", "is_superuser", "is_verified", "role")
+
+class UserCache:
+    """
+    JWT 鉴权的用户缓存，键为 用户ID + 令牌摘要，生存时间很短。
+    进程内缓存为第一级，Redis为可选的第二级（多个API进程共享）。
+    用户信息更新、停用或删除时按用户ID失效；其他进程的进程内缓存依靠TTL过期。
+    """
+    def __init__(self, ttl: float = 30, max_entries: int = 10000, use_redis: bool = False):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.use_redis = use_redis
+        self.redis: Optional[Redis] = None
+        # (用户ID, 令牌摘要) -> (过期时间, 用户字段)
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._by_user: Dict[int, Set[str]] = {}
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    @staticmethod
+    def token_digest(token: str) -> str:
+        return hashlib.blake2b(token.encode("utf-8"), digest_size=16).hexdigest()
+
+    @staticmethod
+    def _redis_key(user_id: int) -> str:
+        return f"user_cache:{user_id}"
+
+    async def get_redis(self) -> Redis:
+        if self.redis is None:
+            self.redis = InstrumentedRedis.from_url(settings.redis_url)
+        return self.redis
+
+    @staticmethod
+    def _snapshot(user: User) -> Dict[str, Any]:
+        data = {field: getattr(user, field, None) for field in CACHED_FIELDS}
+        created_at = getattr(user, "created_at", None)
+        data["created_at"] = created_at.isoformat() if created_at else None
+        return data
+
+    @staticmethod
+    def _restore(data: Dict[str, Any]) -> User:
+        """由缓存字段构造一个未绑定会话的用户对象"""
+        fields = {field: data.get(field) for field in CACHED_FIELDS}
+        created_at = data.get("created_at")
+        fields["created_at"] = datetime.fromisoformat(created_at) if created_at else None
+        return User(hashed_password="", **fields)
+
+    async def get(self, user_id: int, token: str) -> Optional[User]:
+        if not self.enabled:
+            return None
+        digest = self.token_digest(token)
+        now = time.monotonic()
+        entry = self._entries.get((user_id, digest))
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end((user_id, digest))
+                self.hits += 1
+                return self._restore(entry[1])
+            self._remove((user_id, digest))
+
+        if self.use_redis:
+            try:
+                redis = await self.get_redis()
+                raw = await redis.hget(self._redis_key(user_id), digest)
+                if raw:
+                    cached = json.loads(raw)
+                    # 哈希的过期时间在每次写入时刷新，因此单个字段需要自行检查过期时间
+                    lifetime = cached["expires_at"] - time.time()
+                    if lifetime > 0:
+                        self._store(user_id, digest, cached["user"], lifetime)
+                        self.redis_hits += 1
+                        return self._restore(cached["user"])
+            except Exception as e:
+                print(f"读取用户缓存失败: {str(e)}")
+
+        self.misses += 1
+        return None
+
+    async def set(self, user_id: int, token: str, user: User, token_exp: Optional[float] = None):
+        """token_exp 为令牌的过期时间（Unix时间戳），缓存不会比令牌活得更久"""
+        if not self.enabled:
+            return
+        lifetime = self.ttl if token_exp is None else min(self.ttl, token_exp - time.time())
+        if lifetime <= 0:
+            return
+        digest = self.token_digest(token)
+        data = self._snapshot(user)
+        self._store(user_id, digest, data, lifetime)
+        if self.use_redis:
+            try:
+                redis = await self.get_redis()
+                key = self._redis_key(user_id)
+                async with redis.pipeline(transaction=False) as pipe:
+                    pipe.hset(key, digest, json.dumps({"expires_at": time.time() + lifetime, "user": data}, ensure_ascii=False))
+                    pipe.expire(key, max(1, int(self.ttl)))
+                    await pipe.execute()
+            except Exception as e:
+                print(f"写入用户缓存失败: {str(e)}")
+
+    async def invalidate(self, user_id: int):
+        """用户信息更新、停用、删除时调用"""
+        for digest in list(self._by_user.get(user_id, ())):
+            self._remove((user_id, digest))
+        if self.use_redis:
+            try:
+                redis = await self.get_redis()
+                await redis.delete(self._redis_key(user_id))
+            except Exception as e:
+                print(f"清除用户缓存失败: {str(e)}")
+
+    def _store(self, user_id: int, digest: str, data: Dict[str, Any], lifetime: float):
+        key = (user_id, digest)
+        self._entries[key] = (time.monotonic() + lifetime, data)
+        self._entries.move_to_end(key)
+        self._by_user.setdefault(user_id, set()).add(digest)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Tuple[int, str]):
+        self._entries.pop(key, None)
+        digests = self._by_user.get(key[0])
+        if digests is not None:
+            digests.discard(key[1])
+            if not digests:
+                del self._by_user[key[0]]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses
+        }
+
+# 全局单例
+user_cache = UserCache(
+    ttl=settings.user_cache_ttl,
+    max_entries=settings.user_cache_max_entries,
+    use_redis=settings.user_cache_redis
+)
@@ -1,11 +1,13 @@
-from typing import Optional, Union, AsyncGenerator
+from typing import Optional, Union, AsyncGenerator, Dict, Any
+import jwt
 from fastapi import Depends, Request
-from fastapi_users import FastAPIUsers, BaseUserManager, IntegerIDMixin, schemas
+from fastapi_users import FastAPIUsers, BaseUserManager, IntegerIDMixin, schemas, exceptions
 from fastapi_users.authentication import (
     AuthenticationBackend,
     BearerTransport,
     JWTStrategy,
 )
+from fastapi_users.jwt import decode_jwt
 from fastapi_users_db_sqlalchemy import SQLAlchemyUserDatabase
 from fastapi_users.exceptions import InvalidPasswordException
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -13,6 +15,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.user import User
 from app.core.database import get_db
 from app.core.config import get_settings
+from app.core.user_cache import user_cache
 
 settings = get_settings()
 
@@ -40,6 +43,21 @@ class UserManager(IntegerIDMixin, BaseUserManager[User, int]):
     async def on_after_register(self, user: User, request: Optional[Request] = None):
         print(f"用户 {user.email} 已注册")
 
+    async def on_after_update(
+        self, user: User, update_dict: Dict[str, Any], request: Optional[Request] = None
+    ):
+        # 用户信息变更（包括停用）后，已缓存的鉴权结果立即失效
+        await user_cache.invalidate(user.id)
+
+    async def on_after_reset_password(self, user: User, request: Optional[Request] = None):
+        await user_cache.invalidate(user.id)
+
+    async def on_after_verify(self, user: User, request: Optional[Request] = None):
+        await user_cache.invalidate(user.id)
+
+    async def on_after_delete(self, user: User, request: Optional[Request] = None):
+        await user_cache.invalidate(user.id)
+
     async def on_after_forgot_password(
         self, user: User, token: str, request: Optional[Request] = None
     ):
@@ -90,6 +108,33 @@ async def get_user_manager(user_db=Depends(get_user_db)):
 # 配置令牌传输 - 注意URL前缀
 bearer_transport = BearerTransport(tokenUrl="/api/auth/login")
 
+class CachedJWTStrategy(JWTStrategy):
+    """
+    解码JWT后先查用户缓存，命中时不访问数据库。
+    只有令牌合法时才会查缓存，缓存条目不会比令牌活得更久。
+    命中时返回的是未绑定会话的用户对象（不含密码哈希），只能用于只读的依赖项。
+    """
+    async def read_token(
+        self, token: Optional[str], user_manager: BaseUserManager[User, int]
+    ) -> Optional[User]:
+        if token is None:
+            return None
+        try:
+            data = decode_jwt(token, self.decode_key, self.token_audience, algorithms=[self.algorithm])
+            user_id = user_manager.parse_id(data["sub"])
+        except (jwt.PyJWTError, KeyError, exceptions.InvalidID):
+            return None
+
+        user = await user_cache.get(user_id, token)
+        if user is not None:
+            return user
+        try:
+            user = await user_manager.get(user_id)
+        except exceptions.UserNotExists:
+            return None
+        await user_cache.set(user_id, token, user, data.get("exp"))
+        return user
+
 # 配置JWT策略
 def get_jwt_strategy() -> JWTStrategy:
     return JWTStrategy(
@@ -97,6 +142,12 @@ def get_jwt_strategy() -> JWTStrategy:
         lifetime_seconds=settings.access_token_expire_minutes * 60
     )
 
+def get_cached_jwt_strategy() -> JWTStrategy:
+    return CachedJWTStrategy(
+        secret=settings.secret_key,
+        lifetime_seconds=settings.access_token_expire_minutes * 60
+    )
+
 # 创建认证后端
 auth_backend = AuthenticationBackend(
     name="jwt",
@@ -104,12 +155,26 @@ auth_backend = AuthenticationBackend(
     get_strategy=get_jwt_strategy,
 )
 
-# 创建FastAPI Users实例
+# 读取用户缓存的认证后端（令牌格式相同），不用于登录和用户管理路由
+cached_auth_backend = AuthenticationBackend(
+    name="jwt-cached",
+    transport=bearer_transport,
+    get_strategy=get_cached_jwt_strategy,
+)
+
+# 创建FastAPI Users实例（用户管理路由使用从数据库读取的用户对象）
 fastapi_users = FastAPIUsers[User, int](
     get_user_manager,
     [auth_backend],
 )
+cached_fastapi_users = FastAPIUsers[User, int](
+    get_user_manager,
+    [cached_auth_backend],
+)
 
-# 依赖项：获取当前用户
+# 依赖项：获取当前用户（从数据库读取，可用于会修改用户的路由）
 current_active_user = fastapi_users.current_user(active=True)
-current_superuser = fastapi_users.current_user(active=True, superuser=True)
\ No newline at end of file
+current_superuser = fastapi_users.current_user(active=True, superuser=True)
+
+# 只读依赖项：可能返回缓存的用户对象，只能读取用户字段，不能写回数据库
+cached_active_user = cached_fastapi_users.current_user(active=True)
\ No newline at end of file
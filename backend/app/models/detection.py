@@ -11,7 +11,7 @@ class Detection(Base):
     image_path = Column(String)
     annotated_path = Column(String, nullable=True)
     results = Column(JSONB, nullable=True)  # 使用JSONB代替JSON
-    created_at = Column(DateTime, default=func.now())
+    created_at = Column(DateTime, default=func.now(), index=True)
     
     # 添加用户关联
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
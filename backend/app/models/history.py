@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
@@ -17,23 +17,40 @@ class History(Base):
     timestamp = Column(DateTime, default=func.now(), index=True)
     type = Column(String, index=True)  # 'image', 'video' 或其他类型
     filename = Column(String)
-    thumbnail = Column(Text, nullable=True)  # 缩略图存储为 base64 字符串
+    # 缩略图存储在 thumbnail_store 中，这里只保存键（前端直接提供的图片URL原样保存）
+    thumbnail_key = Column(String, nullable=True)
     result = Column(JSONB, nullable=True)  # 确保允许为空
 
-    def to_dict(self):
-        ts = None
+    def _js_timestamp(self):
         if self.timestamp:
             try:
                 # 转换时间戳
-                ts = time.mktime(self.timestamp.timetuple()) * 1000 + self.timestamp.microsecond / 1000
+                return time.mktime(self.timestamp.timetuple()) * 1000 + self.timestamp.microsecond / 1000
             except:
-                ts = None
-        
+                return None
+        return None
+
+    def to_summary_dict(self):
+        """列表摘要：不包含检测结果，只访问列表查询加载的列"""
         return {
             "id": self.id,
-            "timestamp": ts,  # 转为JS时间戳（毫秒）
+            "timestamp": self._js_timestamp(),
             "type": self.type,
             "filename": self.filename,
-            "thumbnail": self.thumbnail,
+            "thumbnail": self.thumbnail_key,  # 缩略图引用，由路由转换为URL
+            "result": {}
+        }
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "timestamp": self._js_timestamp(),  # 转为JS时间戳（毫秒）
+            "type": self.type,
+            "filename": self.filename,
+            "thumbnail": self.thumbnail_key,  # 缩略图引用，由路由转换为URL
             "result": self.result or {}
-        }
\ No newline at end of file
+        }
+
+# 列表按 (timestamp DESC NULLS LAST, id DESC) 做游标分页，索引的排序与查询一致；按类型筛选时同样可以走索引
+Index("ix_history_timestamp_desc_id", History.timestamp.desc().nulls_last(), History.id.desc())
+Index("ix_history_type_timestamp_desc_id", History.type, History.timestamp.desc().nulls_last(), History.id.desc())
@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey, UniqueConstraint
+from app.models.base import Base  # 导入共享的Base
+
+class DetectionDailyStats(Base):
+    """按 数据来源/用户/天/害虫类别 汇总的检测统计，写入检测结果时增量更新"""
+    __tablename__ = "detection_daily_stats"
+
+    id = Column(Integer, primary_key=True)
+    source = Column(String, nullable=False)  # 'history', 'detections' 或 'video'
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
+    day = Column(Date, nullable=False, index=True)
+    pest_class = Column("class", String, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    conf_sum = Column(Float, nullable=False, default=0)
+    conf_min = Column(Float, nullable=True)
+    conf_max = Column(Float, nullable=True)
+
+    __table_args__ = (
+        # user_id 可以为空，NULL 之间视为相同，保证 upsert 能命中同一行（PostgreSQL 15+）
+        UniqueConstraint(
+            "source", "user_id", "day", "class",
+            name="uq_detection_daily_stats_key",
+            postgresql_nulls_not_distinct=True
+        ),
+    )
@@ -1,16 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse
 import logging
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from app.core.database import get_db
 from app.models.history import History
 from app.schemas.history import HistoryCreate, HistoryResponse
-from sqlalchemy import select, delete
+from app.services.statistics import statistics_service
+from app.services.rollup import rebuild
+from app.services.persistence import insert_history
+from app.services.thumbnails import thumbnail_store, thumbnail_url, is_thumbnail_key, media_type
+from app.core.config import get_settings
+from sqlalchemy import select, delete, or_, tuple_
+from sqlalchemy.orm import load_only
+import asyncio
+import base64
+import json
 import uuid
 from datetime import datetime, timezone
 
 # 设置日志
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
 # 修改前缀路径，移除 /api，因为在 main.py 中会添加
 router = APIRouter(
@@ -18,6 +29,39 @@ router = APIRouter(
     tags=["history"],
 )
 
+# 单次批量导入的最大记录数
+HISTORY_BULK_MAX = 10000
+
+def _history_row(history: HistoryCreate, thumbnail_key: Optional[str]) -> dict:
+    """构造用于写入的历史记录：补全 ID 和时间戳，并去掉时区信息（使用本地时间）"""
+    timestamp = history.timestamp or datetime.now()
+    if timestamp.tzinfo:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return {
+        "id": history.id or str(uuid.uuid4()),
+        "timestamp": timestamp,
+        "type": history.type,
+        "filename": history.filename,
+        "thumbnail_key": thumbnail_key,
+        "result": history.result
+    }
+
+def _history_dict(record: History, summary: bool = False) -> dict:
+    """历史记录响应：把数据库中保存的缩略图引用转换为可访问的URL"""
+    data = record.to_summary_dict() if summary else record.to_dict()
+    data["thumbnail"] = thumbnail_url(record.thumbnail_key)
+    return data
+
+def _store_thumbnails(histories: List[HistoryCreate]) -> List[Optional[str]]:
+    """缩略图写入存储后端，数据库只保存键"""
+    keys = []
+    for index, history in enumerate(histories):
+        try:
+            keys.append(thumbnail_store.store(history.thumbnail))
+        except ValueError as e:
+            raise ValueError(f"第 {index + 1} 条记录的缩略图无效: {str(e)}")
+    return keys
+
 @router.post("/", response_model=HistoryResponse)
 async def create_history(
     history: HistoryCreate,
@@ -26,59 +70,145 @@ async def create_history(
     """创建历史记录"""
     try:
         logger.info(f"尝试创建历史记录: {history.filename}, 类型: {history.type}")
-        
-        # 如果未提供 ID，则生成一个
-        if not history.id:
-            history.id = str(uuid.uuid4())
-        
-        # 确保有时间戳并处理时区问题
-        current_time = datetime.now()
-        if history.timestamp:
-            # 移除时区信息，使用本地时间
-            if history.timestamp.tzinfo:
-                # 将时区转换为本地时间，然后去掉时区信息
-                history.timestamp = history.timestamp.astimezone().replace(tzinfo=None)
-        else:
-            history.timestamp = current_time
-        
         logger.debug(f"创建历史记录，结果大小: {len(str(history.result)) if history.result else 0} 字符")
         
-        db_history = History(
-            id=history.id,
-            timestamp=history.timestamp,
-            type=history.type,
-            filename=history.filename,
-            thumbnail=history.thumbnail,
-            result=history.result
-        )
+        try:
+            thumbnail_key = await asyncio.to_thread(thumbnail_store.store, history.thumbnail)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"缩略图无效: {str(e)}")
         
-        db.add(db_history)
+        # 写入时通过 RETURNING 取回记录，无需再 refresh
+        inserted = await insert_history(db, [_history_row(history, thumbnail_key)])
+        if not inserted:
+            raise HTTPException(status_code=409, detail="历史记录已存在")
         await db.commit()
-        await db.refresh(db_history)
+        await statistics_service.invalidate()
         
-        logger.info(f"历史记录创建成功: {db_history.id}")
-        return db_history.to_dict()
+        logger.info(f"历史记录创建成功: {inserted[0].id}")
+        return _history_dict(inserted[0])
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"创建历史记录失败: {str(e)}", exc_info=True)
         await db.rollback()  # 添加回滚操作
         raise HTTPException(status_code=500, detail=f"创建历史记录时发生错误: {str(e)}")
 
+@router.post("/bulk")
+async def create_history_bulk(
+    histories: List[HistoryCreate],
+    db: AsyncSession = Depends(get_db)
+):
+    """批量导入历史记录（例如历史调查数据），ID 已存在的记录会被跳过"""
+    if not histories:
+        raise HTTPException(status_code=400, detail="未提供历史记录")
+    if len(histories) > HISTORY_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"单次最多导入 {HISTORY_BULK_MAX} 条记录")
+    
+    try:
+        thumbnail_keys = await asyncio.to_thread(_store_thumbnails, histories)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        rows = [_history_row(history, key) for history, key in zip(histories, thumbnail_keys)]
+        inserted = await insert_history(db, rows)
+        await db.commit()
+    except Exception as e:
+        logger.error(f"批量导入历史记录失败: {str(e)}", exc_info=True)
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"批量导入历史记录时发生错误: {str(e)}")
+    await statistics_service.invalidate()
+    
+    logger.info(f"批量导入历史记录: 提交 {len(rows)} 条，写入 {len(inserted)} 条")
+    return {
+        "status": "success",
+        "submitted": len(rows),
+        "inserted": len(inserted),
+        "skipped": len(rows) - len(inserted),
+        "ids": [record.id for record in inserted]
+    }
+
+def _encode_cursor(record: History) -> str:
+    """游标为最后一条记录的 (timestamp, id)，对客户端不透明；timestamp 可以为空"""
+    timestamp = record.timestamp.isoformat() if record.timestamp is not None else None
+    payload = json.dumps({"t": timestamp, "id": record.id})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+def _decode_cursor(cursor: str):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        timestamp = datetime.fromisoformat(payload["t"]) if payload["t"] is not None else None
+        return timestamp, str(payload["id"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
 @router.get("/", response_model=List[HistoryResponse])
 async def get_history_records(
+    response: Response,
     db: AsyncSession = Depends(get_db),
     skip: int = 0,
-    limit: int = 100,
-    type: Optional[str] = None
+    limit: int = Query(100, ge=1, le=500),
+    type: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 的值，指定后忽略 skip"),
+    fields: str = Query("full", pattern="^(full|summary)$", description="summary 时不返回检测结果")
 ):
-    """获取历史记录列表"""
-    query = select(History).order_by(History.timestamp.desc()).offset(skip).limit(limit)
-    
+    """
+    获取历史记录列表，按 (timestamp, id) 倒序，没有时间戳的记录排在最后。
+    推荐使用游标分页：还有下一页时响应头 X-Next-Cursor 给出下一页的游标。
+    列表使用 fields=summary，详情通过 /history/{id} 按需获取。
+    """
+    query = select(History).order_by(History.timestamp.desc().nulls_last(), History.id.desc()).limit(limit)
+
     if type:
         query = query.where(History.type == type)
-        
+    if cursor:
+        cursor_ts, cursor_id = _decode_cursor(cursor)
+        if cursor_ts is None:
+            # 已进入排在最后的无时间戳记录
+            query = query.where(History.timestamp.is_(None), History.id < cursor_id)
+        else:
+            query = query.where(or_(
+                tuple_(History.timestamp, History.id) < tuple_(cursor_ts, cursor_id),
+                History.timestamp.is_(None)
+            ))
+    else:
+        query = query.offset(skip)
+    if fields == "summary":
+        query = query.options(load_only(
+            History.id, History.timestamp, History.type, History.filename, History.thumbnail_key
+        ))
+
     result = await db.execute(query)
     records = result.scalars().all()
-    return [record.to_dict() for record in records]
+
+    if len(records) == limit:
+        response.headers["X-Next-Cursor"] = _encode_cursor(records[-1])
+    if fields == "summary":
+        return [_history_dict(record, summary=True) for record in records]
+    return [_history_dict(record) for record in records]
+
+@router.get("/thumbnails/{key}")
+async def get_thumbnail(key: str, request: Request):
+    """获取缩略图：内容寻址，同一个键的内容永不变化，可长期缓存"""
+    if not is_thumbnail_key(key):
+        raise HTTPException(status_code=404, detail="缩略图不存在")
+
+    etag = f'"{key.split(".")[0]}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.thumbnail_cache_max_age}, immutable"
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+
+    path = thumbnail_store.local_path(key)
+    if path is not None:
+        return FileResponse(path, media_type=media_type(key), headers=headers)
+    data = await asyncio.to_thread(thumbnail_store.get, key)
+    if data is None:
+        raise HTTPException(status_code=404, detail="缩略图不存在")
+    return Response(content=data, media_type=media_type(key), headers=headers)
 
 @router.get("/{history_id}", response_model=HistoryResponse)
 async def get_history_record(
@@ -92,7 +222,7 @@ async def get_history_record(
     if not record:
         raise HTTPException(status_code=404, detail="历史记录不存在")
         
-    return record.to_dict()
+    return _history_dict(record)
 
 @router.delete("/{history_id}", status_code=204)
 async def delete_history_record(
@@ -107,7 +237,11 @@ async def delete_history_record(
         raise HTTPException(status_code=404, detail="历史记录不存在")
         
     await db.execute(delete(History).where(History.id == history_id))
+    # 计数可以直接扣减，但最小/最大置信度无法回退，按当天重建汇总数据
+    if record.type == "image" and record.timestamp:
+        await rebuild(db, "history", [record.timestamp.date()])
     await db.commit()
+    await statistics_service.invalidate()
     
     return None
 
@@ -117,6 +251,8 @@ async def delete_all_history_records(
 ):
     """清空所有历史记录"""
     await db.execute(delete(History))
+    await rebuild(db, "history")
     await db.commit()
+    await statistics_service.invalidate()
     
     return None
\ No newline at end of file
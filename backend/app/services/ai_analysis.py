@@ -1,15 +1,74 @@
 import os
 import asyncio
-from openai import OpenAI
+import hashlib
+import json
+import random
+import time
+import httpx
+import openai
+from openai import AsyncOpenAI
 from fastapi import HTTPException
 from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
+from redis.asyncio import Redis
+from app.core.redis import InstrumentedRedis
+from typing import Dict, Any, List, Optional, AsyncIterator
+from app.core.config import get_settings
+from app.core.metrics import histogram
+
+settings = get_settings()
+
+# 可以重试的上游错误：连接失败/超时、限流和服务端错误
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+AI_QUEUE_WAIT = histogram("ai_analysis_queue_wait_seconds", "AI分析请求等待上游并发名额的时间")
+AI_FIRST_TOKEN = histogram("ai_analysis_first_token_seconds", "AI分析上游调用的首个片段延迟")
+AI_UPSTREAM_LATENCY = histogram("ai_analysis_upstream_seconds", "AI分析单次上游调用的总耗时")
+
+SYSTEM_PROMPT = "你是一个专业的农业害虫分析助手。根据提供的害虫检测统计数据，分析害虫发生规律、提供防治建议，并预测可能的发展趋势。使用专业且易懂的语言，结构清晰地呈现分析结果。"
 
 class AnalysisRequest(BaseModel):
     statisticsData: Dict[str, Any]
     dateRange: List[str]
     comparisonData: Optional[Dict[str, Any]] = None
 
+class AnalysisStream:
+    """
+    一次上游生成产生的事件序列。多个相同的并发请求订阅同一个流，
+    后加入的订阅者先重放已产生的事件，再继续接收新的事件。
+    """
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.finished = False
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def publish(self, event: Dict[str, Any]):
+        self.events.append(event)
+        self._notify()
+
+    def finish(self):
+        self.finished = True
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[Dict[str, Any]]:
+        index = 0
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.finished:
+                return
+            await self._changed.wait()
+
 class AIAnalysisService:
     def __init__(self):
         #TODO： 从环境变量获取API密钥，确保安全性
@@ -18,54 +77,207 @@ class AIAnalysisService:
             print("警告: 未设置DEEPSEEK_API_KEY环境变量")
             self.api_key = "demo_key"  # 仅用于开发，生产环境需要设置真实密钥
         
-        self.client = OpenAI(
+        # 复用HTTP连接池；重试由服务自身控制，以便记录退避和避免重复输出
+        timeout = httpx.Timeout(settings.ai_request_timeout, connect=settings.ai_connect_timeout)
+        self.client = AsyncOpenAI(
             api_key=self.api_key,
-            base_url="https://api.deepseek.com"
+            base_url=settings.ai_base_url,
+            timeout=timeout,
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                timeout=timeout,
+                limits=httpx.Limits(
+                    max_connections=settings.ai_max_connections,
+                    max_keepalive_connections=settings.ai_max_connections
+                )
+            )
         )
+        self.model = settings.ai_model
+        self._semaphore = asyncio.Semaphore(max(1, settings.ai_max_concurrency))
+        self._waiting = 0
+        self._running = 0
+        self.retries = 0
+        self.redis: Optional[Redis] = None
+        # 正在生成中的报告：缓存键 -> 事件流
+        self._inflight: Dict[str, AnalysisStream] = {}
     
-    async def generate_analysis(self, data: AnalysisRequest) -> Dict[str, Any]:
-        """根据统计数据生成智能分析报告"""
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key) and self.api_key != "demo_key"
+    
+    async def get_redis(self) -> Redis:
+        """获取Redis连接"""
+        if self.redis is None:
+            self.redis = InstrumentedRedis.from_url(settings.redis_url)
+        return self.redis
+    
+    def _cache_key(self, prompt: str) -> str:
+        """以模型、系统提示词和 _build_prompt 生成的提示词的摘要作为缓存键"""
+        payload = "\0".join((self.model, SYSTEM_PROMPT, prompt)).encode("utf-8")
+        return f"ai_analysis:{hashlib.blake2b(payload, digest_size=20).hexdigest()}"
+    
+    async def stream_analysis(self, data: AnalysisRequest) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式生成分析报告，依次产生 meta、reasoning/delta（逐段内容）、done 或 error 事件。
+        相同提示词的结果会被缓存；相同的并发请求共享同一次上游调用。
+        """
+        if not self.configured:
+            yield {"type": "error", "message": "DeepSeek API密钥未配置，请联系管理员设置有效的API密钥"}
+            return
+        
+        prompt = self._build_prompt(data)
+        key = self._cache_key(prompt)
+        
+        cached = await self._cache_get(key)
+        if cached is not None:
+            yield {"type": "meta", "cached": True, "shared": False}
+            yield {"type": "delta", "content": cached["analysis"]}
+            yield {"type": "done", **cached}
+            return
+        
+        stream = self._inflight.get(key)
+        shared = stream is not None
+        if stream is None:
+            stream = AnalysisStream()
+            self._inflight[key] = stream
+            # 上游调用在独立任务中进行，发起请求的客户端断开也不会中断其他订阅者
+            stream.task = asyncio.create_task(self._generate(key, prompt, stream))
+        
+        yield {"type": "meta", "cached": False, "shared": shared}
+        async for event in stream.subscribe():
+            yield event
+    
+    async def _generate(self, key: str, prompt: str, stream: AnalysisStream):
+        """在并发上限内调用上游接口，完成后写入缓存"""
         try:
-            # 检查API密钥是否可用
-            if not self.api_key or self.api_key == "demo_key":
-                return {
-                    "status": "error", 
-                    "message": "DeepSeek API密钥未配置，请联系管理员设置有效的API密钥"
-                }
-            
-            # 构建提示信息
-            prompt = self._build_prompt(data)
+            queued_at = time.perf_counter()
+            self._waiting += 1
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self._waiting -= 1
+            AI_QUEUE_WAIT.observe(time.perf_counter() - queued_at)
+            self._running += 1
+            try:
+                analysis_text = await self._call_with_retry(prompt, stream)
+            finally:
+                self._running -= 1
+                self._semaphore.release()
             
-            # 使用asyncio.to_thread将同步API调用转换为异步操作
-            # 这样API调用会在单独的线程中执行，不会阻塞主事件循环
-            response = await asyncio.to_thread(
-                self.client.chat.completions.create,
-                model="deepseek-reasoner",
+            result = {
+                "status": "success",
+                "analysis": analysis_text,
+                "summary": self._extract_summary(analysis_text)
+            }
+            await self._cache_set(key, result)
+            stream.publish({"type": "done", **result})
+        except Exception as e:
+            print(f"调用DeepSeek API出错: {str(e)}")
+            stream.publish({"type": "error", "message": f"生成分析报告失败: {str(e)}"})
+        finally:
+            # 先写缓存再移除，之后的相同请求直接命中缓存
+            self._inflight.pop(key, None)
+            stream.finish()
+    
+    async def _call_with_retry(self, prompt: str, stream: AnalysisStream) -> str:
+        """按指数退避重试；已经向客户端输出内容后不再重试，避免内容重复"""
+        attempt = 0
+        while True:
+            published = len(stream.events)
+            try:
+                return await asyncio.wait_for(
+                    self._call_upstream(prompt, stream),
+                    timeout=settings.ai_request_timeout
+                )
+            except RETRYABLE_ERRORS as e:
+                if attempt >= settings.ai_max_retries or len(stream.events) > published:
+                    raise
+                delay = settings.ai_retry_backoff * (2 ** attempt) * random.uniform(0.5, 1.0)
+                attempt += 1
+                self.retries += 1
+                print(f"调用DeepSeek API失败，{delay:.1f}秒后第{attempt}次重试: {type(e).__name__}")
+                await asyncio.sleep(delay)
+    
+    async def _call_upstream(self, prompt: str, stream: AnalysisStream) -> str:
+        """单次流式调用，把增量内容发布到事件流"""
+        start = time.perf_counter()
+        first_chunk = True
+        parts: List[str] = []
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.model,
                 messages=[
-                    {
-                        "role": "system", 
-                        "content": "你是一个专业的农业害虫分析助手。根据提供的害虫检测统计数据，分析害虫发生规律、提供防治建议，并预测可能的发展趋势。使用专业且易懂的语言，结构清晰地呈现分析结果。"
-                    },
+                    {"role": "system", "content": SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.7,
-                stream=False
+                stream=True
             )
-            
-            analysis_text = response.choices[0].message.content
-            
-            # 解析markdown格式的回复
+            async for chunk in response:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                # deepseek-reasoner 会先输出推理过程
+                reasoning = getattr(delta, "reasoning_content", None)
+                if (reasoning or delta.content) and first_chunk:
+                    AI_FIRST_TOKEN.observe(time.perf_counter() - start)
+                    first_chunk = False
+                if reasoning:
+                    stream.publish({"type": "reasoning", "content": reasoning})
+                if delta.content:
+                    parts.append(delta.content)
+                    stream.publish({"type": "delta", "content": delta.content})
+        finally:
+            AI_UPSTREAM_LATENCY.observe(time.perf_counter() - start)
+        return "".join(parts)
+    
+    def stats(self) -> Dict[str, Any]:
+        """上游并发、排队和延迟分布"""
+        return {
+            "max_concurrency": settings.ai_max_concurrency,
+            "running": self._running,
+            "waiting": self._waiting,
+            "inflight_reports": len(self._inflight),
+            "retries": self.retries,
+            "queue_wait_seconds": AI_QUEUE_WAIT.snapshot(),
+            "first_token_seconds": AI_FIRST_TOKEN.snapshot(),
+            "upstream_seconds": AI_UPSTREAM_LATENCY.snapshot()
+        }
+    
+    async def close(self):
+        """关闭HTTP连接池"""
+        await self.client.close()
+    
+    async def generate_analysis(self, data: AnalysisRequest) -> Dict[str, Any]:
+        """根据统计数据生成智能分析报告（非流式，等待完整结果）"""
+        if not self.configured:
             return {
-                "status": "success",
-                "analysis": analysis_text,
-                "summary": self._extract_summary(analysis_text)
+                "status": "error", 
+                "message": "DeepSeek API密钥未配置，请联系管理员设置有效的API密钥"
             }
+        
+        async for event in self.stream_analysis(data):
+            if event["type"] == "done":
+                return {k: v for k, v in event.items() if k != "type"}
+            if event["type"] == "error":
+                raise HTTPException(status_code=500, detail=event["message"])
+        raise HTTPException(status_code=500, detail="生成分析报告失败: 上游未返回结果")
+    
+    async def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            redis = await self.get_redis()
+            data = await redis.get(key)
+            return json.loads(data) if data else None
         except Exception as e:
-            print(f"调用DeepSeek API出错: {str(e)}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"生成分析报告失败: {str(e)}"
-            )
+            print(f"读取分析报告缓存失败: {str(e)}")
+            return None
+    
+    async def _cache_set(self, key: str, value: Dict[str, Any]):
+        try:
+            redis = await self.get_redis()
+            await redis.set(key, json.dumps(value, ensure_ascii=False), ex=settings.ai_analysis_cache_ttl)
+        except Exception as e:
+            print(f"写入分析报告缓存失败: {str(e)}")
     
     def _build_prompt(self, data: AnalysisRequest) -> str:
         """构建提示词"""
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple
+from redis.asyncio import Redis
+from app.core.redis import InstrumentedRedis
+from app.core.config import get_settings
+
+settings = get_settings()
+
+class DetectionCache:
+    """
+    按图像内容寻址的检测结果缓存。
+    键为图像字节与模型配置（模型路径、输入尺寸、置信度阈值）的BLAKE2摘要，
+    值为预测结果和标注图像JPEG字节。
+    进程内LRU为第一级，Redis为可选的第二级（多个API进程共享）。
+    """
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_entries: int = 1024,
+        max_bytes: int = 256 * 1024 * 1024,
+        ttl: int = 60 * 60 * 24,
+        use_redis: bool = False
+    ):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self.redis: Optional[Redis] = None
+        # key -> (过期时间, 占用字节数, 值)
+        self._entries: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self._bytes = 0
+        # 模型配置参与摘要计算，模型或阈值变化后旧结果自动失效
+        self._salt = f"{settings.model_path}|{settings.img_size}|{settings.conf_thresh}".encode("utf-8")
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, image_bytes: bytes) -> str:
+        """计算图像内容摘要"""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(self._salt)
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    async def get_redis(self) -> Redis:
+        """获取Redis连接"""
+        if self.redis is None:
+            self.redis = InstrumentedRedis.from_url(settings.redis_url)
+        return self.redis
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存，返回 {"predictions": [...], "annotated": bytes | None}，未命中返回None"""
+        if not self.enabled:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, _, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self._remove(key)
+
+        if self.use_redis:
+            try:
+                redis = await self.get_redis()
+                data = await redis.hgetall(f"detection_cache:{key}")
+                if data:
+                    value = {
+                        "predictions": json.loads(data[b"predictions"]),
+                        "annotated": data.get(b"annotated") or None
+                    }
+                    self._store(key, value)
+                    self.redis_hits += 1
+                    return value
+            except Exception as e:
+                print(f"读取Redis检测缓存失败: {str(e)}")
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, predictions: List[Dict], annotated: Optional[bytes] = None):
+        """写入缓存"""
+        if not self.enabled:
+            return
+        value = {"predictions": predictions, "annotated": annotated}
+        self._store(key, value)
+
+        if self.use_redis:
+            try:
+                redis = await self.get_redis()
+                mapping = {"predictions": json.dumps(predictions, ensure_ascii=False)}
+                if annotated:
+                    mapping["annotated"] = annotated
+                async with redis.pipeline(transaction=False) as pipe:
+                    pipe.hset(f"detection_cache:{key}", mapping=mapping)
+                    pipe.expire(f"detection_cache:{key}", self.ttl)
+                    await pipe.execute()
+            except Exception as e:
+                print(f"写入Redis检测缓存失败: {str(e)}")
+
+    def _store(self, key: str, value: Dict[str, Any]):
+        """写入进程内LRU，并按条目数与字节数淘汰最久未使用的条目"""
+        size = len(value["annotated"] or b"") + len(json.dumps(value["predictions"]))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中率等缓存统计"""
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "redis_enabled": self.use_redis,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.redis_hits) / lookups, 4) if lookups else 0
+        }
+
+# 全局缓存实例
+detection_cache = DetectionCache(
+    enabled=settings.detection_cache_enabled,
+    max_entries=settings.detection_cache_max_entries,
+    max_bytes=settings.detection_cache_max_bytes,
+    ttl=settings.detection_cache_ttl,
+    use_redis=settings.detection_cache_redis
+)
@@ -1,16 +1,40 @@
 from ultralytics import YOLO
 from app.core.config import get_settings
+from app.core.metrics import histogram, gauge
 import cv2
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import base64
+import time
 
 settings = get_settings()
 
+MODEL_LOAD_SECONDS = gauge("model_load_seconds", "模型加载耗时")
+# 取自 Results.speed，按单张图像计（批量推理时为批次耗时均摊到每张图像）
+INFERENCE_STAGE_SECONDS = histogram(
+    "inference_stage_seconds",
+    "推理各阶段单张图像耗时（preprocess/inference/postprocess）",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+    labelnames=("stage",)
+)
+INFERENCE_BATCH_SIZE = histogram(
+    "inference_batch_size",
+    "每次模型调用的图像数量",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+CODEC_SECONDS = histogram(
+    "image_codec_seconds",
+    "图像解码与JPEG编码耗时",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5),
+    labelnames=("op",)
+)
+
 class PestDetector:
     def __init__(self):
         print(f"[DEBUG] 正在加载模型，路径: {settings.model_path}")
+        load_start = time.perf_counter()
         self.model = YOLO(settings.model_path, task="detect")
+        MODEL_LOAD_SECONDS.set(time.perf_counter() - load_start)
         print("[DEBUG] 模型类别标签:", self.model.names)  # 打印模型支持的类别
         self.img_size = settings.img_size
         self.conf_thresh = settings.conf_thresh
@@ -32,86 +56,123 @@ class PestDetector:
                 conf=self.conf_thresh,
                 verbose=False  # 关闭冗余日志
             )
+            self.record_speed(results)
             return self.parse_results(results)
         except Exception as e:
             print(f"预测过程中出错: {str(e)}")
             return []
+
+    def predict_batch(self, images: List[np.ndarray]) -> List[List[Dict]]:
+        """对一组已预处理的图像执行一次批量推理，按输入顺序返回每张图像的预测结果"""
+        if not images:
+            return []
+        try:
+            results = self.model(
+                images,
+                imgsz=self.img_size,
+                conf=self.conf_thresh,
+                verbose=False
+            )
+            self.record_speed(results)
+            return [self.parse_results([result]) for result in results]
+        except Exception as e:
+            print(f"批量预测过程中出错: {str(e)}")
+            return [[] for _ in images]
+
+    @staticmethod
+    def record_speed(results):
+        """记录 Results.speed 中的各阶段耗时（毫秒）"""
+        INFERENCE_BATCH_SIZE.observe(len(results))
+        for result in results:
+            for stage, ms in (getattr(result, "speed", None) or {}).items():
+                if ms is not None:
+                    INFERENCE_STAGE_SECONDS.observe(ms / 1000, stage=stage)
+
+    def predict_grouped(self, images: List[np.ndarray], max_batch_size: int = 8) -> List[List[Dict]]:
+        """
+        将图像按原始尺寸分组，每组按批次送入模型，再按输入顺序拆分结果。
+        ultralytics 只在一个批次内所有输入尺寸完全相同时才使用矩形（最小填充）letterbox，
+        尺寸不同的图像即使缩放后形状相同也会填充为正方形，因此必须按原始尺寸分组。
+        """
+        groups: Dict[Tuple[int, ...], List[int]] = {}
+        for idx, img in enumerate(images):
+            groups.setdefault(img.shape, []).append(idx)
+
+        outputs: List[List[Dict]] = [[] for _ in images]
+        for indices in groups.values():
+            for i in range(0, len(indices), max(1, max_batch_size)):
+                chunk = indices[i:i + max_batch_size]
+                for idx, predictions in zip(chunk, self.predict_batch([images[j] for j in chunk])):
+                    outputs[idx] = predictions
+        return outputs
     
+    def decode(self, image_bytes: bytes) -> np.ndarray:
+        """将字节流解码为BGR图像（整个处理流程只解码一次）"""
+        start = time.perf_counter()
+        nparr = np.frombuffer(image_bytes, np.uint8)
+        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        CODEC_SECONDS.observe(time.perf_counter() - start, op="decode")
+        if img is None:
+            raise ValueError("无法解码图像数据")
+        return img
+
+    def decode_for_inference(self, image_bytes: bytes) -> Tuple[np.ndarray, np.ndarray]:
+        """解码一次，同时返回用于标注的BGR图像和用于推理的RGB图像"""
+        img_bgr = self.decode(image_bytes)
+        return img_bgr, cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+
+    @staticmethod
+    def draw_predictions(img_bgr: np.ndarray, predictions: List[Dict]) -> np.ndarray:
+        """在BGR图像上原地绘制标注框"""
+        for pred in predictions:
+            x1 = int(pred["bbox"]["x1"])
+            y1 = int(pred["bbox"]["y1"])
+            x2 = int(pred["bbox"]["x2"])
+            y2 = int(pred["bbox"]["y2"])
+            cv2.rectangle(img_bgr, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            label = f"{pred['class']} {pred['confidence']:.2f}"
+            if "track_id" in pred:
+                label = f"#{pred['track_id']} {label}"
+            cv2.putText(img_bgr, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX,
+                        0.5, (0, 255, 0), 2)
+        return img_bgr
+
+    @staticmethod
+    def encode_jpeg(img_bgr: np.ndarray, quality: int = 95) -> bytes:
+        """将BGR图像编码为JPEG字节"""
+        start = time.perf_counter()
+        ok, buffer = cv2.imencode('.jpg', img_bgr, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        CODEC_SECONDS.observe(time.perf_counter() - start, op="encode")
+        if not ok or buffer is None:
+            raise ValueError("图像编码失败")
+        return buffer.tobytes()
+
+    def save_annotated(self, img_bgr: np.ndarray, predictions: List[Dict], path: str) -> bytes:
+        """原地绘制标注并只编码一次，直接写入文件，返回编码后的JPEG字节"""
+        self.draw_predictions(img_bgr, predictions)
+        jpeg = self.encode_jpeg(img_bgr)
+        with open(path, "wb") as f:
+            f.write(jpeg)
+        return jpeg
+
     def annotate_image(self, image_bytes: bytes, predictions: List[Dict]) -> str:
         """绘制标注框并返回base64编码的图像"""
         try:
-            # 使用与预测相同的预处理获取RGB格式图像
-            img_rgb = self.preprocess(image_bytes)
-            
-            # 使用已有的预测结果，避免重复调用模型
-            if predictions and len(predictions) > 0:
-                # 从已有的预测结果构建要显示的边界框
-                img_with_boxes = img_rgb.copy()
-                
-                for pred in predictions:
-                    # 获取边界框坐标
-                    x1 = int(pred["bbox"]["x1"])
-                    y1 = int(pred["bbox"]["y1"])
-                    x2 = int(pred["bbox"]["x2"])
-                    y2 = int(pred["bbox"]["y2"])
-                    
-                    # 绘制边界框
-                    cv2.rectangle(img_with_boxes, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                    
-                    # 绘制标签
-                    label = f"{pred['class']} {pred['confidence']:.2f}"
-                    cv2.putText(img_with_boxes, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 
-                               0.5, (0, 255, 0), 2)
-                
-                # 转回BGR用于OpenCV处理
-                img_bgr = cv2.cvtColor(img_with_boxes, cv2.COLOR_RGB2BGR)
-            else:
-                # 如果没有预测结果，使用原始图像
-                img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
-            
-            # 使用更高质量参数进行JPEG编码
-            _, buffer = cv2.imencode('.jpg', img_bgr, [cv2.IMWRITE_JPEG_QUALITY, 95])
-            if buffer is None:
-                raise ValueError("图像编码失败")
-                
-            base64_image = base64.b64encode(buffer).decode('utf-8')
+            img_bgr = self.decode(image_bytes)
+            self.draw_predictions(img_bgr, predictions or [])
+            base64_image = base64.b64encode(self.encode_jpeg(img_bgr)).decode('utf-8')
             return f"data:image/jpeg;base64,{base64_image}"
         except Exception as e:
             print(f"标注图像时出错: {str(e)}")
-            try:
-                # 如果标注失败，返回原始图像
-                nparr = np.frombuffer(image_bytes, np.uint8)
-                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                _, buffer = cv2.imencode('.jpg', img)
-                base64_image = base64.b64encode(buffer).decode('utf-8')
-                return f"data:image/jpeg;base64,{base64_image}"
-            except:
-                return ""
+            return ""
             
     def process_image(self, image_bytes: bytes):
-        """整合预测和标注的完整流程"""
+        """整合预测和标注的完整流程：解码一次、推理一次、编码一次"""
         try:
-            # 预处理图像
-            img_rgb = self.preprocess(image_bytes)
-            
-            # 预测
-            results = self.model(
-                img_rgb, 
-                imgsz=self.img_size,
-                conf=self.conf_thresh,
-                verbose=False
-            )
-            
-            # 解析结果
-            predictions = self.parse_results(results)
-            
-            # 使用结果的标注图像 - 使用YOLOv12原生plot方法
-            annotated_img = results[0].plot()
-            annotated_img_bgr = cv2.cvtColor(annotated_img, cv2.COLOR_RGB2BGR)
-            
-            # 编码为base64
-            _, buffer = cv2.imencode('.jpg', annotated_img_bgr, [cv2.IMWRITE_JPEG_QUALITY, 95])
-            base64_image = base64.b64encode(buffer).decode('utf-8')
+            img_bgr, img_rgb = self.decode_for_inference(image_bytes)
+            predictions = self.predict_batch([img_rgb])[0]
+            self.draw_predictions(img_bgr, predictions)
+            base64_image = base64.b64encode(self.encode_jpeg(img_bgr)).decode('utf-8')
             
             return {
                 "predictions": predictions,
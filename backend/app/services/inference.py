@@ -0,0 +1,174 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from app.core.config import get_settings
+from app.core.metrics import gauge
+from app.services.detector import detector, PestDetector
+
+settings = get_settings()
+
+class InferenceEngine:
+    """
+    推理引擎：把来自多个协程的推理请求放入队列，
+    在最大批次/最大等待时间窗口内合并成动态微批次，
+    再在专用线程中一次性调用模型，避免阻塞事件循环。
+    """
+    def __init__(
+        self,
+        detector: PestDetector,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10,
+        queue_size: int = 256
+    ):
+        self.detector = detector
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.queue_size = queue_size
+        # 模型不是线程安全的，只使用一个专用线程执行推理
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # 统计信息
+        self._requests = 0
+        self._batches = 0
+        self._batch_size_counts: Dict[int, int] = {}
+        self._max_batch_seen = 0
+        self._busy_time = 0.0
+
+    def _ensure_started(self):
+        """在当前事件循环中惰性启动批处理协程，协程退出后重新启动时沿用原队列"""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def predict(self, image: np.ndarray) -> List[Dict]:
+        """提交单张已预处理图像（RGB）并等待其预测结果"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, future))
+        self._requests += 1
+        return await future
+
+    async def predict_many(self, images: List[np.ndarray]) -> List[List[Dict]]:
+        """
+        对已知的一组图像（如批量上传）按形状分组后直接进行批量推理，
+        与微批次共用同一推理线程，保证模型不会被并发调用。
+        """
+        if not images:
+            return []
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(
+                self._executor, self.detector.predict_grouped, images, self.max_batch_size
+            )
+        finally:
+            self._busy_time += time.perf_counter() - start
+            self._requests += len(images)
+
+    async def _collect_batch(self, batch: List[Tuple[np.ndarray, asyncio.Future]]):
+        """取出第一个请求后，在等待窗口内尽量凑满一个批次（直接追加到 batch，被取消时已取出的请求不会丢失）"""
+        batch.append(await self._queue.get())
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        # 窗口结束时队列中已就绪的请求也一并带上
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+    async def _run(self):
+        """批处理主循环，退出（被取消或出现异常）时让所有未完成的请求以异常结束，避免调用方一直等待"""
+        batch: List[Tuple[np.ndarray, asyncio.Future]] = []
+        try:
+            await self._run_batches(batch)
+        finally:
+            error = RuntimeError("推理引擎已停止")
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+    async def _run_batches(self, batch: List[Tuple[np.ndarray, asyncio.Future]]):
+        """逐批处理请求，batch 保存当前正在处理的批次，供 _run 退出时清理"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch.clear()
+            await self._collect_batch(batch)
+            # 跳过已被取消的请求（例如客户端断开）
+            batch[:] = [(image, future) for image, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            images = [image for image, _ in batch]
+            start = time.perf_counter()
+            try:
+                outputs = await loop.run_in_executor(self._executor, self.detector.predict_batch, images)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                self._busy_time += time.perf_counter() - start
+
+            size = len(batch)
+            self._batches += 1
+            self._batch_size_counts[size] = self._batch_size_counts.get(size, 0) + 1
+            self._max_batch_seen = max(self._max_batch_seen, size)
+
+            for (_, future), predictions in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(predictions)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回队列深度与批次大小等运行指标"""
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_capacity": self.queue_size,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "requests": self._requests,
+            "batches": self._batches,
+            "avg_batch_size": round(self._requests_batched() / self._batches, 3) if self._batches else 0,
+            "max_batch_seen": self._max_batch_seen,
+            "batch_size_counts": dict(sorted(self._batch_size_counts.items())),
+            "busy_seconds": round(self._busy_time, 3)
+        }
+
+    def _requests_batched(self) -> int:
+        return sum(size * count for size, count in self._batch_size_counts.items())
+
+    async def close(self):
+        """停止批处理协程并释放推理线程"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self._executor.shutdown(wait=False)
+
+# 全局推理引擎实例
+inference_engine = InferenceEngine(
+    detector,
+    max_batch_size=settings.inference_max_batch,
+    max_wait_ms=settings.inference_max_wait_ms,
+    queue_size=settings.inference_queue_size
+)
+
+gauge(
+    "inference_queue_depth",
+    "进程内推理引擎等待中的请求数",
+    callback=lambda: inference_engine.stats()["queue_depth"]
+)
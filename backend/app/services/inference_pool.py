@@ -0,0 +1,86 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+from app.core.config import get_settings
+
+settings = get_settings()
+
+# 工作进程内的检测器实例（每个进程各自持有一份模型）
+_worker_detector = None
+
+def _init_worker(num_threads: int):
+    """工作进程初始化：固定torch线程数并加载独立的YOLO模型"""
+    global _worker_detector
+    import torch
+    torch.set_num_threads(max(1, num_threads))
+    torch.set_num_interop_threads(1)
+    # 避免OpenCV在每个进程内再开线程池造成超额订阅
+    import cv2
+    cv2.setNumThreads(1)
+    # 导入时即在本进程内加载模型
+    from app.services.detector import detector
+    _worker_detector = detector
+
+def _process_file(image_bytes: bytes, upload_name: str, annotated_name: str) -> Tuple[List[Dict], Optional[bytes]]:
+    """在工作进程中完成单个文件的保存、解码、推理和标注，返回预测结果和标注图像JPEG字节"""
+    upload_path = os.path.join("app", "static", "uploads", upload_name)
+    with open(upload_path, "wb") as f:
+        f.write(image_bytes)
+
+    img_bgr, img_rgb = _worker_detector.decode_for_inference(image_bytes)
+    predictions = _worker_detector.predict_batch([img_rgb])[0]
+    if not predictions:
+        return predictions, None
+
+    annotated_path = os.path.join("app", "static", "annotated", annotated_name)
+    return predictions, _worker_detector.save_annotated(img_bgr, predictions, annotated_path)
+
+class InferencePool:
+    """多进程分片推理池，用于批量上传"""
+    def __init__(self, workers: int, threads_per_worker: int = 1):
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """惰性创建进程池（使用spawn，避免fork已初始化的torch状态）"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.threads_per_worker,)
+            )
+        return self._executor
+
+    async def process(self, items: List[Tuple[bytes, str, str]]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        将文件（图像字节、上传文件名、标注文件名）分发到工作进程并行处理，按提交顺序逐个产出结果。
+        每个结果包含 predictions 和 annotated（标注图像JPEG字节），失败时包含 error。
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        futures = [
+            loop.run_in_executor(executor, _process_file, image_bytes, upload_name, annotated_name)
+            for image_bytes, upload_name, annotated_name in items
+        ]
+        for future in futures:
+            try:
+                predictions, annotated = await future
+                yield {"predictions": predictions, "annotated": annotated}
+            except Exception as e:
+                yield {"error": str(e)}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+# 全局进程池实例
+inference_pool = InferencePool(settings.batch_workers, settings.batch_worker_threads)
@@ -0,0 +1,56 @@
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.detection import Detection
+from app.models.history import History
+from app.services.rollup import record_predictions
+
+# 每条多行 INSERT 包含的记录数（asyncpg 单条语句最多 32767 个参数）
+INSERT_CHUNK_SIZE = 1000
+
+def _chunks(rows: List[Dict[str, Any]], size: int = INSERT_CHUNK_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    for offset in range(0, len(rows), size):
+        yield rows[offset:offset + size]
+
+def _detection_rollup_records(rows: List[Dict[str, Any]]) -> List[Tuple[Optional[int], datetime, List[Dict]]]:
+    """从检测记录中提取写入汇总表所需的字段"""
+    return [(row["user_id"], row["created_at"], row["results"]) for row in rows]
+
+def _history_rollup_records(records: List[History]) -> List[Tuple[Optional[int], datetime, List[Dict]]]:
+    """只有图像记录参与统计"""
+    return [
+        (record.user_id, record.timestamp, record.result.get("predictions"))
+        for record in records
+        if record.type == "image" and isinstance(record.result, dict) and record.timestamp
+    ]
+
+async def insert_detections(db: AsyncSession, rows: List[Dict[str, Any]]):
+    """
+    批量写入检测记录并更新汇总表（由调用方提交）。
+    每批生成一条多行 INSERT，而不是逐条 add 后由 flush 产生多条语句。
+    """
+    if not rows:
+        return
+    for chunk in _chunks(rows):
+        await db.execute(insert(Detection).values(chunk))
+    await record_predictions(db, "detections", _detection_rollup_records(rows))
+
+async def insert_history(db: AsyncSession, rows: List[Dict[str, Any]]) -> List[History]:
+    """
+    批量写入历史记录并更新汇总表（由调用方提交），返回实际写入的记录。
+    通过 RETURNING 直接取回写入结果，不再逐条 refresh；
+    ID 已存在的记录被跳过，重复导入同一批数据不会产生重复记录。
+    """
+    inserted: List[History] = []
+    for chunk in _chunks(rows):
+        stmt = (
+            pg_insert(History)
+            .values(chunk)
+            .on_conflict_do_nothing(index_elements=[History.id])
+            .returning(History)
+        )
+        inserted.extend((await db.scalars(stmt)).all())
+    await record_predictions(db, "history", _history_rollup_records(inserted))
+    return inserted
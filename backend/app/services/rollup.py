@@ -0,0 +1,142 @@
+from datetime import datetime, date
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from sqlalchemy import text, bindparam, func, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.stats import DetectionDailyStats
+
+# 从原始记录重建汇总表时使用的数据源，展开为 (user_id, ts, cls, conf) 行
+ROLLUP_SOURCES = {
+    "history": """
+        SELECT h.user_id, h.timestamp AS ts,
+               COALESCE(p->>'class', p->>'pest', '未知') AS cls,
+               (p->>'confidence')::float AS conf
+        FROM history h
+        CROSS JOIN LATERAL jsonb_array_elements(
+            CASE WHEN jsonb_typeof(h.result->'predictions') = 'array'
+                 THEN h.result->'predictions' ELSE '[]'::jsonb END
+        ) AS p
+        WHERE h.type = 'image' AND h.timestamp IS NOT NULL
+    """,
+    "detections": """
+        SELECT d.user_id, d.created_at AS ts,
+               COALESCE(p->>'class', '未知') AS cls,
+               (p->>'confidence')::float AS conf
+        FROM detections d
+        CROSS JOIN LATERAL jsonb_array_elements(
+            CASE WHEN jsonb_typeof(d.results) = 'array' THEN d.results ELSE '[]'::jsonb END
+        ) AS p
+        WHERE d.created_at IS NOT NULL
+    """,
+}
+
+# (user_id, 时间, 预测结果列表)
+RollupRecord = Tuple[Optional[int], datetime, List[Dict[str, Any]]]
+
+class RollupAccumulator:
+    """在内存中把预测结果按 用户/天/类别 累加为待写入汇总表的行"""
+    def __init__(self):
+        self._groups: Dict[Tuple[Optional[int], date, str], Dict[str, Any]] = {}
+
+    def add(self, user_id: Optional[int], ts: datetime, predictions: Optional[List[Dict[str, Any]]]):
+        for pred in predictions or []:
+            pest_class = pred.get("class") or pred.get("pest") or "未知"
+            conf = float(pred.get("confidence", 0))
+            key = (user_id, ts.date(), pest_class)
+            row = self._groups.get(key)
+            if row is None:
+                self._groups[key] = {
+                    "user_id": user_id,
+                    "day": ts.date(),
+                    "pest_class": pest_class,
+                    "count": 1,
+                    "conf_sum": conf,
+                    "conf_min": conf,
+                    "conf_max": conf
+                }
+            else:
+                row["count"] += 1
+                row["conf_sum"] += conf
+                row["conf_min"] = min(row["conf_min"], conf)
+                row["conf_max"] = max(row["conf_max"], conf)
+
+    def rows(self) -> List[Dict[str, Any]]:
+        return list(self._groups.values())
+
+    def merge(self, rows: Iterable[Dict[str, Any]]):
+        """合并已汇总的行（如分段处理的检查点），day 可以是日期或ISO格式字符串"""
+        for row in rows:
+            day = row["day"] if isinstance(row["day"], date) else date.fromisoformat(row["day"])
+            key = (row["user_id"], day, row["pest_class"])
+            current = self._groups.get(key)
+            if current is None:
+                self._groups[key] = {**row, "day": day}
+            else:
+                current["count"] += row["count"]
+                current["conf_sum"] += row["conf_sum"]
+                current["conf_min"] = min(current["conf_min"], row["conf_min"])
+                current["conf_max"] = max(current["conf_max"], row["conf_max"])
+
+def aggregate(records: Iterable[RollupRecord]) -> List[Dict[str, Any]]:
+    """把一批记录汇总为待写入的行"""
+    accumulator = RollupAccumulator()
+    for user_id, ts, predictions in records:
+        accumulator.add(user_id, ts, predictions)
+    return accumulator.rows()
+
+async def record_predictions(db: AsyncSession, source: str, records: Iterable[RollupRecord]):
+    """增量更新汇总表（与原始记录在同一事务中执行，由调用方提交）"""
+    await record_rows(db, source, aggregate(records))
+
+async def record_rows(db: AsyncSession, source: str, rows: List[Dict[str, Any]]):
+    """把已汇总的行合并进汇总表，按 INSERT_CHUNK_SIZE 分块，每块一条多行 upsert 语句（避免超出绑定参数上限）"""
+    # persistence 在模块级导入了本模块，这里延迟导入以避免循环引用
+    from app.services.persistence import _chunks
+    if not rows:
+        return
+    for row in rows:
+        row["source"] = source
+    for chunk in _chunks(rows):
+        stmt = pg_insert(DetectionDailyStats).values(chunk)
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_detection_daily_stats_key",
+            set_={
+                "count": DetectionDailyStats.count + excluded["count"],
+                "conf_sum": DetectionDailyStats.conf_sum + excluded["conf_sum"],
+                "conf_min": func.least(DetectionDailyStats.conf_min, excluded["conf_min"]),
+                "conf_max": func.greatest(DetectionDailyStats.conf_max, excluded["conf_max"])
+            }
+        )
+        await db.execute(stmt)
+
+async def rebuild(db: AsyncSession, source: str, days: Optional[Iterable[date]] = None):
+    """
+    从原始记录重建指定数据源的汇总数据（由调用方提交）。
+    指定 days 时只重建这些天，用于删除记录后修正计数和最小/最大置信度。
+    """
+    if source not in ROLLUP_SOURCES:
+        raise ValueError(f"不支持从原始记录重建的数据源: {source}")
+
+    day_list = sorted(set(days)) if days is not None else None
+    if day_list is not None and not day_list:
+        return
+
+    cleanup = delete(DetectionDailyStats).where(DetectionDailyStats.source == source)
+    if day_list is not None:
+        cleanup = cleanup.where(DetectionDailyStats.day.in_(day_list))
+    await db.execute(cleanup)
+
+    day_filter = "WHERE p.ts::date IN :days" if day_list is not None else ""
+    stmt = text(f"""
+        INSERT INTO detection_daily_stats (source, user_id, day, class, count, conf_sum, conf_min, conf_max)
+        SELECT :source, p.user_id, p.ts::date, p.cls, count(*), COALESCE(sum(p.conf), 0), min(p.conf), max(p.conf)
+        FROM ({ROLLUP_SOURCES[source]}) AS p
+        {day_filter}
+        GROUP BY p.user_id, p.ts::date, p.cls
+    """)
+    params: Dict[str, Any] = {"source": source}
+    if day_list is not None:
+        stmt = stmt.bindparams(bindparam("days", expanding=True))
+        params["days"] = day_list
+    await db.execute(stmt, params)
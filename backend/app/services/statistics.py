@@ -0,0 +1,175 @@
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+from redis.asyncio import Redis
+from app.core.redis import InstrumentedRedis
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import get_settings
+
+settings = get_settings()
+
+# 统计数据来源，对应汇总表 detection_daily_stats 的 source 列
+STATISTICS_SOURCES = ("history", "detections", "video")
+
+TREND_INTERVALS = ("day", "week", "month")
+
+class StatisticsService:
+    """检测统计服务：读取按天增量维护的汇总表，并按时间范围缓存结果，有新记录写入时整体失效"""
+    VERSION_KEY = "statistics:version"
+
+    def __init__(self):
+        self.redis: Optional[Redis] = None
+
+    async def get_redis(self) -> Redis:
+        """获取Redis连接"""
+        if self.redis is None:
+            self.redis = InstrumentedRedis.from_url(settings.redis_url)
+        return self.redis
+
+    async def invalidate(self):
+        """有新的检测或历史记录写入时调用：递增版本号使所有缓存失效"""
+        try:
+            redis = await self.get_redis()
+            await redis.incr(self.VERSION_KEY)
+        except Exception as e:
+            print(f"统计缓存失效失败: {str(e)}")
+
+    async def get_statistics(
+        self,
+        db: AsyncSession,
+        start: datetime,
+        end: datetime,
+        source: str = "history",
+        interval: str = "day",
+        compare: bool = False,
+        user_id: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        获取指定时间范围的统计数据，compare为True时同时返回上一个等长周期的数据。
+        user_id 不为None时只统计该用户的记录，为None时统计所有用户。
+        """
+        params = {
+            "user_id": user_id,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "source": source,
+            "interval": interval,
+            "compare": compare
+        }
+        cache_key = await self._cache_key(params)
+        if cache_key:
+            cached = await self._cache_get(cache_key)
+            if cached is not None:
+                return cached
+
+        result = await self._compute(db, start, end, source, interval, user_id)
+        if compare:
+            previous_end = start - timedelta(microseconds=1)
+            previous = await self._compute(db, start - (end - start), previous_end, source, interval, user_id)
+            current_total = result["totalDetections"]
+            previous_total = previous["totalDetections"]
+            result["comparison"] = {
+                "previous": previous,
+                "currentData": {"total": current_total},
+                "previousData": {"total": previous_total},
+                "changeRate": round((current_total - previous_total) / previous_total * 100, 2)
+                if previous_total > 0 else None
+            }
+
+        if cache_key:
+            await self._cache_set(cache_key, result)
+        return result
+
+    async def _compute(
+        self,
+        db: AsyncSession,
+        start: datetime,
+        end: datetime,
+        source: str,
+        interval: str,
+        user_id: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """在汇总表上执行聚合查询，统计粒度为天"""
+        if interval not in TREND_INTERVALS:
+            raise ValueError(f"不支持的时间粒度: {interval}")
+        if source not in STATISTICS_SOURCES:
+            raise ValueError(f"不支持的数据来源: {source}")
+        bind = {"source": source, "start": start.date(), "end": end.date()}
+        where = "source = :source AND day >= :start AND day <= :end"
+        if user_id is not None:
+            bind["user_id"] = user_id
+            where += " AND user_id = :user_id"
+
+        summary = (await db.execute(text(f"""
+            SELECT COALESCE(sum(count), 0), count(DISTINCT class),
+                   COALESCE(sum(conf_sum) / NULLIF(sum(count), 0), 0)
+            FROM detection_daily_stats WHERE {where}
+        """), bind)).one()
+
+        distribution = (await db.execute(text(f"""
+            SELECT class, sum(count) AS value, sum(conf_sum) / NULLIF(sum(count), 0) AS avg_conf,
+                   min(conf_min) AS min_conf, max(conf_max) AS max_conf
+            FROM detection_daily_stats WHERE {where}
+            GROUP BY class ORDER BY value DESC, class
+        """), bind)).all()
+
+        # interval 已按 TREND_INTERVALS 校验，可直接内联
+        trunc = f"date_trunc('{interval}', day)"
+        trend = (await db.execute(text(f"""
+            SELECT to_char({trunc}, 'YYYY-MM-DD') AS date, sum(count)
+            FROM detection_daily_stats WHERE {where}
+            GROUP BY {trunc} ORDER BY {trunc}
+        """), bind)).all()
+
+        return {
+            "totalDetections": int(summary[0]),
+            "uniquePestTypes": summary[1],
+            "averageConfidence": float(summary[2]),
+            "pestDistribution": [
+                {
+                    "name": name,
+                    "value": int(value),
+                    "avgConfidence": float(avg_conf or 0),
+                    "minConfidence": float(min_conf or 0),
+                    "maxConfidence": float(max_conf or 0)
+                }
+                for name, value, avg_conf, min_conf, max_conf in distribution
+            ],
+            "trendData": [{"date": date, "count": int(count)} for date, count in trend],
+            "range": {
+                "startTime": int(start.timestamp() * 1000),
+                "endTime": int(end.timestamp() * 1000)
+            }
+        }
+
+    async def _cache_key(self, params: Dict[str, Any]) -> Optional[str]:
+        """缓存键包含当前版本号，Redis不可用时不使用缓存"""
+        try:
+            redis = await self.get_redis()
+            version = int(await redis.get(self.VERSION_KEY) or 0)
+        except Exception as e:
+            print(f"读取统计缓存版本失败: {str(e)}")
+            return None
+        digest = hashlib.blake2b(json.dumps(params, sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+        return f"statistics:{version}:{digest}"
+
+    async def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            redis = await self.get_redis()
+            data = await redis.get(key)
+            return json.loads(data) if data else None
+        except Exception as e:
+            print(f"读取统计缓存失败: {str(e)}")
+            return None
+
+    async def _cache_set(self, key: str, value: Dict[str, Any]):
+        try:
+            redis = await self.get_redis()
+            await redis.set(key, json.dumps(value, ensure_ascii=False), ex=settings.statistics_cache_ttl)
+        except Exception as e:
+            print(f"写入统计缓存失败: {str(e)}")
+
+# 创建单例服务
+statistics_service = StatisticsService()
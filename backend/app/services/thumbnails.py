@@ -0,0 +1,155 @@
+import base64
+import binascii
+from abc import ABC, abstractmethod
+import hashlib
+import os
+import re
+import tempfile
+from typing import Dict, Optional, Tuple, Type
+from app.core.config import Settings, get_settings
+
+settings = get_settings()
+
+# 缩略图访问路径前缀（由 app/routers/history.py 提供服务）
+THUMBNAIL_URL_PREFIX = "/api/history/thumbnails/"
+
+# 支持的图片类型及对应扩展名
+THUMBNAIL_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+}
+MEDIA_TYPES = {".jpg": "image/jpeg", ".png": "image/png", ".webp": "image/webp", ".gif": "image/gif"}
+
+KEY_PATTERN = re.compile(r"^[0-9a-f]{40}\.(jpg|png|webp|gif)$")
+DATA_URL_PATTERN = re.compile(r"^data:(image/[a-z+.-]+);base64,(.*)$", re.DOTALL)
+
+def is_thumbnail_key(value: Optional[str]) -> bool:
+    """是否为存储后端生成的键（否则为前端直接提供的图片URL）"""
+    return bool(value) and KEY_PATTERN.match(value) is not None
+
+def media_type(key: str) -> str:
+    return MEDIA_TYPES[os.path.splitext(key)[1]]
+
+def thumbnail_url(ref: Optional[str]) -> Optional[str]:
+    """把数据库中保存的缩略图引用转换为可访问的URL"""
+    if not ref:
+        return None
+    if is_thumbnail_key(ref):
+        return f"{THUMBNAIL_URL_PREFIX}{ref}"
+    return ref
+
+def parse_data_url(value: str) -> Tuple[bytes, str]:
+    """解析 data:image/...;base64,... 格式的缩略图，返回 (图片字节, 扩展名)"""
+    match = DATA_URL_PATTERN.match(value)
+    if not match:
+        raise ValueError("缩略图不是有效的 data URL")
+    ext = THUMBNAIL_TYPES.get(match.group(1).lower())
+    if ext is None:
+        raise ValueError(f"不支持的缩略图类型: {match.group(1)}")
+    try:
+        data = base64.b64decode(match.group(2), validate=False)
+    except (binascii.Error, ValueError):
+        raise ValueError("缩略图 base64 数据无效")
+    if not data:
+        raise ValueError("缩略图数据为空")
+    if len(data) > settings.thumbnail_max_bytes:
+        raise ValueError("缩略图过大")
+    return data, ext
+
+class ThumbnailStore(ABC):
+    """缩略图存储后端：按内容摘要寻址，相同内容只保存一份"""
+
+    @classmethod
+    @abstractmethod
+    def from_settings(cls, settings: Settings) -> "ThumbnailStore":
+        """按配置创建存储后端"""
+
+    @staticmethod
+    def make_key(data: bytes, ext: str) -> str:
+        return hashlib.blake2b(data, digest_size=20).hexdigest() + ext
+
+    @abstractmethod
+    def put(self, data: bytes, ext: str) -> str:
+        """保存缩略图并返回键"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """读取缩略图，不存在时返回None"""
+
+    def local_path(self, key: str) -> Optional[str]:
+        """本地文件路径（可直接用文件响应发送），非本地后端返回None"""
+        return None
+
+    def store(self, value: Optional[str]) -> Optional[str]:
+        """
+        保存前端提交的缩略图并返回数据库中保存的引用：
+        data URL 写入存储后返回键，已经是URL（例如标注图像地址）时原样保存。
+        """
+        if not value:
+            return None
+        if value.startswith("data:"):
+            data, ext = parse_data_url(value)
+            return self.put(data, ext)
+        return value
+
+class LocalThumbnailStore(ThumbnailStore):
+    """本地文件存储，按键的前两位分目录，避免单个目录文件过多"""
+
+    def __init__(self, root: str):
+        # 目录在首次写入时创建，导入模块不产生文件系统副作用
+        self.root = root
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "LocalThumbnailStore":
+        return cls(settings.thumbnail_dir)
+
+    def _path(self, key: str) -> str:
+        if not is_thumbnail_key(key):
+            raise ValueError(f"无效的缩略图键: {key}")
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, data: bytes, ext: str) -> str:
+        key = self.make_key(data, ext)
+        path = self._path(key)
+        if os.path.exists(path):
+            return key
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # 先写临时文件再原子替换，并发写入同一内容时不会读到半个文件
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return key
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.local_path(key)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        return path if os.path.exists(path) else None
+
+# 可用的存储后端，新增后端（例如对象存储）时实现 from_settings 读取自己的配置并在此注册
+THUMBNAIL_BACKENDS: Dict[str, Type[ThumbnailStore]] = {
+    "local": LocalThumbnailStore,
+}
+
+def create_thumbnail_store(backend: str) -> ThumbnailStore:
+    if backend not in THUMBNAIL_BACKENDS:
+        raise ValueError(f"不支持的缩略图存储后端: {backend}")
+    return THUMBNAIL_BACKENDS[backend].from_settings(settings)
+
+# 全局单例
+thumbnail_store = create_thumbnail_store(settings.thumbnail_backend)
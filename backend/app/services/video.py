@@ -2,18 +2,75 @@ import cv2
 import numpy as np
 import tempfile
 import os
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, List, Dict, Any, Optional, Set, Tuple
 import asyncio
 from app.core.config import get_settings
 from app.services.detector import detector
-import base64
+from app.services.inference import inference_engine
+from app.services.video_pipeline import FrameReader, FrameWriter, AdaptiveSampler, scan_keyframes, seek_positions
+from app.services.video_tracking import VideoTracker
+from app.services.video_upload import upload_too_large
+from app.services.video_segments import (
+    MERGE_PART, TRACK_ID_STRIDE, concat_clips, merge_job_id, merge_outcomes, parse_job_id,
+    plan_segments, segment_index, segment_job_id, stitch_tracks
+)
+from app.services.rollup import RollupAccumulator, record_rows
+from app.services.statistics import statistics_service
+from app.core.database import async_session_maker
+from app.core.metrics import histogram, gauge, counter
+from datetime import datetime
 import time
 import uuid
 from redis.asyncio import Redis
+from app.core.redis import InstrumentedRedis
 import shutil
+import hashlib
+import json
 
 settings = get_settings()
 
+# 视频任务队列键
+VIDEO_STAGE_SECONDS = histogram(
+    "video_stage_seconds",
+    "单个视频任务各阶段累计耗时（decode/inference/tracking/annotate/write/merge/total）",
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0),
+    labelnames=("stage",)
+)
+VIDEO_QUEUE_DEPTH = gauge("video_queue_depth", "视频任务队列长度", labelnames=("queue",))
+VIDEO_SAMPLED_FRAMES = counter(
+    "video_sampled_frames_total",
+    "候选帧的采样结果（sampled 推理 / skipped 自适应采样跳过）",
+    labelnames=("result",)
+)
+
+VIDEO_TASKS_QUEUE = "video_tasks_queue"
+VIDEO_TASKS_PROCESSING = "video_tasks_processing"
+
+def task_lease_key(job_id: str) -> str:
+    """工作进程处理队列任务时持有的租约"""
+    return f"video_task_lease:{job_id}"
+
+# 上传视频的文件头特征：(偏移, 魔数)
+VIDEO_SIGNATURES = (
+    (4, b"ftyp"),                # MP4 / MOV / 3GP
+    (4, b"moov"),                # 旧版 QuickTime
+    (4, b"mdat"),
+    (4, b"wide"),
+    (4, b"free"),
+    (0, b"\x1a\x45\xdf\xa3"),    # MKV / WebM（EBML）
+    (8, b"AVI "),                # AVI（RIFF）
+    (0, b"FLV"),
+)
+VIDEO_HEADER_BYTES = 16
+
+# 结果保留时间（7天）
+RESULT_TTL = 60 * 60 * 24 * 7
+
+# 状态查询接口返回的任务字段
+TASK_STATUS_FIELDS = (
+    "id", "status", "progress", "created_at", "completed_at", "error", "attempts", "segments", "segments_done"
+)
+
 # 视频处理任务状态
 class VideoTaskStatus:
     PENDING = "pending"
@@ -21,6 +78,22 @@ class VideoTaskStatus:
     COMPLETED = "completed"
     FAILED = "failed"
 
+class ProgressThrottle:
+    """进度写入节流：距上次写入超过时间间隔且进度变化达到阈值时才写入"""
+    def __init__(self, min_interval: float = 1.0, min_delta: int = 1):
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self._last_time = 0.0
+        self._last_progress = -1
+
+    def ready(self, progress: int) -> bool:
+        now = time.monotonic()
+        if progress - self._last_progress < self.min_delta or now - self._last_time < self.min_interval:
+            return False
+        self._last_time = now
+        self._last_progress = progress
+        return True
+
 class VideoProcessor:
     def __init__(self):
         self.redis: Optional[Redis] = None
@@ -28,11 +101,164 @@ class VideoProcessor:
     async def get_redis(self) -> Redis:
         """获取Redis连接"""
         if self.redis is None:
-            self.redis = Redis.from_url(settings.redis_url)
+            self.redis = InstrumentedRedis.from_url(settings.redis_url)
         return self.redis
     
-    async def create_task(self, video_bytes: bytes) -> str:
-        """创建视频处理任务，返回任务ID"""
+    @staticmethod
+    def _task_key(task_id: str) -> str:
+        return f"video_task:{task_id}"
+    
+    @staticmethod
+    def _decode_fields(fields: Dict[Any, Any]) -> Dict[str, Any]:
+        """Redis哈希中的每个字段值都是JSON编码"""
+        return {
+            (k.decode() if isinstance(k, bytes) else k): json.loads(v)
+            for k, v in fields.items() if v is not None
+        }
+    
+    async def load_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """读取完整任务信息，不存在时返回None"""
+        redis = await self.get_redis()
+        data = await redis.hgetall(self._task_key(task_id))
+        if not data:
+            return None
+        return self._decode_fields(data)
+    
+    async def get_task_fields(self, task_id: str, *fields: str) -> Dict[str, Any]:
+        """按字段读取任务信息，不存在的字段不返回"""
+        redis = await self.get_redis()
+        values = await redis.hmget(self._task_key(task_id), fields)
+        return self._decode_fields(dict(zip(fields, values)))
+    
+    async def save_task(self, task_id: str, task_info: Dict[str, Any], pipe=None):
+        """写入任务字段（只更新给出的字段），可传入pipeline与其他写操作合并发送"""
+        mapping = {key: json.dumps(value, ensure_ascii=False) for key, value in task_info.items()}
+        if pipe is not None:
+            pipe.hset(self._task_key(task_id), mapping=mapping)
+            return
+        redis = await self.get_redis()
+        await redis.hset(self._task_key(task_id), mapping=mapping)
+    
+    async def begin_attempt(self, job_id: str, worker_id: str) -> Optional[int]:
+        """
+        原子地增加尝试次数并记录处理进程，任务不存在时返回None。
+        分段任务和合并任务的尝试次数单独记录在分段哈希中。
+        """
+        task_id, part = parse_job_id(job_id)
+        redis = await self.get_redis()
+        if not await redis.exists(self._task_key(task_id)):
+            return None
+        async with redis.pipeline(transaction=True) as pipe:
+            if part is None:
+                pipe.hincrby(self._task_key(task_id), "attempts", 1)
+            else:
+                pipe.hincrby(self._segments_key(task_id), f"attempts:{part}", 1)
+            pipe.hset(self._task_key(task_id), "worker", json.dumps(worker_id))
+            attempts, _ = await pipe.execute()
+        return attempts
+    
+    async def get_job_attempts(self, job_id: str) -> Optional[int]:
+        """读取队列任务的尝试次数，视频任务不存在时返回None"""
+        task_id, part = parse_job_id(job_id)
+        redis = await self.get_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.exists(self._task_key(task_id))
+            if part is None:
+                pipe.hget(self._task_key(task_id), "attempts")
+            else:
+                pipe.hget(self._segments_key(task_id), f"attempts:{part}")
+            exists, attempts = await pipe.execute()
+        if not exists:
+            return None
+        return int(json.loads(attempts)) if attempts else 0
+    
+    async def fail_job(self, job_id: str, error: str):
+        """队列任务多次异常退出时放弃整个视频任务"""
+        task_id, _ = parse_job_id(job_id)
+        task_info = await self.get_task_fields(task_id, "video_path")
+        await self.save_task(task_id, {
+            "status": VideoTaskStatus.FAILED,
+            "error": error,
+            "failed_at": time.time()
+        })
+        segment_plan = await self._load_segment_plan(task_id)
+        if segment_plan is not None:
+            await self._remove_segment_files(task_id, len(segment_plan["segments"]))
+        self.remove_video_file(task_info)
+    
+    @staticmethod
+    def remove_video_file(task_info: Dict[str, Any]):
+        """删除任务的上传视频文件"""
+        try:
+            video_path = task_info.get("video_path")
+            if video_path and os.path.exists(video_path):
+                os.unlink(video_path)
+        except OSError:
+            pass
+    
+    @staticmethod
+    def _validate_video_file(video_path: str):
+        """只检查文件头和容器信息（不解码视频帧），无效时抛出 ValueError"""
+        with open(video_path, "rb") as f:
+            header = f.read(VIDEO_HEADER_BYTES)
+        if not any(header[offset:offset + len(magic)] == magic for offset, magic in VIDEO_SIGNATURES):
+            raise ValueError("不支持的视频格式，请上传 mp4、mov、avi、mkv、webm 或 flv 文件")
+        cap = cv2.VideoCapture(video_path)
+        try:
+            if not cap.isOpened() or cap.get(cv2.CAP_PROP_FPS) <= 0:
+                raise ValueError("视频格式无效或不受支持")
+        finally:
+            cap.release()
+    
+    async def save_upload(self, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """
+        把上传的视频内容（见 video_upload.iter_upload）直接写入共享的视频目录，边写边计算哈希并检查大小，
+        每个连接的内存占用只有一个写入分块。超过大小限制、文件为空或格式无效时删除文件并抛出 ValueError。
+        返回 {"video_path", "size", "content_hash"}。
+        """
+        os.makedirs(settings.video_upload_dir, exist_ok=True)
+        fd, video_path = tempfile.mkstemp(suffix=".mp4", dir=settings.video_upload_dir)
+        hasher = hashlib.blake2b(digest_size=16)
+        size = 0
+        buffer = bytearray()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for piece in chunks:
+                    size += len(piece)
+                    if size > settings.video_max_upload_bytes:
+                        raise upload_too_large(settings.video_max_upload_bytes)
+                    hasher.update(piece)
+                    buffer += piece
+                    # 请求体按网络分块到达，攒满一个写入分块再写盘
+                    if len(buffer) >= settings.video_upload_chunk_size:
+                        await asyncio.to_thread(f.write, bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await asyncio.to_thread(f.write, bytes(buffer))
+            if size == 0:
+                raise ValueError("视频文件为空")
+            await asyncio.to_thread(self._validate_video_file, video_path)
+        except BaseException:
+            try:
+                os.unlink(video_path)
+            except OSError:
+                pass
+            raise
+        return {"video_path": video_path, "size": size, "content_hash": hasher.hexdigest()}
+    
+    async def create_task(
+        self,
+        video_path: str,
+        options: Optional[Dict[str, Any]] = None,
+        size: Optional[int] = None,
+        content_hash: Optional[str] = None
+    ) -> str:
+        """
+        为已保存到共享目录的视频（见 save_upload）创建处理任务，返回任务ID。创建失败时删除视频文件。
+        options 为处理选项：mode（detect 逐帧检测 / track 跟踪计数）、tracker、detect_interval、
+        sampling（fixed 固定步长 / adaptive 按画面变化和检测活动自适应采样）、
+        decode（full / grab / seek / keyframes）、seek_interval（seek 模式的采样间隔，秒）。
+        """
         try:
             task_id = str(uuid.uuid4())
             
@@ -45,240 +271,675 @@ class VideoProcessor:
                 print(f"Redis连接错误: {str(redis_error)}")
                 raise Exception(f"无法连接到Redis服务: {str(redis_error)}")
             
-            # 确保临时目录存在且可写
-            temp_dir = tempfile.gettempdir()
-            os.makedirs(os.path.join(temp_dir, "yolopest_videos"), exist_ok=True)
-            
-            # 保存视频到临时文件
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4', dir=os.path.join(temp_dir, "yolopest_videos")) as tmp:
-                tmp.write(video_bytes)
-                video_path = tmp.name
-            
-            # 验证视频文件
-            try:
-                cap = cv2.VideoCapture(video_path)
-                if not cap.isOpened():
-                    raise Exception(f"无法打开视频文件: {video_path}")
-                cap.release()
-            except Exception as video_error:
-                os.unlink(video_path)
-                print(f"视频验证失败: {str(video_error)}")
-                raise Exception(f"视频格式无效或不受支持: {str(video_error)}")
-            
             # 创建任务信息
             task_info = {
                 "id": task_id,
                 "status": VideoTaskStatus.PENDING,
                 "video_path": video_path,
+                "size": size,
+                "content_hash": content_hash,
                 "created_at": time.time(),
-                "progress": 0
+                "progress": 0,
+                "attempts": 0,
+                "options": options or {}
             }
             
-            # 保存到Redis
-            await redis.set(f"video_task:{task_id}", repr(task_info))
-            # 将任务添加到队列
-            await redis.lpush("video_tasks_queue", task_id)
-            
-            # 启动后台任务处理
-            asyncio.create_task(self._process_video(task_id))
+            # 保存到Redis，并将任务添加到队列，由独立的视频工作进程（video_worker.py）消费
+            async with redis.pipeline(transaction=True) as pipe:
+                await self.save_task(task_id, task_info, pipe=pipe)
+                pipe.lpush(VIDEO_TASKS_QUEUE, task_id)
+                await pipe.execute()
             
             return task_id
         except Exception as e:
             import traceback
             stack_trace = traceback.format_exc()
             print(f"创建视频处理任务失败: {str(e)}\n{stack_trace}")
+            self.remove_video_file({"video_path": video_path})
             raise
     
-    async def get_task_status(self, task_id: str) -> Dict[str, Any]:
-        """获取任务状态"""
+    async def refresh_queue_metrics(self):
+        """读取等待和处理中的任务数量（在采集指标时调用）"""
         redis = await self.get_redis()
-        task_info_str = await redis.get(f"video_task:{task_id}")
-        
-        if not task_info_str:
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.llen(VIDEO_TASKS_QUEUE)
+            pipe.llen(VIDEO_TASKS_PROCESSING)
+            pending, processing = await pipe.execute()
+        VIDEO_QUEUE_DEPTH.set(pending, queue="pending")
+        VIDEO_QUEUE_DEPTH.set(processing, queue="processing")
+
+    async def get_task_status(self, task_id: str) -> Dict[str, Any]:
+        """获取任务状态（只读取对外公开的字段）"""
+        task_info = await self.get_task_fields(task_id, *TASK_STATUS_FIELDS)
+        if not task_info:
             return {"status": "not_found"}
-            
-        try:
-            task_info = eval(task_info_str)
-            # 移除不需要返回的字段
-            if "video_path" in task_info:
-                del task_info["video_path"]
-            return task_info
-        except Exception as e:
-            return {"status": "error", "message": str(e)}
+        return task_info
     
     async def get_task_result(self, task_id: str) -> Dict[str, Any]:
         """获取任务结果"""
         redis = await self.get_redis()
-        task_info_str = await redis.get(f"video_task:{task_id}")
-        result_str = await redis.get(f"video_result:{task_id}")
-        
-        if not task_info_str:
+        task_info = await self.get_task_fields(task_id, "status", "progress")
+        if not task_info:
             return {"status": "not_found"}
-            
+        
+        result_str = await redis.get(f"video_result:{task_id}")
         if not result_str:
-            task_info = eval(task_info_str)
             return {"status": task_info.get("status", "unknown"), "progress": task_info.get("progress", 0)}
             
         try:
-            result = eval(result_str)
-            return result
+            return json.loads(result_str)
         except Exception as e:
             return {"status": "error", "message": str(e)}
     
-    async def _process_video(self, task_id: str):
-        """处理视频的后台任务"""
+    async def get_frame_results(
+        self,
+        task_id: str,
+        offset: int = 0,
+        limit: int = 100,
+        start_ms: Optional[int] = None,
+        end_ms: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """按时间范围分页读取逐帧检测结果"""
         redis = await self.get_redis()
-        task_info_str = await redis.get(f"video_task:{task_id}")
-        if not task_info_str:
-            return
-            
-        task_info = eval(task_info_str)
-        video_path = task_info["video_path"]
-        
-        # 更新状态为处理中
-        task_info["status"] = VideoTaskStatus.PROCESSING
-        await redis.set(f"video_task:{task_id}", repr(task_info))
-        
+        low = start_ms if start_ms is not None else "-inf"
+        high = end_ms if end_ms is not None else "+inf"
+        key = self._frames_key(task_id)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zcount(key, low, high)
+            pipe.zrangebyscore(key, low, high, start=offset, num=limit)
+            total, members = await pipe.execute()
+        return {
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+            "results": [json.loads(member) for member in members]
+        }
+    
+    @staticmethod
+    def _frames_key(task_id: str) -> str:
+        return f"video_frames:{task_id}"
+    
+    @staticmethod
+    def _annotate_batch(
+        task_id: str,
+        frames_dir: str,
+        fps: float,
+        sampled: List[Tuple[int, np.ndarray]],
+        batch_predictions: List[List[Dict]]
+    ) -> List[Dict[str, Any]]:
+        """在线程池中执行：标注一批帧，有检测结果的帧写为JPEG文件，返回逐帧结果记录"""
+        records = []
+        for (frame_idx, frame), predictions in zip(sampled, batch_predictions):
+            annotated_frame = None
+            if predictions:
+                detector.draw_predictions(frame, predictions)
+                with open(os.path.join(frames_dir, f"frame_{frame_idx}.jpg"), "wb") as f:
+                    f.write(detector.encode_jpeg(frame))
+                annotated_frame = f"/api/static/videos/{task_id}/frame_{frame_idx}.jpg"
+            records.append({
+                "timestamp": int(frame_idx / fps * 1000),  # 毫秒
+                "frame_index": frame_idx,
+                "detections": predictions,
+                "annotated_frame": annotated_frame
+            })
+        return records
+    
+    async def process_task(self, job_id: str):
+        """由视频工作进程调用，执行整段任务、分段任务或合并任务"""
+        task_id, part = parse_job_id(job_id)
+        if part is None:
+            await self._process_video(task_id)
+        elif part == MERGE_PART:
+            await self._merge_segments(task_id)
+        elif segment_index(part) is not None:
+            await self._process_segment(task_id, segment_index(part))
+    
+    @staticmethod
+    async def _record_rollup(rollup: RollupAccumulator):
+        """把视频检测结果合并进检测汇总表，失败不影响任务结果"""
+        try:
+            async with async_session_maker() as db:
+                await record_rows(db, "video", rollup.rows())
+                await db.commit()
+            await statistics_service.invalidate()
+        except Exception as e:
+            print(f"写入视频检测汇总失败: {str(e)}")
+    
+    @staticmethod
+    def _probe_video(video_path: str) -> Dict[str, Any]:
+        """读取视频信息"""
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise Exception("无法打开视频文件")
         try:
-            # 打开视频
-            cap = cv2.VideoCapture(video_path)
-            if not cap.isOpened():
-                raise Exception("无法打开视频文件")
-            
-            # 获取视频信息
             fps = cap.get(cv2.CAP_PROP_FPS)
             frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            video_length = frame_count / fps if fps > 0 else 0
-            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            
-            # 创建临时输出视频文件
-            output_path = f"{tempfile.gettempdir()}/{task_id}_annotated.webm"
-            fourcc = cv2.VideoWriter_fourcc(*'VP80')  # WebM格式
-            out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-            
-            # 初始化结果
-            results = []
-            processed_frames = 0
-            
-            start_time = time.time()
-            
-            # 每隔几帧处理一次（根据视频长度调整）
-            frame_interval = max(1, int(fps / 30))  # 每秒处理30帧
-            
-            frame_idx = 0
-            while cap.isOpened():
-                ret, frame = cap.read()
-                if not ret:
+            return {
+                "fps": fps,
+                "frame_count": frame_count,
+                "video_length": frame_count / fps if fps > 0 else 0,
+                "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            }
+        finally:
+            cap.release()
+    
+    async def _decode_plan(self, video_path: str, options: Dict[str, Any], meta: Dict[str, Any]) -> Dict[str, Any]:
+        """确定解码方式、采样位置和标注视频帧率（整个视频共用，分段处理时保存在分段计划中）"""
+        fps = meta["fps"]
+        # 每隔几帧处理一次（根据视频长度调整）
+        frame_interval = max(1, int(fps / 30))  # 每秒处理30帧
+        
+        # 解码方式：seek 按时间戳稀疏采样，keyframes 只读关键帧（不支持时退回按时间戳采样）
+        decode = options.get("decode", settings.video_decode)
+        positions = None
+        keyframes_detected = None
+        if decode == "keyframes":
+            positions = await asyncio.to_thread(scan_keyframes, video_path)
+            keyframes_detected = positions is not None
+        if decode == "seek" or (decode == "keyframes" and positions is None):
+            positions = seek_positions(fps, meta["frame_count"], float(options.get("seek_interval", settings.video_seek_interval)))
+        
+        # 标注视频只包含解码出的帧：full 与原视频帧率相同，其余方式按平均采样率写入
+        if decode == "full":
+            output_fps = fps
+        elif decode == "grab":
+            output_fps = fps / frame_interval
+        else:
+            output_fps = len(positions) / meta["video_length"] if meta["video_length"] > 0 and positions else 1.0
+        return {
+            "decode": decode,
+            "frame_interval": frame_interval,
+            "positions": positions,
+            "keyframes_detected": keyframes_detected,
+            "output_fps": max(output_fps, 1.0),
+            "sample_rate": fps / frame_interval if decode in ("full", "grab") else output_fps
+        }
+    
+    async def _run_pipeline(
+        self,
+        task_id: str,
+        video_path: str,
+        options: Dict[str, Any],
+        meta: Dict[str, Any],
+        plan: Dict[str, Any],
+        start_frame: int,
+        end_frame: int,
+        output_path: str,
+        track_id_offset: int = 0,
+        report_progress: bool = True
+    ) -> Dict[str, Any]:
+        """
+        处理 [start_frame, end_frame) 区间：逐帧结果写入Redis有序集合，标注帧写为静态文件，
+        标注视频写入 output_path。返回可序列化的处理统计（分段处理时作为检查点保存）。
+        """
+        redis = await self.get_redis()
+        fps = meta["fps"]
+        frame_count = meta["frame_count"]
+        progress_throttle = ProgressThrottle(settings.video_progress_interval, settings.video_progress_min_delta)
+        
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise Exception("无法打开视频文件")
+        fourcc = cv2.VideoWriter_fourcc(*'VP80')  # WebM格式
+        out = cv2.VideoWriter(output_path, fourcc, plan["output_fps"], (meta["width"], meta["height"]))
+        
+        # 初始化结果：逐帧结果写入Redis有序集合（按时间戳排序），标注帧写为静态文件
+        frames_key = self._frames_key(task_id)
+        frames_dir = os.path.join("app", "static", "videos", task_id)
+        os.makedirs(frames_dir, exist_ok=True)
+        processed_frames = 0
+        inference_frames = 0
+        inference_time = 0.0
+        annotate_time = 0.0
+        tracking_time = 0.0
+        rollup = RollupAccumulator()
+        
+        # 跟踪模式：每隔 detect_interval 个采样帧检测一次，中间帧使用卡尔曼滤波预测框
+        tracker = None
+        if options.get("mode", "detect") == "track":
+            tracker = VideoTracker(
+                options.get("tracker", settings.video_tracker),
+                frame_rate=plan["sample_rate"] if plan["sample_rate"] > 0 else 30,
+                detect_interval=int(options.get("detect_interval", settings.video_detect_interval)),
+                id_offset=track_id_offset
+            )
+        
+        # 自适应采样：间隔和活动窗口按秒配置，换算为帧数
+        sampler = None
+        if options.get("sampling", settings.video_sampling) == "adaptive":
+            sampler = AdaptiveSampler(
+                method=settings.video_sampling_method,
+                threshold=settings.video_scene_threshold,
+                max_gap=int(settings.video_max_gap_seconds * fps) if fps > 0 else 60,
+                activity_window=int(settings.video_activity_seconds * fps) if fps > 0 else 60
+            )
+        
+        # 三段式流水线：解码线程 → 批量推理（直接使用ndarray，无编解码往返）→ 写入线程
+        reader = FrameReader(
+            cap, plan["frame_interval"],
+            maxsize=settings.video_queue_size,
+            sampler=sampler,
+            decode=plan["decode"],
+            positions=plan["positions"],
+            start_frame=start_frame,
+            end_frame=end_frame
+        )
+        writer = FrameWriter(out, maxsize=settings.video_queue_size)
+        reader.start()
+        writer.start()
+        
+        try:
+            finished = False
+            while not finished:
+                frames, finished = await asyncio.to_thread(reader.next_batch, settings.video_batch_size)
+                if not frames:
                     break
-                    
-                # 创建原始帧的副本用于写入输出视频
-                output_frame = frame.copy()
                 
-                # 按照间隔处理帧
-                if frame_idx % frame_interval == 0:
-                    # 转换颜色空间
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    
-                    # 执行检测
-                    predictions = detector.predict(cv2.imencode('.jpg', frame_rgb)[1].tobytes())
-                    
-                    # 如果有检测结果，生成标注图像
-                    annotated_frame = None
-                    if predictions:
-                        # 绘制标注
-                        for pred in predictions:
-                            bbox = pred["bbox"]
-                            x1, y1, x2, y2 = int(bbox["x1"]), int(bbox["y1"]), int(bbox["x2"]), int(bbox["y2"])
-                            cv2.rectangle(output_frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                            label = f"{pred['class']} {pred['confidence']:.2f}"
-                            cv2.putText(output_frame, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-                            
-                        # 编码为base64
-                        _, buffer = cv2.imencode('.jpg', output_frame)
-                        annotated_frame = "data:image/jpeg;base64," + base64.b64encode(buffer).decode('utf-8')
-                    
-                    # 添加到结果
-                    results.append({
-                        "timestamp": int(frame_idx / fps * 1000),  # 毫秒
-                        "frame_index": frame_idx,
-                        "detections": predictions,
-                        "annotated_frame": annotated_frame
+                # 批量推理（跟踪模式下只对检测帧推理）
+                sampled = [(frame_idx, frame) for frame_idx, frame, frame_rgb in frames if frame_rgb is not None]
+                rgbs = [frame_rgb for _, _, frame_rgb in frames if frame_rgb is not None]
+                if tracker is not None:
+                    detect_plan = tracker.plan(len(rgbs))
+                    rgbs = [frame_rgb for frame_rgb, detect in zip(rgbs, detect_plan) if detect]
+                stage_start = time.perf_counter()
+                batch_predictions = await inference_engine.predict_many(rgbs) if rgbs else []
+                inference_time += time.perf_counter() - stage_start
+                inference_frames += len(rgbs)
+                
+                if tracker is not None:
+                    stage_start = time.perf_counter()
+                    batch_predictions = await asyncio.to_thread(
+                        tracker.process, sampled,
+                        [int(frame_idx / fps * 1000) for frame_idx, _ in sampled],
+                        batch_predictions
+                    )
+                    tracking_time += time.perf_counter() - stage_start
+                
+                # 在原始帧上原地标注，有检测结果的帧编码后写入文件
+                stage_start = time.perf_counter()
+                frame_records = await asyncio.to_thread(
+                    self._annotate_batch, task_id, frames_dir, fps, sampled, batch_predictions
+                )
+                annotate_time += time.perf_counter() - stage_start
+                processed_frames += len(frame_records)
+                if sampler is not None:
+                    # 解码线程领先于推理，检测活动对已入队的帧不生效，活动窗口从解码线程的当前位置起算
+                    for record in frame_records:
+                        if record["detections"]:
+                            sampler.mark_activity(record["frame_index"])
+                if tracker is None:
+                    batch_time = datetime.now()
+                    for predictions in batch_predictions:
+                        rollup.add(None, batch_time, predictions)
+                
+                # 逐帧结果分页存储：以时间戳为分数写入有序集合
+                if frame_records:
+                    await redis.zadd(frames_key, {
+                        json.dumps(record, ensure_ascii=False): record["timestamp"] for record in frame_records
                     })
-                    
-                    processed_frames += 1
                 
                 # 所有帧都写入输出视频（无论是否处理过）
-                out.write(output_frame)
+                await asyncio.to_thread(writer.write_many, [frame for _, frame, _ in frames])
                 
-                # 更新进度
-                progress = int((frame_idx / frame_count) * 100) if frame_count > 0 else 0
-                task_info["progress"] = progress
-                await redis.set(f"video_task:{task_id}", repr(task_info))
-                
-                frame_idx += 1
-            
+                # 更新进度（按时间间隔和进度增量节流）
+                if report_progress:
+                    last_idx = frames[-1][0]
+                    progress = int((last_idx / frame_count) * 100) if frame_count > 0 else 0
+                    if progress_throttle.ready(progress):
+                        await self.save_task(task_id, {"progress": progress})
+        finally:
+            reader.stop()
+            await asyncio.to_thread(writer.close)
+            reader.join()
             # 释放资源
             cap.release()
             out.release()
+        
+        if reader.error is not None:
+            raise reader.error
+        if writer.error is not None:
+            raise writer.error
+        
+        outcome = {
+            "start_frame": start_frame,
+            "end_frame": end_frame,
+            "processed_frames": processed_frames,
+            "inference_frames": inference_frames,
+            "stage_timings": {
+                "decode": round(reader.decode_time, 3),
+                "inference": round(inference_time, 3),
+                "annotate": round(annotate_time, 3),
+                "write": round(writer.write_time, 3)
+            },
+            "decode": reader.stats()
+        }
+        if plan["keyframes_detected"] is not None:
+            outcome["decode"]["keyframes_detected"] = plan["keyframes_detected"]
+        if sampler is not None:
+            outcome["sampling"] = {"mode": "adaptive", **sampler.stats()}
+        else:
+            outcome["sampling"] = {
+                "mode": "fixed",
+                "candidate_frames": processed_frames,
+                "sampled_frames": processed_frames,
+                "skipped_frames": 0
+            }
+        if tracker is not None:
+            outcome["stage_timings"]["tracking"] = round(tracking_time, 3)
+            outcome["detect_interval"] = tracker.detect_interval
+            outcome["tracks"] = await asyncio.to_thread(tracker.summaries, task_id, frames_dir)
+        else:
+            # 检查点需要JSON序列化，日期保存为ISO格式字符串
+            outcome["rollup_rows"] = [{**row, "day": row["day"].isoformat()} for row in rollup.rows()]
+        return outcome
+    
+    @staticmethod
+    def _publish_video(output_path: str, task_id: str) -> str:
+        """把标注视频移动到静态文件目录，返回最终路径"""
+        # 确保静态目录存在
+        static_dir = os.path.join("app", "static", "videos")
+        os.makedirs(static_dir, exist_ok=True)
+        final_path = os.path.join(static_dir, f"{task_id}_annotated.webm")
+        try:
+            shutil.move(output_path, final_path)
+        except Exception as e:
+            # 如果移动失败，可能是权限问题，尝试复制然后删除
+            print(f"移动文件失败，尝试复制: {str(e)}")
+            shutil.copy(output_path, final_path)
+            os.remove(output_path)
+        return final_path
+    
+    async def _complete_task(
+        self,
+        task_id: str,
+        options: Dict[str, Any],
+        meta: Dict[str, Any],
+        outcomes: List[Dict[str, Any]],
+        processing_time: float,
+        final_path: str
+    ):
+        """汇总各区间的处理统计，保存结果并把任务标记为完成"""
+        redis = await self.get_redis()
+        mode = options.get("mode", "detect")
+        merged = merge_outcomes(outcomes)
+        processed_frames = merged["processed_frames"]
+        result = {
+            "status": "success",
+            "video_length": meta["video_length"],
+            "mode": mode,
+            "processed_frames": processed_frames,
+            "inference_frames": merged["inference_frames"],
+            "time_cost": processing_time,
+            "fps": processed_frames / processing_time if processing_time > 0 else 0,
+            "stage_timings": merged["stage_timings"],
+            "annotated_video_url": f"/api/static/videos/{task_id}_annotated.webm",
+            "decode": merged["decode"],
+            "sampling": merged["sampling"]
+        }
+        if len(outcomes) > 1:
+            result["segments"] = len(outcomes)
+        
+        rollup = RollupAccumulator()
+        if mode == "track":
+            # 各分段独立跟踪，边界两侧的同一目标需要拼接后再计数
+            tracks = stitch_tracks(
+                [outcome["tracks"] for outcome in outcomes],
+                [int(outcome["start_frame"] / meta["fps"] * 1000) for outcome in outcomes[1:]] if meta["fps"] > 0 else []
+            )
+            # 跟踪模式按目标计数：每个目标以投票类别和最佳置信度计入汇总
+            rollup.add(None, datetime.now(), [
+                {"class": track["class"], "confidence": track["best_confidence"]} for track in tracks
+            ])
+            result.update({
+                "tracker": options.get("tracker", settings.video_tracker),
+                "detect_interval": outcomes[0]["detect_interval"],
+                "unique_counts": VideoTracker.unique_counts(tracks),
+                "tracks": tracks
+            })
+        else:
+            for outcome in outcomes:
+                rollup.merge(outcome["rollup_rows"])
+        
+        VIDEO_SAMPLED_FRAMES.inc(result["sampling"]["sampled_frames"], result="sampled")
+        VIDEO_SAMPLED_FRAMES.inc(result["sampling"]["skipped_frames"], result="skipped")
+        for stage, seconds in result["stage_timings"].items():
+            VIDEO_STAGE_SECONDS.observe(seconds, stage=stage)
+        VIDEO_STAGE_SECONDS.observe(processing_time, stage="total")
+        
+        # 更新任务状态为完成并保存结果（7天过期），在同一个pipeline中发送
+        async with redis.pipeline(transaction=True) as pipe:
+            await self.save_task(task_id, {
+                "status": VideoTaskStatus.COMPLETED,
+                "progress": 100,
+                "completed_at": time.time(),
+                "annotated_video_path": final_path
+            }, pipe=pipe)
+            pipe.set(f"video_result:{task_id}", json.dumps(result, ensure_ascii=False), ex=RESULT_TTL)
+            pipe.expire(self._frames_key(task_id), RESULT_TTL)
+            await pipe.execute()
+        
+        # 任务完成后再写入汇总表，避免任务重试时重复计数
+        await self._record_rollup(rollup)
+    
+    async def _process_video(self, task_id: str):
+        """处理视频的后台任务：短视频整段处理，长视频拆分为分段任务由多个工作进程并行处理"""
+        redis = await self.get_redis()
+        task_info = await self.load_task(task_id)
+        if task_info is None:
+            return
             
-            # 处理完成，保存结果
-            end_time = time.time()
-            processing_time = end_time - start_time
-            
-            # 确保静态目录存在
-            static_dir = os.path.join("app", "static", "videos")
-            os.makedirs(static_dir, exist_ok=True)
-            
-            # 创建静态文件URL
-            annotated_video_url = f"/api/static/videos/{task_id}_annotated.webm" 
-            
-            # 将处理后的视频移动到静态文件目录
-            final_path = os.path.join(static_dir, f"{task_id}_annotated.webm")
+        video_path = task_info["video_path"]
+        options = task_info.get("options") or {}
+        
+        # 更新状态为处理中
+        await self.save_task(task_id, {"status": VideoTaskStatus.PROCESSING})
+        
+        try:
+            meta = await asyncio.to_thread(self._probe_video, video_path)
+            plan = await self._decode_plan(video_path, options, meta)
+            segments = plan_segments(meta["fps"], meta["frame_count"], settings.video_segment_seconds)
+            if len(segments) > 1:
+                # 视频文件在合并完成后才删除
+                await self._dispatch_segments(task_id, meta, plan, segments)
+                return
             
-            # 在_process_video方法中替换os.rename
-            try:
-                shutil.move(output_path, final_path)
-            except Exception as e:
-                # 如果移动失败，可能是权限问题，尝试复制然后删除
-                print(f"移动文件失败，尝试复制: {str(e)}")
-                shutil.copy(output_path, final_path)
-                os.remove(output_path)
+            start_time = time.time()
+            await redis.delete(self._frames_key(task_id))  # 重试时清除上一次的部分结果
+            output_path = f"{tempfile.gettempdir()}/{task_id}_annotated.webm"
+            outcome = await self._run_pipeline(
+                task_id, video_path, options, meta, plan, 0, meta["frame_count"], output_path
+            )
+            final_path = self._publish_video(output_path, task_id)
+            await self._complete_task(task_id, options, meta, [outcome], time.time() - start_time, final_path)
             
-            result = {
-                "status": "success",
-                "video_length": video_length,
-                "processed_frames": processed_frames,
-                "time_cost": processing_time,
-                "fps": processed_frames / processing_time if processing_time > 0 else 0,
-                "results": results,
-                "annotated_video_url": annotated_video_url
+        except Exception as e:
+            # 交给工作进程按尝试次数重试，超过上限时由 fail_job 标记失败并删除视频文件
+            print(f"视频处理失败: {str(e)}")
+            raise
+        
+        # 删除临时文件（任务被取消时保留文件，以便重新入队后继续处理）
+        self.remove_video_file(task_info)
+    
+    @staticmethod
+    def _segments_key(task_id: str) -> str:
+        """分段计划、各分段检查点和尝试次数（哈希）"""
+        return f"video_segments:{task_id}"
+    
+    @staticmethod
+    def _segments_done_key(task_id: str) -> str:
+        """已完成的分段序号（集合）"""
+        return f"video_segments_done:{task_id}"
+    
+    @staticmethod
+    def _segment_clip_path(task_id: str, index: int) -> str:
+        # 分段的标注子视频写入共享目录，合并任务可能在其他工作进程上执行
+        return os.path.join(settings.video_upload_dir, f"{task_id}_seg{index}.webm")
+    
+    async def _load_segment_plan(self, task_id: str) -> Optional[Dict[str, Any]]:
+        redis = await self.get_redis()
+        raw = await redis.hget(self._segments_key(task_id), "plan")
+        return json.loads(raw) if raw else None
+    
+    async def _dispatch_segments(
+        self,
+        task_id: str,
+        meta: Dict[str, Any],
+        plan: Dict[str, Any],
+        segments: List[Tuple[int, int]]
+    ):
+        """
+        保存分段计划并把未完成的分段放入任务队列。
+        任务重新入队时沿用已有的计划和检查点，只处理尚未完成的分段。
+        """
+        redis = await self.get_redis()
+        segments_key = self._segments_key(task_id)
+        done_key = self._segments_done_key(task_id)
+        segment_plan = await self._load_segment_plan(task_id)
+        if segment_plan is None:
+            segment_plan = {
+                "meta": meta,
+                "decode": plan,
+                "segments": segments,
+                "started_at": time.time()
             }
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.delete(self._frames_key(task_id), done_key)
+                pipe.hset(segments_key, "plan", json.dumps(segment_plan, ensure_ascii=False))
+                await pipe.execute()
+        
+        done = {int(index) for index in await redis.smembers(done_key)}
+        total = len(segment_plan["segments"])
+        pending = [index for index in range(total) if index not in done]
+        active = await self._active_jobs([segment_job_id(task_id, index) for index in pending] + [merge_job_id(task_id)])
+        async with redis.pipeline(transaction=True) as pipe:
+            await self.save_task(task_id, {"segments": total, "segments_done": len(done)}, pipe=pipe)
+            for index in pending:
+                # 上一次分发的分段可能仍在队列中或正在被其他进程处理，不重复入队
+                if segment_job_id(task_id, index) not in active:
+                    pipe.lpush(VIDEO_TASKS_QUEUE, segment_job_id(task_id, index))
+            if not pending and merge_job_id(task_id) not in active:
+                # 所有分段都已完成但合并未执行完（合并进程异常退出）
+                pipe.lpush(VIDEO_TASKS_QUEUE, merge_job_id(task_id))
+            pipe.expire(segments_key, RESULT_TTL)
+            pipe.expire(done_key, RESULT_TTL)
+            await pipe.execute()
+    
+    async def _active_jobs(self, job_ids: List[str]) -> Set[str]:
+        """返回 job_ids 中仍在等待队列、处理中队列或持有租约的队列任务"""
+        redis = await self.get_redis()
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.lrange(VIDEO_TASKS_QUEUE, 0, -1)
+            pipe.lrange(VIDEO_TASKS_PROCESSING, 0, -1)
+            pipe.mget([task_lease_key(job_id) for job_id in job_ids])
+            queued, processing, leases = await pipe.execute()
+        listed = {item.decode() if isinstance(item, bytes) else item for item in queued + processing}
+        return {job_id for job_id, lease in zip(job_ids, leases) if job_id in listed or lease is not None}
+    
+    async def _process_segment(self, task_id: str, index: int):
+        """处理单个分段并保存检查点，最后一个完成的分段负责把合并任务放入队列"""
+        redis = await self.get_redis()
+        task_info = await self.get_task_fields(task_id, "status", "video_path", "options")
+        if not task_info or task_info.get("status") in (VideoTaskStatus.COMPLETED, VideoTaskStatus.FAILED):
+            return
+        segment_plan = await self._load_segment_plan(task_id)
+        done_key = self._segments_done_key(task_id)
+        if segment_plan is None or await redis.sismember(done_key, index):
+            return
+        
+        meta = segment_plan["meta"]
+        start_frame, end_frame = segment_plan["segments"][index]
+        total = len(segment_plan["segments"])
+        fps = meta["fps"]
+        try:
+            # 重试时清除本分段上一次的部分逐帧结果
+            start_ms = int(start_frame / fps * 1000)
+            end_ms = int(end_frame / fps * 1000)
+            await redis.zremrangebyscore(self._frames_key(task_id), start_ms, f"({end_ms}")
             
-            # 更新任务状态为完成
-            task_info["status"] = VideoTaskStatus.COMPLETED
-            task_info["progress"] = 100
-            task_info["completed_at"] = time.time()
-            task_info["annotated_video_path"] = final_path
+            outcome = await self._run_pipeline(
+                task_id,
+                task_info["video_path"],
+                task_info.get("options") or {},
+                meta,
+                segment_plan["decode"],
+                start_frame,
+                end_frame,
+                self._segment_clip_path(task_id, index),
+                track_id_offset=index * TRACK_ID_STRIDE,
+                report_progress=False
+            )
             
-            await redis.set(f"video_task:{task_id}", repr(task_info))
-            # 保存结果（7天过期）
-            await redis.set(f"video_result:{task_id}", repr(result), ex=60*60*24*7)
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.hset(self._segments_key(task_id), f"segment:{index}", json.dumps(outcome, ensure_ascii=False))
+                pipe.sadd(done_key, index)
+                pipe.scard(done_key)
+                _, added, done_count = await pipe.execute()
             
+            # 合并完成前进度最多到99
+            await self.save_task(task_id, {
+                "segments_done": done_count,
+                "progress": min(99, int(done_count / total * 100))
+            })
+            if added and done_count == total:
+                await redis.lpush(VIDEO_TASKS_QUEUE, merge_job_id(task_id))
         except Exception as e:
-            # 处理失败
-            print(f"视频处理失败: {str(e)}")
-            task_info["status"] = VideoTaskStatus.FAILED
-            task_info["error"] = str(e)
-            await redis.set(f"video_task:{task_id}", repr(task_info))
-            
-        finally:
-            # 删除临时文件
+            # 交给工作进程按尝试次数重试本分段，超过上限时由 fail_job 放弃任务并删除视频文件
+            print(f"视频分段 {index} 处理失败: {str(e)}")
+            raise
+    
+    async def _merge_segments(self, task_id: str):
+        """合并各分段的检查点和标注子视频，完成任务"""
+        redis = await self.get_redis()
+        task_info = await self.load_task(task_id)
+        if task_info is None or task_info.get("status") in (VideoTaskStatus.COMPLETED, VideoTaskStatus.FAILED):
+            return
+        segment_plan = await self._load_segment_plan(task_id)
+        if segment_plan is None:
+            return
+        
+        total = len(segment_plan["segments"])
+        segments_key = self._segments_key(task_id)
+        raw_outcomes = await redis.hmget(segments_key, [f"segment:{index}" for index in range(total)])
+        if any(raw is None for raw in raw_outcomes):
+            return
+        outcomes = [json.loads(raw) for raw in raw_outcomes]
+        meta = segment_plan["meta"]
+        clip_paths = [self._segment_clip_path(task_id, index) for index in range(total)]
+        
+        try:
+            output_path = f"{tempfile.gettempdir()}/{task_id}_annotated.webm"
+            stage_start = time.perf_counter()
+            await asyncio.to_thread(
+                concat_clips, clip_paths, output_path,
+                segment_plan["decode"]["output_fps"], (meta["width"], meta["height"])
+            )
+            outcomes[-1]["stage_timings"]["merge"] = round(time.perf_counter() - stage_start, 3)
+            final_path = self._publish_video(output_path, task_id)
+            await self._complete_task(
+                task_id,
+                task_info.get("options") or {},
+                meta,
+                outcomes,
+                time.time() - segment_plan["started_at"],
+                final_path
+            )
+        except Exception as e:
+            print(f"合并视频分段失败: {str(e)}")
+            await self.save_task(task_id, {"status": VideoTaskStatus.FAILED, "error": str(e)})
+        
+        await self._remove_segment_files(task_id, total)
+        self.remove_video_file(task_info)
+    
+    async def _remove_segment_files(self, task_id: str, total: int):
+        """删除各分段的标注子视频和分段检查点"""
+        for index in range(total):
             try:
-                if os.path.exists(video_path):
-                    os.unlink(video_path)
-            except:
+                os.unlink(self._segment_clip_path(task_id, index))
+            except OSError:
                 pass
+        redis = await self.get_redis()
+        await redis.delete(self._segments_key(task_id), self._segments_done_key(task_id))
 
 # 全局单例实例
-video_processor = VideoProcessor()
\ No newline at end of file
+video_processor = VideoProcessor()
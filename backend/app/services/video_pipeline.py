@@ -0,0 +1,349 @@
+import queue
+import threading
+import time
+from typing import Optional, Tuple, List, Dict, Any
+import cv2
+import numpy as np
+
+# 队列结束标记
+_END = None
+
+# 帧采样方式：fixed 固定步长；adaptive 在固定步长的候选帧上自适应跳过
+SAMPLING_MODES = ("fixed", "adaptive")
+
+# 自适应采样的画面变化度量及默认阈值：
+# diff 为缩略灰度图的平均绝对差（0~1），hist 为灰度直方图的巴氏距离（0~1）
+SAMPLING_METHODS = {"diff": 0.04, "hist": 0.2}
+
+class AdaptiveSampler:
+    """
+    自适应采样：在固定步长的候选帧上，用缩小后的灰度图与上一个采样帧比较，
+    画面几乎不变的帧跳过推理；画面变化、最近有检测结果或距上次采样达到最大间隔时采样。
+    should_sample 在解码线程中调用，mark_activity 由推理阶段调用（只写入一个整数，无需加锁）。
+    """
+    def __init__(
+        self,
+        method: str = "diff",
+        threshold: Optional[float] = None,
+        max_gap: int = 60,
+        activity_window: int = 60,
+        thumb_size: Tuple[int, int] = (64, 36)
+    ):
+        if method not in SAMPLING_METHODS:
+            raise ValueError(f"不支持的画面变化度量: {method}")
+        self.method = method
+        self.threshold = SAMPLING_METHODS[method] if threshold is None else threshold
+        self.max_gap = max(1, max_gap)
+        self.activity_window = max(0, activity_window)
+        self.thumb_size = thumb_size
+        self.active_until = -1
+        self.activity_marks = 0  # 检测结果延长活动窗口的次数
+        self.candidates = 0
+        self.sampled = 0
+        self.reasons: Dict[str, int] = {"first": 0, "scene_change": 0, "activity": 0, "max_gap": 0}
+        self.compare_time = 0.0
+        self._last_idx: Optional[int] = None
+        self._last_candidate = -1  # 解码线程已判断到的候选帧
+        self._last_feature: Optional[np.ndarray] = None
+
+    def _feature(self, frame: np.ndarray) -> np.ndarray:
+        small = cv2.resize(frame, self.thumb_size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        if self.method == "hist":
+            hist = cv2.calcHist([gray], [0], None, [32], [0, 256])
+            return cv2.normalize(hist, hist).flatten()
+        return gray
+
+    def _distance(self, feature: np.ndarray) -> float:
+        if self.method == "hist":
+            return float(cv2.compareHist(self._last_feature, feature, cv2.HISTCMP_BHATTACHARYYA))
+        return float(cv2.absdiff(self._last_feature, feature).mean()) / 255.0
+
+    def should_sample(self, frame_idx: int, frame: np.ndarray) -> bool:
+        """判断候选帧是否需要推理"""
+        self.candidates += 1
+        self._last_candidate = frame_idx
+        start = time.perf_counter()
+        feature = self._feature(frame)
+        if self._last_feature is None:
+            reason = "first"
+        elif frame_idx <= self.active_until:
+            reason = "activity"
+        elif frame_idx - self._last_idx >= self.max_gap:
+            reason = "max_gap"
+        elif self._distance(feature) >= self.threshold:
+            reason = "scene_change"
+        else:
+            reason = None
+        self.compare_time += time.perf_counter() - start
+        if reason is None:
+            return False
+        self.reasons[reason] += 1
+        self.sampled += 1
+        self._last_idx = frame_idx
+        self._last_feature = feature
+        return True
+
+    def mark_activity(self, frame_idx: int):
+        """
+        采样帧出现检测结果后，接下来 activity_window 帧内的候选帧全部采样。
+        解码线程领先于推理，窗口从解码线程当前的位置起算，否则窗口可能在生效前就已被越过。
+        """
+        self.activity_marks += 1
+        self.active_until = max(self.active_until, max(frame_idx, self._last_candidate) + self.activity_window)
+
+    def stats(self) -> Dict[str, Any]:
+        skipped = self.candidates - self.sampled
+        return {
+            "method": self.method,
+            "threshold": self.threshold,
+            "candidate_frames": self.candidates,
+            "sampled_frames": self.sampled,
+            "skipped_frames": skipped,
+            "saved_ratio": round(skipped / self.candidates, 4) if self.candidates else 0.0,
+            "reasons": dict(self.reasons),
+            "activity_marks": self.activity_marks,
+            "activity_frames": self.reasons["activity"],
+            "compare_time": round(self.compare_time, 3)
+        }
+
+# 解码方式：
+# full      逐帧 read()，所有帧都进入写入队列（标注视频与原视频帧数相同）
+# grab      所有帧只 grab()，候选帧才 retrieve()，跳过的帧不做颜色转换和拷贝，也不写入标注视频
+# seek      按时间戳采样，间隔较大时直接定位到目标帧，适合稀疏采样
+# keyframes 只读取关键帧，用于快速预览
+DECODE_MODES = ("full", "grab", "seek", "keyframes")
+
+# 目标帧与当前位置相差超过该帧数时直接定位，否则 grab() 向前推进更便宜
+SEEK_MIN_GAP = 30
+
+def seek_positions(fps: float, frame_count: int, interval_seconds: float) -> List[int]:
+    """每隔 interval_seconds 秒取一个时间戳，换算为帧位置"""
+    if fps <= 0 or frame_count <= 0:
+        return []
+    step = max(1, int(round(interval_seconds * fps)))
+    return list(range(0, frame_count, step))
+
+def scan_keyframes(video_path: str) -> Optional[List[int]]:
+    """
+    以原始数据包方式打开视频（不解码），逐包检查是否为关键帧，返回关键帧的帧位置。
+    需要 FFmpeg 后端和 CAP_PROP_LRF_HAS_KEY_FRAME（OpenCV 4.5+），不支持时返回None。
+    帧位置按数据包顺序计数，含B帧的视频中可能与显示顺序有少量偏差。
+    """
+    prop = getattr(cv2, "CAP_PROP_LRF_HAS_KEY_FRAME", None)
+    if prop is None:
+        return None
+    try:
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    except cv2.error:
+        return None
+    try:
+        if not cap.isOpened():
+            return None
+        keyframes = []
+        frame_idx = 0
+        while cap.grab():
+            if cap.get(prop):
+                keyframes.append(frame_idx)
+            frame_idx += 1
+        return keyframes or None
+    finally:
+        cap.release()
+
+class FrameReader(threading.Thread):
+    """
+    解码阶段：后台线程读取视频帧放入有界队列。
+    需要推理的帧同时附带RGB副本，避免推理阶段再做颜色转换。
+    full/grab 按固定步长选出候选帧，seek/keyframes 的候选帧为 positions 给出的帧位置；
+    提供 sampler 时再由自适应采样决定候选帧是否推理。
+    start_frame/end_frame 限定读取的帧区间 [start_frame, end_frame)，用于分段处理。
+    """
+    def __init__(
+        self,
+        cap: cv2.VideoCapture,
+        frame_interval: int,
+        maxsize: int = 64,
+        sampler: Optional[AdaptiveSampler] = None,
+        decode: str = "full",
+        positions: Optional[List[int]] = None,
+        seek_min_gap: int = SEEK_MIN_GAP,
+        start_frame: int = 0,
+        end_frame: Optional[int] = None
+    ):
+        super().__init__(name="video-reader", daemon=True)
+        if decode not in DECODE_MODES:
+            raise ValueError(f"不支持的解码方式: {decode}")
+        if decode in ("seek", "keyframes") and positions is None:
+            raise ValueError(f"解码方式 {decode} 需要给出采样的帧位置")
+        self.cap = cap
+        self.frame_interval = max(1, frame_interval)
+        self.sampler = sampler
+        self.decode = decode
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        if positions is not None:
+            positions = [p for p in positions if p >= start_frame and (end_frame is None or p < end_frame)]
+        self.positions = positions
+        self.seek_min_gap = seek_min_gap
+        self.queue: "queue.Queue[Optional[Tuple[int, np.ndarray, Optional[np.ndarray]]]]" = queue.Queue(maxsize=maxsize)
+        self.decode_time = 0.0
+        self.frames_read = 0  # 推进过的源视频帧数（read 或 grab）
+        self.frames_decoded = 0  # 转换为BGR图像的帧数（read 或 retrieve）
+        self.seeks = 0
+        self.error: Optional[BaseException] = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            if self.decode == "full":
+                self._read_all()
+            elif self.decode == "grab":
+                self._grab_candidates()
+            else:
+                self._read_positions()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self._put(_END)
+
+    def _seek_start(self) -> int:
+        """定位到区间起点，返回起始帧位置"""
+        if self.start_frame > 0:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
+            self.seeks += 1
+        return self.start_frame
+
+    def _in_range(self, frame_idx: int) -> bool:
+        return self.end_frame is None or frame_idx < self.end_frame
+
+    def _read_all(self):
+        frame_idx = self._seek_start()
+        while not self._stop_event.is_set() and self._in_range(frame_idx):
+            start = time.perf_counter()
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            self.frames_read += 1
+            self._emit(frame_idx, frame, start, frame_idx % self.frame_interval == 0)
+            frame_idx += 1
+
+    def _grab_candidates(self):
+        frame_idx = self._seek_start()
+        while not self._stop_event.is_set() and self._in_range(frame_idx):
+            start = time.perf_counter()
+            if not self.cap.grab():
+                break
+            self.frames_read += 1
+            if frame_idx % self.frame_interval != 0:
+                self.decode_time += time.perf_counter() - start
+                frame_idx += 1
+                continue
+            ret, frame = self.cap.retrieve()
+            if not ret:
+                break
+            self._emit(frame_idx, frame, start, True)
+            frame_idx += 1
+
+    def _read_positions(self):
+        current = 0  # 下一次 read() 将得到的帧位置
+        for target in self.positions:
+            if self._stop_event.is_set():
+                return
+            if target < current:
+                continue
+            start = time.perf_counter()
+            if target - current > self.seek_min_gap:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                self.seeks += 1
+            else:
+                while current < target and self.cap.grab():
+                    self.frames_read += 1
+                    current += 1
+            ret, frame = self.cap.read()
+            if not ret:
+                self.decode_time += time.perf_counter() - start
+                return
+            self.frames_read += 1
+            current = target + 1
+            self._emit(target, frame, start, True)
+
+    def _emit(self, frame_idx: int, frame: np.ndarray, start: float, candidate: bool):
+        """放入队列，候选帧经自适应采样确认后附带RGB副本"""
+        sample = candidate and (self.sampler is None or self.sampler.should_sample(frame_idx, frame))
+        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) if sample else None
+        self.decode_time += time.perf_counter() - start
+        self.frames_decoded += 1
+        self._put((frame_idx, frame, frame_rgb))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.decode,
+            "frames_read": self.frames_read,
+            "frames_decoded": self.frames_decoded,
+            "seeks": self.seeks,
+            "decode_time": round(self.decode_time, 3),
+            "decoded_fps": round(self.frames_decoded / self.decode_time, 1) if self.decode_time > 0 else 0.0
+        }
+
+    def _put(self, item):
+        """队列满时阻塞等待，停止后放弃写入"""
+        while not self._stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def next_batch(self, max_sampled: int) -> Tuple[List[Tuple[int, np.ndarray, Optional[np.ndarray]]], bool]:
+        """
+        按顺序取出帧，直到凑满 max_sampled 个需要推理的帧或视频结束。
+        返回 (帧列表, 是否已结束)。
+        """
+        frames = []
+        sampled = 0
+        while sampled < max_sampled:
+            item = self.queue.get()
+            if item is _END:
+                return frames, True
+            frames.append(item)
+            if item[2] is not None:
+                sampled += 1
+        return frames, False
+
+    def stop(self):
+        self._stop_event.set()
+
+class FrameWriter(threading.Thread):
+    """写入阶段：后台线程把帧写入 cv2.VideoWriter"""
+    def __init__(self, writer: cv2.VideoWriter, maxsize: int = 64):
+        super().__init__(name="video-writer", daemon=True)
+        self.writer = writer
+        self.queue: "queue.Queue[Optional[np.ndarray]]" = queue.Queue(maxsize=maxsize)
+        self.write_time = 0.0
+        self.frames_written = 0
+        self.error: Optional[BaseException] = None
+
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is _END:
+                break
+            if self.error is not None:
+                continue
+            try:
+                start = time.perf_counter()
+                self.writer.write(frame)
+                self.write_time += time.perf_counter() - start
+                self.frames_written += 1
+            except BaseException as e:
+                self.error = e
+
+    def write_many(self, frames: List[np.ndarray]):
+        """按顺序放入写入队列（队列满时阻塞，应在线程池中调用）"""
+        for frame in frames:
+            self.queue.put(frame)
+
+    def close(self):
+        """写完队列中剩余的帧后结束线程"""
+        self.queue.put(_END)
+        self.join()
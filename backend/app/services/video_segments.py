@@ -0,0 +1,170 @@
+import os
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple
+import cv2
+
+# 分段任务在队列中的ID：{任务ID}#seg{序号}，全部分段完成后的合并任务为 {任务ID}#merge
+JOB_SEPARATOR = "#"
+SEGMENT_PREFIX = "seg"
+MERGE_PART = "merge"
+
+# 每个分段的跟踪目标ID从 序号 * TRACK_ID_STRIDE 开始。分段内的ID由各自的 VideoTracker 独立分配
+# （不使用 ultralytics 的进程全局计数器，同一进程并发处理多个分段时不会互相重复），偏移只用于区分分段
+TRACK_ID_STRIDE = 100000
+
+# 相邻分段边界处的跟踪目标拼接条件：间隔不超过该毫秒数且框的IoU不低于阈值
+STITCH_MAX_GAP_MS = 1000
+STITCH_MIN_IOU = 0.3
+
+def segment_job_id(task_id: str, index: int) -> str:
+    return f"{task_id}{JOB_SEPARATOR}{SEGMENT_PREFIX}{index}"
+
+def merge_job_id(task_id: str) -> str:
+    return f"{task_id}{JOB_SEPARATOR}{MERGE_PART}"
+
+def parse_job_id(job_id: str) -> Tuple[str, Optional[str]]:
+    """拆分队列中的任务ID，返回 (视频任务ID, 子任务部分)，整段任务的子任务部分为None"""
+    task_id, _, part = job_id.partition(JOB_SEPARATOR)
+    return task_id, part or None
+
+def segment_index(part: Optional[str]) -> Optional[int]:
+    if part and part.startswith(SEGMENT_PREFIX) and part[len(SEGMENT_PREFIX):].isdigit():
+        return int(part[len(SEGMENT_PREFIX):])
+    return None
+
+def plan_segments(fps: float, frame_count: int, segment_seconds: float) -> List[Tuple[int, int]]:
+    """
+    按时长把视频划分为 [起始帧, 结束帧) 区间。
+    视频不超过 1.5 个分段时长时不拆分，最后一段不足半个分段时长时并入前一段。
+    """
+    segment_frames = int(segment_seconds * fps) if fps > 0 else 0
+    if segment_frames <= 0 or frame_count <= segment_frames * 1.5:
+        return [(0, frame_count)]
+    bounds = list(range(0, frame_count, segment_frames))
+    if frame_count - bounds[-1] < segment_frames / 2:
+        bounds.pop()
+    return [(start, bounds[i + 1] if i + 1 < len(bounds) else frame_count) for i, start in enumerate(bounds)]
+
+def _sum_numbers(target: Dict[str, Any], source: Dict[str, Any]):
+    """把数值字段（含嵌套字典）累加到 target，非数值字段保留第一次出现的值"""
+    for key, value in source.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float, dict)):
+            target.setdefault(key, value)
+        elif isinstance(value, dict):
+            _sum_numbers(target.setdefault(key, {}), value)
+        else:
+            target[key] = target.get(key, 0) + value
+
+def merge_outcomes(outcomes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """合并各分段的统计：帧数、阶段耗时、解码和采样统计相加，比例类字段重新计算"""
+    merged: Dict[str, Any] = {
+        "processed_frames": 0,
+        "inference_frames": 0,
+        "stage_timings": {},
+        "decode": {},
+        "sampling": {}
+    }
+    for outcome in outcomes:
+        merged["processed_frames"] += outcome["processed_frames"]
+        merged["inference_frames"] += outcome["inference_frames"]
+        _sum_numbers(merged["stage_timings"], outcome["stage_timings"])
+        _sum_numbers(merged["decode"], outcome["decode"])
+        _sum_numbers(merged["sampling"], outcome["sampling"])
+
+    decode = merged["decode"]
+    decode_time = decode.get("decode_time", 0)
+    decode["decode_time"] = round(decode_time, 3)
+    decode["decoded_fps"] = round(decode.get("frames_decoded", 0) / decode_time, 1) if decode_time > 0 else 0.0
+    sampling = merged["sampling"]
+    candidates = sampling.get("candidate_frames", 0)
+    if "saved_ratio" in sampling:
+        sampling["saved_ratio"] = round(sampling.get("skipped_frames", 0) / candidates, 4) if candidates else 0.0
+    if "threshold" in sampling and outcomes:
+        sampling["threshold"] = outcomes[0]["sampling"]["threshold"]
+    if "compare_time" in sampling:
+        sampling["compare_time"] = round(sampling["compare_time"], 3)
+    merged["stage_timings"] = {stage: round(seconds, 3) for stage, seconds in merged["stage_timings"].items()}
+    return merged
+
+def _iou(a: Optional[Dict[str, float]], b: Optional[Dict[str, float]]) -> float:
+    if not a or not b:
+        return 0.0
+    x1, y1 = max(a["x1"], b["x1"]), max(a["y1"], b["y1"])
+    x2, y2 = min(a["x2"], b["x2"]), min(a["y2"], b["y2"])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a["x2"] - a["x1"]) * (a["y2"] - a["y1"]) + (b["x2"] - b["x1"]) * (b["y2"] - b["y1"]) - inter
+    return inter / union if union > 0 else 0.0
+
+def _join_tracks(head: Dict[str, Any], tail: Dict[str, Any]) -> Dict[str, Any]:
+    """把后一段的目标并入前一段的目标，保留前一段的目标ID"""
+    votes = Counter(head["class_votes"])
+    votes.update(tail["class_votes"])
+    joined = dict(head)
+    joined.update({
+        "class": votes.most_common(1)[0][0],
+        "class_votes": dict(votes),
+        "last_frame": tail["last_frame"],
+        "last_seen_ms": tail["last_seen_ms"],
+        "last_bbox": tail["last_bbox"],
+        "duration_ms": tail["last_seen_ms"] - head["first_seen_ms"],
+        "detections": head["detections"] + tail["detections"],
+        "merged_track_ids": head.get("merged_track_ids", [head["track_id"]]) + [tail["track_id"]]
+    })
+    if tail["best_confidence"] > head["best_confidence"]:
+        for key in ("best_confidence", "best_frame", "best_timestamp_ms", "best_bbox", "keyframe"):
+            joined[key] = tail[key]
+    return joined
+
+def stitch_tracks(
+    segment_tracks: List[List[Dict[str, Any]]],
+    boundaries_ms: List[int],
+    max_gap_ms: int = STITCH_MAX_GAP_MS,
+    min_iou: float = STITCH_MIN_IOU
+) -> List[Dict[str, Any]]:
+    """
+    拼接相邻分段边界两侧的同一目标（各分段独立跟踪，跨边界的目标会被拆成两个）。
+    boundaries_ms[i] 为第 i+1 段的起始时间；按IoU从高到低贪心匹配。
+    """
+    if not segment_tracks:
+        return []
+    merged = list(segment_tracks[0])
+    for boundary, tracks in zip(boundaries_ms, segment_tracks[1:]):
+        heads = [i for i, track in enumerate(merged) if boundary - track["last_seen_ms"] <= max_gap_ms]
+        tails = [j for j, track in enumerate(tracks) if track["first_seen_ms"] - boundary <= max_gap_ms]
+        pairs = sorted(
+            ((_iou(merged[i]["last_bbox"], tracks[j]["first_bbox"]), i, j) for i in heads for j in tails),
+            reverse=True
+        )
+        used_heads, used_tails = set(), set()
+        for iou, i, j in pairs:
+            if iou < min_iou:
+                break
+            if i in used_heads or j in used_tails:
+                continue
+            merged[i] = _join_tracks(merged[i], tracks[j])
+            used_heads.add(i)
+            used_tails.add(j)
+        merged.extend(track for j, track in enumerate(tracks) if j not in used_tails)
+    return sorted(merged, key=lambda track: (track["first_frame"], track["track_id"]))
+
+def concat_clips(clip_paths: List[str], output_path: str, fps: float, size: Tuple[int, int]) -> int:
+    """按顺序把各分段的标注子视频拼接为一个WebM文件，返回写入的帧数"""
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'VP80'), fps, size)
+    frames = 0
+    try:
+        for path in clip_paths:
+            if not os.path.exists(path):
+                continue
+            cap = cv2.VideoCapture(path)
+            try:
+                while True:
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    out.write(frame)
+                    frames += 1
+            finally:
+                cap.release()
+    finally:
+        out.release()
+    return frames
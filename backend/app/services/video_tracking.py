@@ -0,0 +1,243 @@
+import os
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from ultralytics.trackers.track import TRACKER_MAP
+from ultralytics.trackers.utils.kalman_filter import KalmanFilterXYWH
+from ultralytics.utils import IterableSimpleNamespace, yaml_load
+from ultralytics.utils.checks import check_yaml
+from app.services.detector import detector
+
+# 视频处理模式
+VIDEO_MODES = ("detect", "track")
+
+# 跟踪器类型 -> ultralytics/cfg/trackers 下的配置文件
+TRACKER_CONFIGS = {"bytetrack": "bytetrack.yaml", "botsort": "botsort.yaml"}
+
+# 关键帧裁剪时在检测框四周保留的边距（相对框宽高的比例）
+KEYFRAME_PADDING = 0.1
+
+class TrackerDetections:
+    """把检测结果字典适配为跟踪器需要的数组形式（与 Results.boxes 的 conf/xywh/cls 一致）"""
+    def __init__(self, predictions: List[Dict], class_ids: Dict[str, int]):
+        self.conf = np.array([pred["confidence"] for pred in predictions], dtype=np.float32)
+        self.cls = np.array([class_ids.get(pred["class"], -1) for pred in predictions], dtype=np.float32)
+        xywh = np.zeros((len(predictions), 4), dtype=np.float32)
+        for i, pred in enumerate(predictions):
+            box = pred["bbox"]
+            xywh[i] = (
+                (box["x1"] + box["x2"]) / 2,
+                (box["y1"] + box["y2"]) / 2,
+                box["x2"] - box["x1"],
+                box["y2"] - box["y1"]
+            )
+        self.xywh = xywh
+
+    def __len__(self):
+        return len(self.conf)
+
+class TrackSummary:
+    """单个跟踪目标的汇总：首次/最后出现、最佳置信度关键帧、类别投票"""
+    def __init__(self, track_id: int):
+        self.track_id = track_id
+        self.first_frame: Optional[int] = None
+        self.last_frame: Optional[int] = None
+        self.first_seen_ms = 0
+        self.last_seen_ms = 0
+        self.hits = 0
+        self.votes: Counter = Counter()
+        self.vote_confidence: Counter = Counter()
+        self.best_confidence = 0.0
+        self.best_frame: Optional[int] = None
+        self.best_timestamp_ms = 0
+        self.best_bbox: Optional[Dict[str, float]] = None
+        self.first_bbox: Optional[Dict[str, float]] = None
+        self.last_bbox: Optional[Dict[str, float]] = None
+        self.keyframe: Optional[bytes] = None
+
+    def add(self, frame_idx: int, timestamp_ms: int, prediction: Dict, frame: np.ndarray):
+        if self.first_frame is None:
+            self.first_frame = frame_idx
+            self.first_seen_ms = timestamp_ms
+            self.first_bbox = prediction["bbox"]
+        self.last_frame = frame_idx
+        self.last_seen_ms = timestamp_ms
+        self.last_bbox = prediction["bbox"]
+        self.hits += 1
+        self.votes[prediction["class"]] += 1
+        self.vote_confidence[prediction["class"]] += prediction["confidence"]
+        if prediction["confidence"] > self.best_confidence:
+            self.best_confidence = prediction["confidence"]
+            self.best_frame = frame_idx
+            self.best_timestamp_ms = timestamp_ms
+            self.best_bbox = prediction["bbox"]
+            self.keyframe = self._crop(frame, prediction["bbox"])
+
+    @staticmethod
+    def _crop(frame: np.ndarray, bbox: Dict[str, float]) -> Optional[bytes]:
+        """裁剪检测框（带少量边距）并编码为JPEG，须在帧被标注之前调用"""
+        height, width = frame.shape[:2]
+        pad_x = (bbox["x2"] - bbox["x1"]) * KEYFRAME_PADDING
+        pad_y = (bbox["y2"] - bbox["y1"]) * KEYFRAME_PADDING
+        x1 = max(0, int(bbox["x1"] - pad_x))
+        y1 = max(0, int(bbox["y1"] - pad_y))
+        x2 = min(width, int(bbox["x2"] + pad_x))
+        y2 = min(height, int(bbox["y2"] + pad_y))
+        if x2 <= x1 or y2 <= y1:
+            return None
+        return detector.encode_jpeg(frame[y1:y2, x1:x2], quality=90)
+
+    @property
+    def voted_class(self) -> str:
+        """票数最多的类别，票数相同时取置信度之和较大的"""
+        return max(self.votes, key=lambda name: (self.votes[name], self.vote_confidence[name]))
+
+    def to_dict(self, keyframe_url: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            "track_id": self.track_id,
+            "class": self.voted_class,
+            "class_votes": dict(self.votes),
+            "first_frame": self.first_frame,
+            "last_frame": self.last_frame,
+            "first_seen_ms": self.first_seen_ms,
+            "last_seen_ms": self.last_seen_ms,
+            "duration_ms": self.last_seen_ms - self.first_seen_ms,
+            "detections": self.hits,
+            "best_confidence": round(self.best_confidence, 4),
+            "best_frame": self.best_frame,
+            "best_timestamp_ms": self.best_timestamp_ms,
+            "best_bbox": self.best_bbox,
+            "first_bbox": self.first_bbox,
+            "last_bbox": self.last_bbox,
+            "keyframe": keyframe_url
+        }
+
+class VideoTracker:
+    """
+    视频多目标跟踪：每隔 detect_interval 个采样帧运行一次检测并更新跟踪器，
+    中间的帧不做推理，用卡尔曼滤波对下一次检测时刻的预测结果线性插值得到预测框。
+    每个跟踪目标只在检测帧上累计汇总信息，预测框仅用于标注和逐帧结果。
+    """
+    def __init__(self, tracker_type: str, frame_rate: float, detect_interval: int = 1, id_offset: int = 0):
+        if tracker_type not in TRACKER_CONFIGS:
+            raise ValueError(f"不支持的跟踪器类型: {tracker_type}")
+        cfg = IterableSimpleNamespace(**yaml_load(check_yaml(TRACKER_CONFIGS[tracker_type])))
+        self.detect_interval = max(1, detect_interval)
+        # 跟踪器每次更新对应 detect_interval 个采样帧，帧率按更新频率计算（影响丢失目标的保留时长）
+        self.tracker = TRACKER_MAP[tracker_type](args=cfg, frame_rate=max(1, int(round(frame_rate / self.detect_interval))))
+        self.names: Dict[int, str] = dict(detector.model.names)
+        self.class_ids = {name: class_id for class_id, name in self.names.items()}
+        # ultralytics 的 track_id 来自进程全局计数器，新建跟踪器时会被清零，同一进程并发处理多个任务或分段时
+        # 会互相重复，因此按跟踪器目标对象本身分配 id_offset+1 起的连续ID（见 _track_id）
+        self.id_offset = id_offset
+        self._next_id = 0
+        self.sampled = 0  # 已处理的采样帧数
+        self.detect_frames = 0  # 实际运行检测的帧数
+        self.tracks: Dict[int, TrackSummary] = {}
+        # 上一个检测帧后处于跟踪状态的目标：(跟踪器目标, 当前状态均值, 下一次更新时的预测均值)
+        self._motion: List[Tuple[Any, np.ndarray, np.ndarray]] = []
+
+    def plan(self, count: int) -> List[bool]:
+        """接下来 count 个采样帧中哪些需要运行检测"""
+        return [(self.sampled + i) % self.detect_interval == 0 for i in range(count)]
+
+    def process(
+        self,
+        sampled: List[Tuple[int, np.ndarray]],
+        timestamps: List[int],
+        detections: List[List[Dict]]
+    ) -> List[List[Dict]]:
+        """
+        在线程池中执行：按顺序处理一批采样帧，detections 为 plan() 标记为检测帧的推理结果。
+        返回每一帧的跟踪结果（带 track_id，预测框带 predicted 标记）。
+        """
+        detections = iter(detections)
+        results = []
+        for (frame_idx, frame), timestamp_ms in zip(sampled, timestamps):
+            if self.sampled % self.detect_interval == 0:
+                results.append(self._update(frame_idx, timestamp_ms, frame, next(detections)))
+            else:
+                results.append(self._predict())
+            self.sampled += 1
+        return results
+
+    def _track_id(self, track: Any) -> int:
+        """目标ID记录在跟踪器目标对象上，目标丢失后重新匹配时沿用同一对象，ID不变"""
+        track_id = getattr(track, "summary_track_id", None)
+        if track_id is None:
+            self._next_id += 1
+            track_id = track.summary_track_id = self.id_offset + self._next_id
+        return track_id
+
+    def _update(self, frame_idx: int, timestamp_ms: int, frame: np.ndarray, predictions: List[Dict]) -> List[Dict]:
+        self.detect_frames += 1
+        # BOTSORT 使用原始帧做全局运动补偿；返回值只含全局 track_id，这里直接遍历已确认的目标对象
+        self.tracker.update(TrackerDetections(predictions, self.class_ids), frame)
+        tracked = []
+        for track in self.tracker.tracked_stracks:
+            if not track.is_activated:
+                continue
+            x1, y1, x2, y2, _, score, cls, _ = track.result
+            track_id = self._track_id(track)
+            prediction = {
+                "class": self.names.get(int(cls), str(int(cls))),
+                "confidence": float(score),
+                "bbox": {"x1": float(x1), "y1": float(y1), "x2": float(x2), "y2": float(y2)},
+                "track_id": track_id
+            }
+            summary = self.tracks.get(track_id)
+            if summary is None:
+                summary = self.tracks[track_id] = TrackSummary(track_id)
+            summary.add(frame_idx, timestamp_ms, prediction, frame)
+            tracked.append(prediction)
+        self._prepare_motion()
+        return tracked
+
+    def _prepare_motion(self):
+        """对每个已确认的跟踪目标预测一步，供中间帧插值"""
+        self._motion = []
+        if self.detect_interval == 1:
+            return
+        kalman_filter = self.tracker.kalman_filter
+        for track in self.tracker.tracked_stracks:
+            if not track.is_activated or track.mean is None:
+                continue
+            next_mean, _ = kalman_filter.predict(track.mean.copy(), track.covariance.copy())
+            self._motion.append((track, track.mean.copy(), next_mean))
+
+    def _predict(self) -> List[Dict]:
+        fraction = (self.sampled % self.detect_interval) / self.detect_interval
+        # BOTSORT 的卡尔曼状态为 xywh，BYTETracker 为 xyah
+        xywh_state = isinstance(self.tracker.kalman_filter, KalmanFilterXYWH)
+        predicted = []
+        for track, mean, next_mean in self._motion:
+            x, y, a, h = (mean[:4] + (next_mean[:4] - mean[:4]) * fraction).tolist()
+            w = a if xywh_state else a * h
+            if w <= 0 or h <= 0:
+                continue
+            predicted.append({
+                "class": self.names.get(int(track.cls), str(int(track.cls))),
+                "confidence": float(track.score),
+                "bbox": {"x1": x - w / 2, "y1": y - h / 2, "x2": x + w / 2, "y2": y + h / 2},
+                "track_id": self._track_id(track),
+                "predicted": True
+            })
+        return predicted
+
+    def summaries(self, task_id: str, frames_dir: str) -> List[Dict[str, Any]]:
+        """写出每个跟踪目标的关键帧并返回按首次出现时间排序的汇总"""
+        results = []
+        for summary in sorted(self.tracks.values(), key=lambda s: (s.first_frame, s.track_id)):
+            keyframe_url = None
+            if summary.keyframe is not None:
+                filename = f"track_{summary.track_id}.jpg"
+                with open(os.path.join(frames_dir, filename), "wb") as f:
+                    f.write(summary.keyframe)
+                keyframe_url = f"/api/static/videos/{task_id}/{filename}"
+            results.append(summary.to_dict(keyframe_url))
+        return results
+
+    @staticmethod
+    def unique_counts(summaries: List[Dict[str, Any]]) -> Dict[str, int]:
+        """按投票类别统计不重复的目标数量"""
+        return dict(Counter(summary["class"] for summary in summaries))
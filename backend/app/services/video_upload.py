@@ -0,0 +1,87 @@
+from typing import AsyncIterator, List
+from fastapi import Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# 请求体中除文件内容以外的部分（分隔符、part 头、其他表单字段）允许的最大字节数
+MULTIPART_OVERHEAD = 64 * 1024
+
+def upload_too_large(max_bytes: int) -> ValueError:
+    return ValueError(f"视频文件过大，请限制在{max_bytes // (1024 * 1024)}MB以内")
+
+class MultipartFileReader:
+    """
+    用 python-multipart 的流式解析器逐块解析请求体，只取出指定字段的文件内容。
+    与 UploadFile 不同，文件内容不会先写入临时文件。
+    """
+    def __init__(self, content_type: str, field: str):
+        ctype, params = parse_options_header(content_type)
+        if ctype != b"multipart/form-data" or b"boundary" not in params:
+            raise ValueError("请以 multipart/form-data 格式上传视频文件")
+        self.field = field.encode()
+        self.found = False
+        self._current = False  # 当前 part 是否为要读取的文件字段
+        self._header_field = b""
+        self._header_value = b""
+        self._pieces: List[bytes] = []
+        self._parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_part_data": self._on_part_data,
+        })
+
+    def _on_part_begin(self):
+        self._current = False
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        if self._header_field.lower() == b"content-disposition" and not self.found:
+            _, options = parse_options_header(self._header_value)
+            if options.get(b"name") == self.field and b"filename" in options:
+                self._current = self.found = True
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._current:
+            self._pieces.append(bytes(data[start:end]))
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """解析一块请求体，返回其中属于文件字段的数据"""
+        self._parser.write(chunk)
+        pieces, self._pieces = self._pieces, []
+        return pieces
+
+    def finalize(self):
+        self._parser.finalize()
+
+async def iter_upload(request: Request, field: str, max_bytes: int) -> AsyncIterator[bytes]:
+    """
+    边接收请求体边产出上传文件的内容。Content-Length 超出限制时在读取请求体之前拒绝，
+    分块传输时按已接收的字节数限制。格式错误、缺少文件字段或超出限制时抛出 ValueError。
+    """
+    max_body = max_bytes + MULTIPART_OVERHEAD
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_body:
+        raise upload_too_large(max_bytes)
+    reader = MultipartFileReader(request.headers.get("content-type", ""), field)
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_body:
+            raise upload_too_large(max_bytes)
+        for piece in reader.feed(chunk):
+            yield piece
+    reader.finalize()
+    if not reader.found:
+        raise ValueError(f"缺少上传文件字段: {field}")
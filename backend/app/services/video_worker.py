@@ -0,0 +1,233 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import uuid
+from typing import Optional, Set
+from redis.asyncio import Redis
+from app.core.redis import InstrumentedRedis
+from app.core.config import get_settings
+from app.services.video_segments import parse_job_id
+from app.services.video import (
+    VideoProcessor, VideoTaskStatus, VIDEO_TASKS_QUEUE, VIDEO_TASKS_PROCESSING, task_lease_key
+)
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# 条件重新入队：LREM 确实移除了任务才放回等待队列，并按需把视频任务状态改为等待中
+REQUEUE_SCRIPT = """
+if redis.call('LREM', KEYS[1], 1, ARGV[1]) == 1 then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+    redis.call('DEL', KEYS[3])
+    if ARGV[2] ~= '' then
+        redis.call('HSET', KEYS[4], 'status', ARGV[2])
+    end
+    return 1
+end
+return 0
+"""
+
+class VideoWorker:
+    """
+    视频任务工作进程：从Redis队列可靠地取出任务并处理。
+
+    - 使用 BLMOVE 将任务从等待队列原子地移动到处理中队列，进程崩溃时任务不会丢失
+    - 每个处理中的任务持有一个带过期时间的租约（可见性超时），处理期间定期续租
+    - 回收协程发现租约过期的任务后重新入队，超过最大尝试次数则标记为失败
+    - 收到 SIGTERM/SIGINT 时停止取新任务，等待当前任务完成，超时未完成的任务重新入队
+    - 长视频被拆分为分段任务和合并任务（ID形如 {任务ID}#seg0、{任务ID}#merge），与整段任务使用同一队列
+    """
+    def __init__(
+        self,
+        processor: VideoProcessor,
+        concurrency: int = 2,
+        visibility_timeout: int = 300,
+        max_attempts: int = 3,
+        shutdown_timeout: int = 60,
+        poll_timeout: int = 5
+    ):
+        self.processor = processor
+        self.concurrency = max(1, concurrency)
+        self.visibility_timeout = max(10, visibility_timeout)
+        self.max_attempts = max(1, max_attempts)
+        self.shutdown_timeout = shutdown_timeout
+        self.poll_timeout = poll_timeout
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._stopping = asyncio.Event()
+        # 上一轮回收扫描时没有租约的任务，连续两轮都没有租约才重新入队
+        self._suspects: Set[str] = set()
+        self._redis: Optional[Redis] = None
+
+    async def get_redis(self) -> Redis:
+        """获取Redis连接（与处理器使用不同的客户端，阻塞读取不会占用处理器的连接）"""
+        if self._redis is None:
+            self._redis = InstrumentedRedis.from_url(settings.redis_url)
+        return self._redis
+
+    @staticmethod
+    def _lease_key(task_id: str) -> str:
+        return task_lease_key(task_id)
+
+    def stop(self):
+        """请求优雅停止"""
+        if not self._stopping.is_set():
+            logger.info("视频工作进程 %s 正在停止，不再接收新任务", self.worker_id)
+            self._stopping.set()
+
+    def install_signal_handlers(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:
+                # Windows 不支持 add_signal_handler
+                signal.signal(sig, lambda *_: self.stop())
+
+    async def run(self):
+        """启动消费协程和回收协程，直到收到停止信号"""
+        logger.info("视频工作进程 %s 启动，并发数: %d", self.worker_id, self.concurrency)
+        consumers = [asyncio.create_task(self._consume()) for _ in range(self.concurrency)]
+        reaper = asyncio.create_task(self._reap_loop())
+
+        await self._stopping.wait()
+
+        # 等待正在处理的任务完成
+        _, pending = await asyncio.wait(consumers, timeout=self.shutdown_timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        reaper.cancel()
+        await asyncio.gather(reaper, return_exceptions=True)
+        logger.info("视频工作进程 %s 已停止", self.worker_id)
+
+    async def _consume(self):
+        """消费循环：每次取一个任务处理"""
+        redis = await self.get_redis()
+        while not self._stopping.is_set():
+            try:
+                task_id = await redis.blmove(
+                    VIDEO_TASKS_QUEUE, VIDEO_TASKS_PROCESSING, self.poll_timeout, "RIGHT", "LEFT"
+                )
+            except Exception as e:
+                logger.error("读取视频任务队列失败: %s", e)
+                await asyncio.sleep(1)
+                continue
+            if task_id is None:
+                continue
+            task_id = task_id.decode() if isinstance(task_id, bytes) else task_id
+            await self._handle(task_id)
+
+    async def _handle(self, task_id: str):
+        """持有租约处理单个任务，完成后从处理中队列移除"""
+        redis = await self.get_redis()
+        await redis.set(self._lease_key(task_id), self.worker_id, ex=self.visibility_timeout)
+        heartbeat = asyncio.create_task(self._heartbeat(task_id))
+        try:
+            if await self._begin_attempt(task_id):
+                await self.processor.process_task(task_id)
+        except asyncio.CancelledError:
+            # 优雅停止超时：把任务交还给队列，由其他工作进程继续处理
+            logger.warning("视频任务 %s 未在停止超时内完成，重新入队", task_id)
+            await self._requeue(task_id)
+            raise
+        except Exception as e:
+            logger.error("处理视频任务 %s 时出现未处理的异常: %s", task_id, e, exc_info=True)
+            if await self._retry(task_id, str(e)):
+                # 任务已交还给等待队列，可能已被其他进程取走，不能再从处理中队列移除
+                return
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.lrem(VIDEO_TASKS_PROCESSING, 1, task_id)
+            pipe.delete(self._lease_key(task_id))
+            await pipe.execute()
+
+    async def _begin_attempt(self, task_id: str) -> bool:
+        """记录尝试次数，任务不存在时返回False"""
+        return await self.processor.begin_attempt(task_id, self.worker_id) is not None
+
+    async def _retry(self, task_id: str, error: str) -> bool:
+        """处理异常的任务未超过最大尝试次数时重新入队，否则放弃整个视频任务，返回是否重新入队"""
+        attempts = await self.processor.get_job_attempts(task_id)
+        if attempts is None:
+            return False
+        if attempts >= self.max_attempts:
+            logger.error("视频任务 %s 超过最大尝试次数，标记为失败", task_id)
+            await self.processor.fail_job(task_id, error)
+            return False
+        if await self._requeue(task_id):
+            logger.warning("视频任务 %s 处理失败，已重新入队（第 %d 次尝试）", task_id, attempts)
+            return True
+        return False
+
+    async def _heartbeat(self, task_id: str):
+        """定期续租，防止长视频被误判为崩溃"""
+        redis = await self.get_redis()
+        interval = self.visibility_timeout / 3
+        delay = interval
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await redis.set(self._lease_key(task_id), self.worker_id, ex=self.visibility_timeout)
+                delay = interval
+            except Exception as e:
+                # 续租失败不能结束心跳，否则租约过期后任务会被回收并重复执行；稍后重试
+                logger.warning("视频任务 %s 续租失败: %s", task_id, e)
+                delay = min(interval, 1)
+
+    async def _requeue(self, task_id: str) -> bool:
+        """
+        把任务从处理中队列移回等待队列的队首。多个进程的回收协程可能同时发现同一个过期任务，
+        只有成功从处理中队列移除的一方才会重新入队，返回是否重新入队。
+        """
+        redis = await self.get_redis()
+        video_task_id, part = parse_job_id(task_id)
+        # 分段和合并任务不改变视频任务的状态
+        status = json.dumps(VideoTaskStatus.PENDING) if part is None else ""
+        requeued = await redis.eval(
+            REQUEUE_SCRIPT, 4,
+            VIDEO_TASKS_PROCESSING, VIDEO_TASKS_QUEUE, self._lease_key(task_id),
+            self.processor._task_key(video_task_id),
+            task_id, status
+        )
+        return bool(requeued)
+
+    async def _reap_loop(self):
+        """周期性扫描处理中队列，回收租约已过期的任务"""
+        while True:
+            try:
+                await self._reap()
+            except Exception as e:
+                logger.error("回收视频任务失败: %s", e)
+            await asyncio.sleep(self.visibility_timeout / 3)
+
+    async def _reap(self):
+        redis = await self.get_redis()
+        processing = [
+            item.decode() if isinstance(item, bytes) else item
+            for item in await redis.lrange(VIDEO_TASKS_PROCESSING, 0, -1)
+        ]
+        suspects = set()
+        for task_id in processing:
+            if await redis.exists(self._lease_key(task_id)):
+                continue
+            if task_id not in self._suspects:
+                suspects.add(task_id)
+                continue
+
+            attempts = await self.processor.get_job_attempts(task_id)
+            if attempts is None:
+                await redis.lrem(VIDEO_TASKS_PROCESSING, 1, task_id)
+                continue
+            if attempts >= self.max_attempts:
+                logger.error("视频任务 %s 超过最大尝试次数，标记为失败", task_id)
+                await self.processor.fail_job(task_id, "处理进程多次异常退出，任务已放弃")
+                await redis.lrem(VIDEO_TASKS_PROCESSING, 1, task_id)
+            elif await self._requeue(task_id):
+                logger.warning("视频任务 %s 的租约已过期，已重新入队", task_id)
+        self._suspects = suspects
@@ -0,0 +1,67 @@
+"""
+批量推理基准测试：对比逐张推理与按原始尺寸分组的批量推理耗时。
+
+用法:
+    python benchmark_batch.py <图片目录> [--repeat 3] [--batch 8]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'ultralytics'))
+
+from app.services.detector import detector
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+def load_images(folder: str):
+    """读取目录下的所有图片并解码为模型输入"""
+    images = []
+    for name in sorted(os.listdir(folder)):
+        if os.path.splitext(name)[1].lower() not in IMAGE_EXTS:
+            continue
+        with open(os.path.join(folder, name), "rb") as f:
+            try:
+                _, img_rgb = detector.decode_for_inference(f.read())
+                images.append(img_rgb)
+            except ValueError:
+                print(f"跳过无法解码的文件: {name}")
+    return images
+
+def timed(fn, repeat: int) -> float:
+    """多次运行取最短耗时（秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="逐张推理与批量推理的耗时对比")
+    parser.add_argument("folder", help="样本图片目录")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数")
+    parser.add_argument("--batch", type=int, default=8, help="最大批次大小")
+    args = parser.parse_args()
+
+    images = load_images(args.folder)
+    if not images:
+        print("目录中没有可用的图片")
+        return
+
+    groups = {img.shape for img in images}
+    print(f"图片数量: {len(images)}，按原始尺寸分组: {len(groups)}")
+
+    # 预热，避免首次推理的初始化开销影响结果
+    detector.predict_batch(images[:1])
+
+    per_image = timed(lambda: [detector.predict_batch([img]) for img in images], args.repeat)
+    batched = timed(lambda: detector.predict_grouped(images, args.batch), args.repeat)
+
+    print(f"逐张推理: {per_image:.3f}s ({per_image / len(images) * 1000:.1f} ms/张)")
+    print(f"批量推理: {batched:.3f}s ({batched / len(images) * 1000:.1f} ms/张, batch={args.batch})")
+    print(f"加速比: {per_image / batched:.2f}x" if batched > 0 else "加速比: N/A")
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,7 @@ from app.models.base import Base
 from app.models.user import User  # 显式导入User模型
 from app.models.history import History  # 显式导入History模型
 from app.models.detection import Detection  # 显式导入Detection模型
+from app.models.stats import DetectionDailyStats  # 显式导入检测汇总模型
 from app.core.database import engine, DATABASE_URL
 
 # 覆盖数据库连接
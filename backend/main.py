@@ -5,7 +5,15 @@ from app.core.config import get_settings
 from app.api.router import router  # 使用新的路由聚合
 from app.routers import history  # 保留原有路由
 from app.api import video  # 添加这一行导入视频模块
+from app.api.metrics import prometheus_metrics
+from app.core.http_metrics import HTTPMetricsMiddleware
+from app.services.inference import inference_engine
+from app.services.ai_analysis import ai_analysis_service
+from app.services.inference_pool import inference_pool
+from app.services.video import video_processor
+from app.services.video_worker import VideoWorker
 import uvicorn
+import asyncio
 import logging
 import sys
 import os
@@ -27,9 +35,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
     allow_credentials=True,
-    expose_headers=["Content-Disposition"],
+    expose_headers=["Content-Disposition", "X-Next-Cursor"],
 )
 
+# 按路由记录请求耗时
+app.add_middleware(HTTPMetricsMiddleware)
+
 # 确保静态文件目录存在
 os.makedirs(os.path.join("app", "static"), exist_ok=True)
 os.makedirs(os.path.join("app", "static", "videos"), exist_ok=True)
@@ -48,6 +59,34 @@ app.include_router(
     tags=["video"]
 )
 
+# Prometheus 指标
+app.add_api_route("/metrics", prometheus_metrics, methods=["GET"], include_in_schema=False)
+
+# 本地开发时可在API进程内运行视频工作协程，生产环境请单独运行 video_worker.py
+embedded_video_worker = None
+
+@app.on_event("startup")
+async def start_embedded_video_worker():
+    global embedded_video_worker
+    if settings.video_embedded_workers > 0:
+        embedded_video_worker = VideoWorker(
+            video_processor,
+            concurrency=settings.video_embedded_workers,
+            visibility_timeout=settings.video_visibility_timeout,
+            max_attempts=settings.video_max_attempts,
+            shutdown_timeout=settings.video_shutdown_timeout,
+        )
+        app.state.video_worker_task = asyncio.create_task(embedded_video_worker.run())
+
+@app.on_event("shutdown")
+async def shutdown_inference_engine():
+    if embedded_video_worker is not None:
+        embedded_video_worker.stop()
+        await app.state.video_worker_task
+    await inference_engine.close()
+    inference_pool.close()
+    await ai_analysis_service.close()
+
 @app.get("/")
 async def health_check():
     return {"status": "backend is running"}
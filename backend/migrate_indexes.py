@@ -0,0 +1,43 @@
+import argparse
+import asyncio
+import logging
+from sqlalchemy import text
+
+# 设置日志记录
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+from app.core.database import engine
+
+# 新版本模型中新增的索引：(索引名, 建索引语句)。create_all 不会给已存在的表补建索引
+INDEXES = [
+    # 历史记录列表的 (timestamp DESC NULLS LAST, id DESC) 游标分页
+    ("ix_history_timestamp_desc_id",
+     "CREATE INDEX IF NOT EXISTS ix_history_timestamp_desc_id ON history (timestamp DESC NULLS LAST, id DESC)"),
+    ("ix_history_type_timestamp_desc_id",
+     "CREATE INDEX IF NOT EXISTS ix_history_type_timestamp_desc_id "
+     "ON history (type, timestamp DESC NULLS LAST, id DESC)"),
+    # 统计接口按检测时间范围筛选
+    ("ix_detections_created_at",
+     "CREATE INDEX IF NOT EXISTS ix_detections_created_at ON detections (created_at)"),
+]
+
+# 排序与查询不一致、已被上面的索引取代的旧索引
+OBSOLETE_INDEXES = ["ix_history_timestamp_id", "ix_history_type_timestamp_id"]
+
+async def migrate_indexes():
+    """给已有数据库补建索引，已存在的索引跳过，可以重复运行"""
+    for name, ddl in INDEXES:
+        # 每个索引单独提交，中断后重新运行只会创建剩余的索引
+        async with engine.begin() as conn:
+            logger.info(f"正在创建索引: {name}")
+            await conn.execute(text(ddl))
+    async with engine.begin() as conn:
+        for name in OBSOLETE_INDEXES:
+            await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    logger.info("索引迁移完成")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="给已有数据库补建新版本模型中的索引")
+    parser.parse_args()
+    asyncio.run(migrate_indexes())
@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+import logging
+from sqlalchemy import text
+
+# 设置日志记录
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+from app.core.database import engine
+from app.services.thumbnails import thumbnail_store
+
+async def _legacy_column_exists(conn) -> bool:
+    result = await conn.execute(text(
+        "SELECT EXISTS (SELECT FROM information_schema.columns "
+        "WHERE table_name = 'history' AND column_name = 'thumbnail')"
+    ))
+    return bool(result.scalar())
+
+def _convert(value: str):
+    """把旧的 base64 缩略图写入存储后端，无法解析的数据丢弃"""
+    try:
+        return thumbnail_store.store(value)
+    except ValueError as e:
+        logger.warning(f"跳过无效缩略图: {str(e)}")
+        return None
+
+async def migrate_thumbnails(batch_size: int, drop_column: bool):
+    """把 history.thumbnail 中的 base64 缩略图迁移到缩略图存储，只在 thumbnail_key 中保存键"""
+    async with engine.begin() as conn:
+        await conn.execute(text("ALTER TABLE history ADD COLUMN IF NOT EXISTS thumbnail_key VARCHAR"))
+        if not await _legacy_column_exists(conn):
+            logger.info("history.thumbnail 列不存在，无需迁移")
+            return
+
+    migrated = 0
+    last_id = ""
+    while True:
+        # 每批单独提交，按主键推进，可以中断后重新运行
+        async with engine.begin() as conn:
+            rows = (await conn.execute(text("""
+                SELECT id, thumbnail FROM history
+                WHERE thumbnail IS NOT NULL AND id > :last_id
+                ORDER BY id LIMIT :limit
+            """), {"last_id": last_id, "limit": batch_size})).all()
+            if not rows:
+                break
+            updates = []
+            for history_id, thumbnail in rows:
+                key = await asyncio.to_thread(_convert, thumbnail)
+                updates.append({"id": history_id, "key": key})
+            await conn.execute(text(
+                "UPDATE history SET thumbnail_key = :key, thumbnail = NULL WHERE id = :id"
+            ), updates)
+            last_id = rows[-1][0]
+            migrated += len(rows)
+            logger.info(f"已迁移 {migrated} 条缩略图")
+
+    if drop_column:
+        async with engine.begin() as conn:
+            await conn.execute(text("ALTER TABLE history DROP COLUMN thumbnail"))
+        logger.info("已删除 history.thumbnail 列，可执行 VACUUM FULL history 回收磁盘空间")
+    logger.info(f"缩略图迁移完成，共 {migrated} 条")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把历史记录中的 base64 缩略图迁移到缩略图存储")
+    parser.add_argument("--batch-size", type=int, default=200, help="每批迁移的记录数")
+    parser.add_argument("--keep-column", action="store_true", help="迁移后保留旧的 thumbnail 列")
+    args = parser.parse_args()
+    asyncio.run(migrate_thumbnails(args.batch_size, not args.keep_column))
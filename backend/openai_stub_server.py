@@ -0,0 +1,97 @@
+"""
+本地 OpenAI 兼容桩服务，用于在不访问 DeepSeek 的情况下测试 AI 分析接口。
+
+    python openai_stub_server.py --port 9000 --delay 0.05
+    AI_BASE_URL=http://localhost:9000 DEEPSEEK_API_KEY=stub uvicorn main:app
+
+GET /stats 返回收到的补全请求数，可用于验证相同请求的合并和缓存。
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+app = FastAPI(title="OpenAI Stub")
+state = {"requests": 0, "delay": 0.05}
+
+REASONING = "先看总检测数和主要害虫类型，再结合环比变化判断趋势。"
+REPORT = """## 总体情况概述
+本周期内共检测到多种害虫，整体发生程度中等。
+
+## 主要害虫分析
+出现最多的害虫集中在少数几个类别，需要重点关注。
+
+## 发展趋势分析
+与上一周期相比，检测数量有所变化，建议持续监测。
+
+## 防治建议
+- 加强田间巡查
+- 优先采用物理和生物防治措施
+
+## 风险预警
+暂无需要立即处理的高风险情况。
+"""
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+async def _stream(completion_id: str, model: str):
+    yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+    for piece in REASONING.split("，"):
+        await asyncio.sleep(state["delay"])
+        yield _chunk(completion_id, model, {"reasoning_content": piece})
+    for line in REPORT.splitlines(keepends=True):
+        await asyncio.sleep(state["delay"])
+        yield _chunk(completion_id, model, {"content": line})
+    yield _chunk(completion_id, model, {}, finish_reason="stop")
+    yield "data: [DONE]\n\n"
+
+@app.post("/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    state["requests"] += 1
+    model = body.get("model", "stub")
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    if body.get("stream"):
+        return StreamingResponse(_stream(completion_id, model), media_type="text/event-stream")
+
+    await asyncio.sleep(state["delay"] * 10)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": REPORT, "reasoning_content": REASONING},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    }
+
+@app.get("/stats")
+async def stats():
+    return {"requests": state["requests"]}
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--delay", type=float, default=0.05, help="每个流式片段之间的延迟（秒）")
+    args = parser.parse_args()
+    state["delay"] = args.delay
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,37 @@
+import argparse
+import asyncio
+import logging
+
+# 设置日志记录
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+from app.core.database import async_session_maker, engine
+from app.models.stats import DetectionDailyStats
+from app.services.rollup import ROLLUP_SOURCES, rebuild
+from app.services.statistics import statistics_service
+
+async def rebuild_stats(sources):
+    """从原始记录重建检测汇总表（用于首次上线或数据修复）"""
+    # 已有数据库升级时只新建汇总表，不影响其他表（create_tables.py 会删除所有表）
+    async with engine.begin() as conn:
+        await conn.run_sync(lambda sync_conn: DetectionDailyStats.__table__.create(sync_conn, checkfirst=True))
+    async with async_session_maker() as db:
+        for source in sources:
+            logger.info(f"正在重建汇总数据: {source}")
+            await rebuild(db, source)
+        await db.commit()
+    await statistics_service.invalidate()
+    logger.info("检测汇总表重建完成")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="重建 detection_daily_stats 汇总表")
+    parser.add_argument(
+        "--source",
+        choices=[*ROLLUP_SOURCES, "all"],
+        default="all",
+        help="要重建的数据来源（视频汇总没有原始记录，无法重建）"
+    )
+    args = parser.parse_args()
+    sources = list(ROLLUP_SOURCES) if args.source == "all" else [args.source]
+    asyncio.run(rebuild_stats(sources))
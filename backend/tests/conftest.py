@@ -0,0 +1,14 @@
+import os
+import sys
+import types
+
+# 测试从 backend 目录导入 app 和本地修改的 ultralytics
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.services.detector 在导入时加载模型权重，跟踪相关的测试只需要类别表和JPEG编码
+_detector_module = types.ModuleType("app.services.detector")
+_detector_module.detector = types.SimpleNamespace(
+    model=types.SimpleNamespace(names={0: "pest_a", 1: "pest_b"}),
+    encode_jpeg=lambda image, quality=95: b"jpeg"
+)
+sys.modules.setdefault("app.services.detector", _detector_module)
@@ -0,0 +1,59 @@
+import numpy as np
+
+from app.services.video_segments import TRACK_ID_STRIDE, stitch_tracks
+from app.services.video_tracking import VideoTracker
+
+FRAME = np.zeros((480, 640, 3), dtype=np.uint8)
+
+def _pred(x1, y1, cls="pest_a"):
+    return {"class": cls, "confidence": 0.9, "bbox": {"x1": x1, "y1": y1, "x2": x1 + 40, "y2": y1 + 40}}
+
+def _step(tracker, frame_idx, predictions):
+    return tracker.process([(frame_idx, FRAME)], [frame_idx * 40], [predictions])[0]
+
+def test_interleaved_trackers_keep_distinct_tracks():
+    """新建跟踪器会清零 ultralytics 的全局 track_id 计数器，已有跟踪器的目标不能因此被合并"""
+    first = VideoTracker("bytetrack", frame_rate=25)
+    _step(first, 0, [_pred(50, 50)])
+
+    # 第二个跟踪器（例如同一进程中的另一个任务或分段）开始后，第一个跟踪器出现新目标
+    second = VideoTracker("bytetrack", frame_rate=25, id_offset=100000)
+    for frame_idx in range(1, 6):
+        _step(first, frame_idx, [_pred(50, 50), _pred(400, 300)])
+        _step(second, frame_idx, [_pred(200, 200, "pest_b"), _pred(500, 100, "pest_b")])
+
+    first_ids = sorted(first.tracks)
+    second_ids = sorted(second.tracks)
+    assert first_ids == [1, 2]
+    assert second_ids == [100001, 100002]
+    assert all(first.tracks[track_id].votes == {"pest_a": first.tracks[track_id].hits} for track_id in first_ids)
+    summaries = [{"class": summary.voted_class} for summary in first.tracks.values()]
+    assert VideoTracker.unique_counts(summaries) == {"pest_a": 2}
+
+def test_track_id_is_stable_across_frames():
+    tracker = VideoTracker("bytetrack", frame_rate=25)
+    ids = set()
+    for frame_idx in range(5):
+        for prediction in _step(tracker, frame_idx, [_pred(100 + frame_idx, 100)]):
+            ids.add(prediction["track_id"])
+    assert ids == {1}
+
+def test_interleaved_segments_stitch_only_the_same_target(tmp_path):
+    """同一进程中交替处理的两个分段：跨边界的同一目标被拼接，其他目标保持独立"""
+    segments = [
+        VideoTracker("bytetrack", frame_rate=25, id_offset=index * TRACK_ID_STRIDE) for index in range(2)
+    ]
+    for step in range(5):
+        _step(segments[0], step, [_pred(50, 50)] + ([_pred(400, 300)] if step else []))
+        _step(segments[1], 5 + step, [_pred(50, 50), _pred(200, 200, "pest_b")])
+
+    segment_tracks = [tracker.summaries("task", str(tmp_path)) for tracker in segments]
+    assert [len(tracks) for tracks in segment_tracks] == [2, 2]
+    assert len({track["track_id"] for tracks in segment_tracks for track in tracks}) == 4
+
+    stitched = stitch_tracks(segment_tracks, [5 * 40])
+    assert len(stitched) == 3
+    assert len({track["track_id"] for track in stitched}) == 3
+    joined = [track for track in stitched if "merged_track_ids" in track]
+    assert len(joined) == 1
+    assert joined[0]["first_frame"] == 0 and joined[0]["last_frame"] == 9
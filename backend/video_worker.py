@@ -0,0 +1,45 @@
+"""
+视频处理工作进程入口。
+
+API进程只负责把视频任务放入Redis队列，本进程负责消费并处理，可独立于API副本横向扩展。
+
+用法:
+    python video_worker.py [--concurrency 2]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'ultralytics'))
+
+from app.core.config import get_settings
+from app.services.video import video_processor
+from app.services.video_worker import VideoWorker
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+)
+
+async def main(concurrency: int):
+    settings = get_settings()
+    worker = VideoWorker(
+        video_processor,
+        concurrency=concurrency,
+        visibility_timeout=settings.video_visibility_timeout,
+        max_attempts=settings.video_max_attempts,
+        shutdown_timeout=settings.video_shutdown_timeout,
+    )
+    worker.install_signal_handlers()
+    await worker.run()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="YoloPest 视频处理工作进程")
+    parser.add_argument(
+        "--concurrency", type=int, default=get_settings().video_worker_concurrency,
+        help="同时处理的视频任务数量"
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency))